@@ -11,7 +11,13 @@ import os
 # Load environment variables
 load_dotenv()
 
-def create_app():
+def create_app(warm_up: str = None):
+    """
+    建立 Flask 應用
+    
+    Args:
+        warm_up: 嵌入模型預熱模式 background / sync / off；None 時讀取 EMBEDDING_WARMUP（預設 background）
+    """
     app = Flask(__name__)
     
     # Configure CORS
@@ -37,12 +43,36 @@ def create_app():
     app.register_blueprint(documents_bp, url_prefix='/api/documents')
     app.register_blueprint(study_tools_bp, url_prefix='/api/study')
     
+    # 預熱嵌入模型，避免部署後第一位使用者等待模型載入
+    from services import start_warm_up
+    start_warm_up(warm_up)
+    
     @app.route('/api/health')
     def health_check():
         return {'status': 'healthy', 'message': 'Study Buddy API is running!'}
     
+    @app.route('/api/ready')
+    def readiness_check():
+        """就緒探針：模型常駐記憶體後才返回 200，供負載平衡器判斷是否導入流量"""
+        from services import get_readiness
+        readiness = get_readiness()
+        return readiness, 200 if readiness['ready'] else 503
+    
+    @app.route('/api/stats')
+    def service_stats():
+        from services import get_rag_service, get_generation_cache, get_llm_executor, get_embedding_writer
+        from services.rag_service import is_rag_service_loaded
+        # 統計端點不觸發模型載入（監控輪詢可能早於預熱完成）
+        return {
+            **(get_rag_service().get_stats() if is_rag_service_loaded() else {'rag_service': 'not loaded'}),
+            'generation_cache': get_generation_cache().get_stats(),
+            'llm': get_llm_executor().get_stats() if os.getenv('GROQ_API_KEY') else None,
+            'embedding_writer': get_embedding_writer().get_stats()
+        }
+    
     return app
 
 if __name__ == '__main__':
-    app = create_app()
+    # debug 模式的 reloader 監控行程不處理請求，不需要載入模型
+    app = create_app(warm_up=None if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' else 'off')
     app.run(debug=True, port=5001)
@@ -0,0 +1,81 @@
+"""
+區塊切分效能：逐區塊 decode vs 向量化位元組切片
+兩種實作的輸出逐一比對，確認內容相同後再比較耗時
+
+用法:
+    python benchmarks/chunking.py --tokens 1000000
+    python benchmarks/chunking.py --text 講義.txt --repeat 5
+"""
+
+import sys
+import os
+import time
+import argparse
+
+# 添加 backend 目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.document_processor import DocumentProcessor
+
+
+def build_text(processor: DocumentProcessor, path: str, num_tokens: int) -> str:
+    """重複樣本文字直到約 num_tokens 個 token（中英混合，包含多位元組字元）"""
+    if path:
+        sample = processor.extract_text(path)
+    else:
+        sample = ("機器學習是人工智慧的一個分支，研究如何讓電腦從資料中學習。"
+                  "Gradient descent iteratively updates parameters to minimize the loss function. "
+                  "第二章介紹線性迴歸、邏輯迴歸與正規化方法；習題 2.3 請推導最小平方解。\n\n")
+    sample_tokens = max(processor.count_tokens(sample), 1)
+    return sample * (num_tokens // sample_tokens + 1)
+
+
+def timed(fn, repeat: int):
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return result, float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunker throughput: per-chunk decode vs vectorized byte offsets')
+    parser.add_argument('--text', help='樣本文件（PDF/DOCX/TXT），未指定時使用內建中英文段落')
+    parser.add_argument('--tokens', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    processor = DocumentProcessor()
+    text = build_text(processor, args.text, args.tokens)
+    processor.split_text_into_chunks(text[:1000])  # 建立 token 位元組長度表（每個行程一次）
+
+    def legacy():
+        tokens = processor.tokenize(text)
+        return processor.split_tokens_into_chunks(tokens), processor.count_tokens(text)
+
+    def vectorized():
+        tokens = processor.encode_array(text)
+        return processor.split_text_into_chunks(text, tokens), len(tokens)
+
+    (legacy_chunks, legacy_total), legacy_ms = timed(legacy, args.repeat)
+    (fast_chunks, fast_total), fast_ms = timed(vectorized, args.repeat)
+
+    assert legacy_total == fast_total, (legacy_total, fast_total)
+    assert len(legacy_chunks) == len(fast_chunks)
+    mismatches = sum(a['content'] != b['content'] for a, b in zip(legacy_chunks, fast_chunks))
+
+    print(f"token 數: {fast_total:,}  區塊數: {len(fast_chunks):,}  內容不一致: {mismatches}")
+    print()
+    header = f"{'chunker':<14}{'median ms':>12}{'Mtokens/s':>12}{'speedup':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, ms in (('legacy', legacy_ms), ('vectorized', fast_ms)):
+        print(f"{name:<14}{ms:>12.1f}{fast_total / ms / 1000:>12.2f}{legacy_ms / ms:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
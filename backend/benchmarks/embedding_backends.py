@@ -0,0 +1,91 @@
+"""
+嵌入推論後端比較
+以 PyTorch fp32 為基準，比較各後端的編碼吞吐量（區塊/秒）與檢索一致性：
+- cosine: 同一段文字在兩個後端的向量餘弦相似度
+- agreement@k: 以相同查詢檢索時，前 k 名與基準結果的重疊比例
+
+用法:
+    python benchmarks/embedding_backends.py --text 講義.txt
+    python benchmarks/embedding_backends.py --backends torch onnx onnx-int8 --num-chunks 256
+"""
+
+import sys
+import os
+import time
+import argparse
+
+# 添加 backend 目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from services.embedding_backends import create_embedding_backend, BACKENDS
+from services.document_processor import DocumentProcessor
+
+
+def load_chunks(path: str, num_chunks: int) -> list:
+    """將文字檔依系統的切片方式切成區塊；未提供時產生合成段落"""
+    if path:
+        processor = DocumentProcessor()
+        chunks = [chunk["content"] for chunk in processor.split_into_chunks(processor.extract_text(path))]
+        return (chunks * (num_chunks // max(len(chunks), 1) + 1))[:num_chunks]
+
+    rng = np.random.default_rng(0)
+    topics = ['機器學習', '線性代數', '細胞生物學', '經濟學原理', '有機化學', '中國歷史', '資料結構', '統計推論']
+    sentences = ['{}是本章的核心主題。', '本節介紹{}的基本定義與常見例子。', '理解{}有助於解決實際問題。',
+                 '考試常見的{}題型包含計算與概念說明。', '{}與其他領域的關係也值得注意。']
+    return [
+        ''.join(sentences[j % len(sentences)].format(topics[rng.integers(len(topics))]) for j in range(60))
+        for _ in range(num_chunks)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embedding backend throughput and retrieval agreement')
+    parser.add_argument('--model', default='shibing624/text2vec-base-chinese', help='不含後端前綴的模型名稱')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--text', help='用於切片的文字檔（PDF/DOCX/TXT）')
+    parser.add_argument('--num-chunks', type=int, default=128)
+    parser.add_argument('--num-queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.text, args.num_chunks)
+    # 查詢：取區塊開頭的一句，模擬與內容相關的問題
+    rng = np.random.default_rng(1)
+    queries = [chunks[i][:30] for i in rng.choice(len(chunks), min(args.num_queries, len(chunks)), replace=False)]
+
+    results = {}
+    for backend in ['torch'] + [b for b in args.backends if b != 'torch']:
+        spec = args.model if backend == 'torch' else f'{backend}:{args.model}'
+        model = create_embedding_backend(spec)
+        model.encode(chunks[:8])  # 預熱
+
+        started = time.perf_counter()
+        chunk_vectors = model.encode(chunks)
+        elapsed = time.perf_counter() - started
+
+        results[backend] = {
+            'chunks_per_sec': len(chunks) / elapsed,
+            'chunks': np.asarray(chunk_vectors, dtype=np.float32),
+            'queries': np.asarray(model.encode(queries), dtype=np.float32)
+        }
+
+    baseline = results['torch']
+    truth = np.argsort(-baseline['queries'] @ baseline['chunks'].T, axis=1)[:, :args.top_k]
+
+    print(f"模型: {args.model}  區塊數: {len(chunks)}  查詢數: {len(queries)}")
+    print()
+    header = f"{'backend':<12}{'chunks/s':>10}{'speedup':>9}{'cosine':>9}{f'agree@{args.top_k}':>11}"
+    print(header)
+    print('-' * len(header))
+    for backend, row in results.items():
+        cosine = float(np.mean(np.sum(row['chunks'] * baseline['chunks'], axis=1)))
+        ranked = np.argsort(-row['queries'] @ row['chunks'].T, axis=1)[:, :args.top_k]
+        agreement = np.mean([len(set(a) & set(b)) / args.top_k for a, b in zip(ranked, truth)])
+        print(f"{backend:<12}{row['chunks_per_sec']:>10.1f}{row['chunks_per_sec'] / baseline['chunks_per_sec']:>9.2f}"
+              f"{cosine:>9.4f}{agreement:>11.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+向量索引召回率/延遲報告
+比較 Flat / SQ8 / fp16 / HNSW / IVF-Flat / IVF-PQ（含全精度重新排序）與精確 Flat 基準，
+協助為每個部署選擇參數
+
+用法:
+    python benchmarks/index_recall.py --num-vectors 100000
+    python benchmarks/index_recall.py --embeddings chunks.npy --top-k 10
+"""
+
+import sys
+import os
+import argparse
+
+# 添加 backend 目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import faiss
+
+from services.vector_index import evaluate_index_types
+
+
+def synthetic_embeddings(num_vectors: int, dim: int, num_clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """產生有聚類結構的正規化向量（接近真實語義嵌入的分佈）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+    assignments = rng.integers(0, num_clusters, num_vectors)
+    vectors = centers[assignments] + 0.5 * rng.standard_normal((num_vectors, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vector index recall/latency report')
+    parser.add_argument('--embeddings', help='.npy 檔案（N x dim float32），未指定時使用合成資料')
+    parser.add_argument('--num-vectors', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        embeddings = np.load(args.embeddings).astype(np.float32)
+        faiss.normalize_L2(embeddings)
+    else:
+        embeddings = synthetic_embeddings(args.num_vectors, args.dim)
+
+    # 查詢：資料點加上擾動，模擬與文件相近但不相同的問題
+    rng = np.random.default_rng(1)
+    queries = embeddings[rng.choice(len(embeddings), args.num_queries, replace=False)].copy()
+    queries += 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+
+    print(f"向量數: {len(embeddings):,}  維度: {embeddings.shape[1]}  查詢數: {len(queries)}")
+    print()
+
+    report = evaluate_index_types(embeddings, queries, top_k=args.top_k)
+    recall_key = f'recall@{args.top_k}'
+
+    header = f"{'type':<10}{'params':<28}{recall_key:>12}{'mean ms':>10}{'p95 ms':>10}{'build ms':>11}{'MB':>9}"
+    print(header)
+    print('-' * len(header))
+    for row in report:
+        params = ', '.join(f"{k}={v}" for k, v in row.items() if k in ('ef_search', 'nprobe', 'rerank'))
+        print(f"{row['type']:<10}{params:<28}{row[recall_key]:>12.4f}{row['mean_latency_ms']:>10.3f}"
+              f"{row['p95_latency_ms']:>10.3f}{row['build_ms']:>11.1f}{row['index_bytes'] / 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+查詢編碼吞吐量：逐筆編碼 vs 微批次
+模擬多個並行請求各自編碼一個查詢，比較每秒可處理的查詢數與延遲
+
+用法:
+    python benchmarks/query_batching.py --threads 16 --queries 800
+    python benchmarks/query_batching.py --max-batch-size 64 --max-wait-ms 10
+"""
+
+import sys
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加 backend 目錄到路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from services.embedding_batcher import EmbeddingBatcher
+
+
+def run(encode, queries, threads: int) -> dict:
+    latencies = []
+
+    def one(query):
+        started = time.perf_counter()
+        encode([query])
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, queries))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'qps': len(queries) / elapsed,
+        'mean_ms': float(np.mean(latencies)),
+        'p95_ms': float(np.percentile(latencies, 95))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query embedding throughput with and without micro-batching')
+    parser.add_argument('--model', default=os.getenv("EMBEDDING_MODEL", "shibing624/text2vec-base-chinese"))
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=800)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model)
+
+    def encode(texts):
+        return model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+
+    queries = [f"第 {i} 個問題：什麼是機器學習中的過擬合？" for i in range(args.queries)]
+    encode(queries[:8])  # 預熱
+
+    batcher = EmbeddingBatcher(encode, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    results = {
+        'per-request': run(encode, queries, args.threads),
+        'micro-batch': run(batcher.encode, queries, args.threads)
+    }
+
+    print(f"模型: {args.model}  並行請求: {args.threads}  查詢數: {args.queries}")
+    print()
+    header = f"{'mode':<14}{'queries/s':>12}{'mean ms':>10}{'p95 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for mode, row in results.items():
+        print(f"{mode:<14}{row['qps']:>12.1f}{row['mean_ms']:>10.2f}{row['p95_ms']:>10.2f}")
+    print()
+    print(f"批次統計: {batcher.get_stats()}")
+
+
+if __name__ == '__main__':
+    main()
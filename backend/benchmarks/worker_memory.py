@@ -0,0 +1,110 @@
+"""
+多工作行程記憶體比較
+分別以 PRELOAD_MODEL=true / false 啟動 gunicorn，等待所有工作行程就緒後，
+從 /proc/<pid>/smaps_rollup 讀取主行程與工作行程的 RSS / PSS
+
+RSS 會把共用頁面重複計算在每個行程中；PSS 依共用行程數平均分攤，
+加總後即為整組行程實際佔用的實體記憶體。
+
+用法（Linux）:
+    python benchmarks/worker_memory.py --workers 4
+"""
+
+import sys
+import os
+import time
+import signal
+import argparse
+import subprocess
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_memory(pid: int) -> dict:
+    """讀取行程的 Rss / Pss / Shared / Private（KB）"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[-1] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    }
+
+
+def child_pids(pid: int) -> list:
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def wait_until_ready(url: str, workers: int, timeout: float):
+    """連續多次 /api/ready 都成功，視為所有工作行程都已預熱"""
+    deadline = time.time() + timeout
+    consecutive = 0
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                consecutive = consecutive + 1 if response.status == 200 else 0
+        except Exception:
+            consecutive = 0
+        if consecutive >= workers * 5:
+            return
+        time.sleep(0.2)
+    raise TimeoutError('workers did not become ready in time')
+
+
+def measure(preload: bool, workers: int, port: int, timeout: float) -> dict:
+    env = {
+        **os.environ,
+        'PRELOAD_MODEL': 'true' if preload else 'false',
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_BIND': f'127.0.0.1:{port}'
+    }
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_ready(f'http://127.0.0.1:{port}/api/ready', workers, timeout)
+        # 讓背景預熱與分配穩定下來
+        time.sleep(2)
+        return {
+            'master': read_memory(master.pid),
+            'workers': [read_memory(pid) for pid in child_pids(master.pid)]
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gunicorn worker memory with and without model preloading')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    header = f"{'mode':<12}{'process':<10}{'RSS MB':>10}{'PSS MB':>10}{'shared MB':>12}{'private MB':>12}"
+    print(header)
+    print('-' * len(header))
+
+    for preload in (False, True):
+        mode = 'preload' if preload else 'per-worker'
+        result = measure(preload, args.workers, args.port, args.timeout)
+        rows = [('master', result['master'])] + [(f'worker{i}', m) for i, m in enumerate(result['workers'])]
+        for name, m in rows:
+            print(f"{mode:<12}{name:<10}{m['rss'] / 1024:>10.1f}{m['pss'] / 1024:>10.1f}"
+                  f"{m['shared'] / 1024:>12.1f}{m['private'] / 1024:>12.1f}")
+        total_rss = sum(m['rss'] for _, m in rows) / 1024
+        total_pss = sum(m['pss'] for _, m in rows) / 1024
+        print(f"{mode:<12}{'total':<10}{total_rss:>10.1f}{total_pss:>10.1f}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
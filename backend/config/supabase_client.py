@@ -4,6 +4,7 @@ Supabase 客戶端配置
 """
 
 import os
+import threading
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -12,16 +13,21 @@ load_dotenv()
 class SupabaseClient:
     _instance = None
     _initialized = False
+    _lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
         return cls._instance
     
     def __init__(self):
         if not SupabaseClient._initialized:
-            self._initialize()
-            SupabaseClient._initialized = True
+            with SupabaseClient._lock:
+                if not SupabaseClient._initialized:
+                    self._initialize()
+                    SupabaseClient._initialized = True
     
     def _initialize(self):
         url = os.getenv("SUPABASE_URL")
@@ -31,6 +37,8 @@ class SupabaseClient:
             raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
         
         self.client: Client = create_client(url, key)
+        # 預先建立 PostgREST 客戶端（延遲建立非執行緒安全），所有請求共用其 httpx 長連線池
+        self.client.postgrest
     
     def get_client(self) -> Client:
         return self.client
@@ -51,6 +59,28 @@ class SupabaseClient:
         """獲取單個文件"""
         return self.client.table('documents').select('*').eq('id', doc_id).single().execute()
     
+    def find_document_by_hash(self, column: str, value: str):
+        """依 file_hash 或 text_hash 查找已處理完成的文件（用於去重）"""
+        if column not in ('file_hash', 'text_hash'):
+            raise ValueError(f"Unsupported hash column: {column}")
+        return self.client.table('documents').select(
+            'id, content_document_id, total_characters, total_tokens, total_chunks'
+        ).eq(column, value).eq('status', 'ready').limit(1).execute()
+    
+    def update_document(self, doc_id: str, updates: dict):
+        """更新文件元數據（例如處理狀態）"""
+        return self.client.table('documents').update(updates).eq('id', doc_id).execute()
+    
+    def mark_document_failed(self, doc_id: str, error: str = None, status: str = 'failed'):
+        """
+        將文件標記為 failed（或 degraded：本地索引可用但未保存到 Supabase）並記錄原因
+        （尚未加入 error 欄位的資料庫只更新狀態）
+        """
+        try:
+            return self.update_document(doc_id, {'status': status, 'error': error})
+        except Exception:
+            return self.update_document(doc_id, {'status': status})
+    
     def delete_document(self, doc_id: str):
         """刪除文件"""
         return self.client.table('documents').delete().eq('id', doc_id).execute()
@@ -60,6 +90,23 @@ class SupabaseClient:
         """保存向量嵌入"""
         return self.client.table('document_embeddings').insert(embeddings_data).execute()
     
+    def upsert_embeddings(self, embeddings_data: list):
+        """以 (document_id, chunk_index) upsert 一批向量嵌入（重試時不會產生重複資料列）"""
+        return self.client.table('document_embeddings').upsert(
+            embeddings_data, on_conflict='document_id,chunk_index', returning='minimal'
+        ).execute()
+    
+    def delete_document_embeddings(self, doc_id: str):
+        """刪除文件的所有向量嵌入（攝取失敗或改為共用既有內容時清除已寫入的部分）"""
+        return self.client.table('document_embeddings').delete().eq('document_id', doc_id).execute()
+    
+    def transfer_document_content(self, old_doc_id: str, new_doc_id: str):
+        """內容來源轉移：嵌入改掛在新來源下，其他重複文件改指向新來源（單一交易）"""
+        return self.client.rpc('transfer_document_content', {
+            'old_document_id': old_doc_id,
+            'new_document_id': new_doc_id
+        }).execute()
+    
     def search_similar(self, query_embedding: list, doc_id: str, limit: int = 5):
         """
         使用向量相似度搜索
@@ -79,9 +126,18 @@ class SupabaseClient:
             }
         ).execute()
     
-    def get_document_chunks(self, doc_id: str):
-        """獲取文件的所有文字區塊"""
-        return self.client.table('document_embeddings').select('content, chunk_index').eq('document_id', doc_id).order('chunk_index').execute()
+    def get_document_chunks(self, doc_id: str, include_embeddings: bool = False):
+        """
+        獲取文件的所有文字區塊
+        
+        Args:
+            doc_id: 文件 ID
+            include_embeddings: 是否同時返回已保存的向量（用於重建本地索引）
+        """
+        columns = 'content, chunk_index, start_byte, end_byte'
+        if include_embeddings:
+            columns += ', embedding'
+        return self.client.table('document_embeddings').select(columns).eq('document_id', doc_id).order('chunk_index').execute()
     
     # Quiz and flashcard operations
     def save_quiz(self, quiz_data: dict):
@@ -96,6 +152,14 @@ class SupabaseClient:
         """保存閃卡"""
         return self.client.table('flashcards').insert(flashcard_data).execute()
     
+    def find_generation(self, table: str, doc_id: str, cache_key: str):
+        """依快取鍵查找最近一次相同內容與參數的生成結果（quizzes / flashcards / summaries）"""
+        if table not in ('quizzes', 'flashcards', 'summaries'):
+            raise ValueError(f"Unsupported generation table: {table}")
+        return self.client.table(table).select('*').eq('document_id', doc_id).eq(
+            'settings->>cache_key', cache_key
+        ).order('created_at', desc=True).limit(1).execute()
+    
     def get_flashcards(self, doc_id: str):
         """獲取文件的所有閃卡（按時間倒序）"""
         return self.client.table('flashcards').select('*').eq('document_id', doc_id).order('created_at', desc=True).execute()
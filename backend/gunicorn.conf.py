@@ -0,0 +1,41 @@
+"""
+gunicorn 配置
+
+PRELOAD_MODEL=true（預設）時，主行程在 fork 前載入嵌入模型，
+所有工作行程以寫時複製共用同一份模型權重，而不是每個行程各載入一份。
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+上傳文件的清單與處理狀態（routes/documents.documents_store）保存在各工作行程的記憶體中，
+多個工作行程時請求可能落在不知道該文件的行程；因此預設只啟動 1 個工作行程，
+以 GUNICORN_THREADS 提高並行度。確認部署已處理共享狀態（例如負載平衡器依文件黏著）
+後才設定 GUNICORN_WORKERS > 1。
+"""
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+
+# 執行緒型工作行程：SSE 串流回答與背景攝取不會佔滿整個行程
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+preload_app = os.getenv("PRELOAD_MODEL", "true").lower() == "true"
+
+if preload_app:
+    # create_app 在主行程只載入模型；編碼預熱在每個工作行程 fork 後進行
+    os.environ["EMBEDDING_WARMUP"] = "preload"
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+
+    from services.prefork import after_fork
+    from services import start_warm_up
+
+    after_fork()
+    start_warm_up("background")
+
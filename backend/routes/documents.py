@@ -1,7 +1,7 @@
 """
 文件管理路由
 處理文件上傳、列表、刪除等操作
-完整流程：上傳 → 切片 → 向量嵌入 → 保存到 Supabase
+完整流程：上傳 → 背景任務（切片 → 向量嵌入 → 保存到 Supabase）→ 狀態查詢
 """
 
 import os
@@ -9,7 +9,8 @@ import uuid
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
 
-from services import get_rag_service, get_document_processor
+from services import get_rag_service, get_ingestion_queue, get_ingestion_pipeline
+from services.document_registry import file_sha256
 from config import get_supabase
 
 documents_bp = Blueprint('documents', __name__)
@@ -20,6 +21,10 @@ ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc', 'txt'}
 # 內存存儲（僅用於無 Supabase 時的備用方案）
 documents_store = {}
 
+# 預設預覽的字符數，以及依位元組範圍預覽時單次讀取的上限
+PREVIEW_CHARS = 2000
+PREVIEW_RANGE_MAX_BYTES = 64 * 1024
+
 # 是否使用 Supabase
 USE_SUPABASE = os.getenv('SUPABASE_URL') and os.getenv('SUPABASE_KEY')
 
@@ -33,12 +38,13 @@ def allowed_file(filename: str) -> bool:
 @documents_bp.route('/upload', methods=['POST'])
 def upload_document():
     """
-    上傳文件並完成完整處理流程：
+    上傳文件並排入背景處理佇列：
     1. 驗證文件類型
     2. 保存到本地
-    3. 提取文字並切片
-    4. 生成向量嵌入
-    5. 保存到 Supabase（如果已配置）
+    3. 建立 processing 狀態的文件記錄
+    4. 背景任務：提取文字 → 切片 → 向量嵌入 → 保存到 Supabase（如果已配置）
+    
+    立即返回 202 和 job_id，處理進度透過 /<doc_id>/status 查詢
     """
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
@@ -57,6 +63,9 @@ def upload_document():
         # 生成唯一文件 ID
         doc_id = str(uuid.uuid4())
         
+        # 可選：所屬使用者，用於跨文件語料搜索
+        user_id = request.form.get('user_id') or None
+        
         # 安全處理文件名
         original_filename = secure_filename(file.filename)
         _, ext = os.path.splitext(original_filename)
@@ -67,72 +76,68 @@ def upload_document():
         file_path = os.path.join(upload_folder, stored_filename)
         file.save(file_path)
         
-        # 2. 提取文字並獲取文件資訊
-        processor = get_document_processor()
-        doc_info = processor.get_document_info(file_path)
-        
-        # 3. 切片並生成向量嵌入（RAG 索引）
+        # 2. 檔案雜湊：位元組完全相同的文件直接共用既有索引，不解析、不嵌入
+        file_hash = file_sha256(file_path)
         rag_service = get_rag_service()
-        index_result = rag_service.index_document(doc_id, file_path)
+        duplicate = rag_service.find_duplicate(file_hash=file_hash)
+        if duplicate:
+            return _create_duplicate_document(
+                doc_id, file_path, original_filename, stored_filename, user_id, file_hash, duplicate
+            )
         
-        # 4. 準備文件元數據
+        # 3. 準備文件元數據（處理中）
         doc_metadata = {
             'id': doc_id,
             'original_filename': original_filename,
             'stored_filename': stored_filename,
             'file_path': file_path,
-            'file_size': doc_info['file_size'],
-            'total_characters': doc_info['total_characters'],
-            'total_tokens': doc_info['total_tokens'],
-            'total_chunks': index_result['chunks_indexed'],
-            'status': 'ready'
+            'file_size': os.path.getsize(file_path),
+            'user_id': user_id,
+            'status': 'processing',
+            'saved_to_supabase': False
         }
         
-        # 5. 保存到 Supabase（如果已配置）
+        # 4. 先在 Supabase 建立 processing 狀態的記錄（如果已配置）
+        document_saved = False
         if USE_SUPABASE:
             try:
                 supabase = get_supabase()
-                
-                # 保存文件元數據
-                supabase_doc_data = {
+                supabase.save_document({
                     'id': doc_id,
                     'original_filename': original_filename,
                     'stored_filename': stored_filename,
-                    'file_size': doc_info['file_size'],
-                    'total_characters': doc_info['total_characters'],
-                    'total_tokens': doc_info['total_tokens'],
-                    'total_chunks': index_result['chunks_indexed'],
-                    'status': 'ready'
-                }
-                supabase.save_document(supabase_doc_data)
-                
-                # 保存向量嵌入（從 RAG service 獲取）
-                embeddings_data = index_result.get('embeddings_for_db', [])
-                if embeddings_data:
-                    supabase.save_embeddings(embeddings_data)
-                
-                doc_metadata['saved_to_supabase'] = True
-                
+                    'file_size': doc_metadata['file_size'],
+                    'status': 'processing'
+                })
+                document_saved = True
             except Exception as supabase_error:
                 # Supabase 失敗不影響主流程
                 print(f"Supabase save failed: {supabase_error}")
-                doc_metadata['saved_to_supabase'] = False
-        else:
-            doc_metadata['saved_to_supabase'] = False
         
-        # 6. 保存到內存存儲（備用）
         documents_store[doc_id] = doc_metadata
         
+        # 5. 排入背景攝取任務
+        job = get_ingestion_queue().submit(
+            doc_id,
+            file_path,
+            {
+                'original_filename': original_filename,
+                'stored_filename': stored_filename,
+                'user_id': user_id,
+                'file_hash': file_hash,
+                'document_saved': document_saved
+            },
+            use_supabase=bool(USE_SUPABASE),
+            on_success=lambda context: _on_ingestion_success(doc_id, context),
+            on_failure=lambda error: _on_ingestion_failure(doc_id, file_path, error, document_saved)
+        )
+        
         return jsonify({
-            'message': 'Document uploaded, chunked, and indexed successfully',
+            'message': 'Document uploaded and queued for processing',
+            'job_id': job['job_id'],
             'document': doc_metadata,
-            'processing_details': {
-                'chunks_created': index_result['chunks_indexed'],
-                'total_tokens': doc_info['total_tokens'],
-                'embedding_model': 'text2vec-base-chinese',
-                'status': 'ready'
-            }
-        }), 201
+            'status_url': f'/api/documents/{doc_id}/status'
+        }), 202
         
     except Exception as e:
         # 清理：如果處理失敗，刪除已上傳的文件
@@ -141,6 +146,146 @@ def upload_document():
         return jsonify({'error': str(e)}), 500
 
 
+def _create_duplicate_document(doc_id: str, file_path: str, original_filename: str, stored_filename: str,
+                               user_id, file_hash: str, duplicate: dict):
+    """建立指向既有內容的文件記錄，立即返回 ready"""
+    documents_store[doc_id] = {
+        'id': doc_id,
+        'original_filename': original_filename,
+        'stored_filename': stored_filename,
+        'file_path': file_path,
+        'file_size': os.path.getsize(file_path),
+        'user_id': user_id,
+        'status': 'processing',
+        'saved_to_supabase': False
+    }
+    
+    pipeline = get_ingestion_pipeline(use_supabase=bool(USE_SUPABASE))
+    try:
+        context = pipeline.run_duplicate(doc_id, file_path, {
+            'original_filename': original_filename,
+            'stored_filename': stored_filename,
+            'user_id': user_id,
+            'file_hash': file_hash
+        }, duplicate)
+    except Exception:
+        # 不留下停在 processing 的記錄與已登記的部分索引（上傳的檔案由呼叫者刪除）
+        documents_store.pop(doc_id, None)
+        get_rag_service().remove_document(doc_id, user_id)
+        raise
+    _on_ingestion_success(doc_id, context)
+    
+    doc_metadata = documents_store[doc_id]
+    return jsonify({
+        'message': 'Duplicate document detected, reusing existing index',
+        'document': doc_metadata,
+        'processing_details': doc_metadata['processing_details']
+    }), 201
+
+
+def _on_ingestion_success(doc_id: str, context):
+    """背景任務完成：更新內存中的文件元數據"""
+    doc_metadata = documents_store.get(doc_id)
+    if doc_metadata is None:
+        return
+    
+    doc_metadata.update({
+        'total_characters': context.stats['total_characters'],
+        'total_tokens': context.stats['total_tokens'],
+        'total_chunks': context.index_result['chunks_indexed'],
+        'content_document_id': context.index_result.get('content_document_id'),
+        'status': context.status,
+        'error': context.persist_error,
+        'saved_to_supabase': context.saved_to_supabase,
+        'processing_details': {
+            'chunks_created': context.index_result['chunks_indexed'],
+            'total_tokens': context.stats['total_tokens'],
+            'embedding_model': get_rag_service().model_name,
+            'status': context.status,
+            'embedding_cache_hit_rate': context.index_result['embedding_cache']['hit_rate'],
+            'deduplicated': context.duplicate is not None,
+            'stage_timings_ms': context.timings,
+            'embedding_write': context.write_stats or None,
+            'supabase_error': context.persist_error
+        }
+    })
+
+
+def _on_ingestion_failure(doc_id: str, file_path: str, error: str, document_saved: bool):
+    """背景任務失敗：標記狀態並清理已上傳的文件"""
+    if doc_id in documents_store:
+        documents_store[doc_id].update({'status': 'failed', 'error': error})
+    
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    
+    if document_saved:
+        try:
+            get_supabase().mark_document_failed(doc_id, error)
+        except Exception as supabase_error:
+            print(f"Supabase status update failed: {supabase_error}")
+
+
+@documents_bp.route('/<doc_id>/status', methods=['GET'])
+def get_document_status(doc_id: str):
+    """
+    查詢文件處理進度
+    
+    Response:
+    {
+        "document_id": "...",
+        "job_id": "...",
+        "status": "processing",  // processing, ready, degraded（已索引但未保存到 Supabase）, failed
+        "current_stage": "embed",
+        "stages": {"extract": {"status": "done", "duration_ms": 12.3}, ...}
+    }
+    """
+    job = get_ingestion_queue().get_job_for_document(doc_id)
+    
+    if job:
+        status = 'processing' if job['status'] == 'queued' else job['status']
+        response = {
+            'document_id': doc_id,
+            'job_id': job['job_id'],
+            'status': status,
+            'current_stage': job['current_stage'],
+            'stages': job['stages'],
+            'error': job['error']
+        }
+        if status in ('ready', 'degraded') and doc_id in documents_store:
+            response['document'] = documents_store[doc_id]
+        return jsonify(response)
+    
+    # 任務不在本進程（例如其他 worker 或重啟後），回退到 documents 表的 status 欄位
+    try:
+        if USE_SUPABASE:
+            result = get_supabase().get_document(doc_id)
+            if result.data:
+                return jsonify({
+                    'document_id': doc_id,
+                    'job_id': None,
+                    'status': result.data.get('status', 'processing'),
+                    'current_stage': None,
+                    'stages': None,
+                    'error': result.data.get('error')
+                })
+    except Exception as e:
+        print(f"Failed to get document status: {e}")
+    
+    if doc_id in documents_store:
+        return jsonify({
+            'document_id': doc_id,
+            'job_id': None,
+            'status': documents_store[doc_id].get('status', 'ready'),
+            'current_stage': None,
+            'stages': None,
+            'error': documents_store[doc_id].get('error'),
+            'document': documents_store[doc_id]
+        })
+    
+    return jsonify({'error': 'Document not found'}), 404
+
+
 @documents_bp.route('/', methods=['GET'])
 def get_documents():
     """獲取所有文件列表"""
@@ -197,7 +342,7 @@ def delete_document(doc_id: str):
         
         # 從 RAG 索引中移除
         rag_service = get_rag_service()
-        rag_service.remove_document(doc_id)
+        rag_service.remove_document(doc_id, doc.get('user_id'))
         
         # 從存儲中移除
         del documents_store[doc_id]
@@ -210,7 +355,12 @@ def delete_document(doc_id: str):
 
 @documents_bp.route('/<doc_id>/preview', methods=['GET'])
 def preview_document(doc_id: str):
-    """預覽文件內容"""
+    """
+    預覽文件內容
+    
+    預設返回前 2000 字符；帶 offset / length（位元組）時返回該範圍，
+    兩者皆直接從磁碟上的全文讀取，不載入整份文字
+    """
     if doc_id not in documents_store:
         return jsonify({'error': 'Document not found'}), 404
     
@@ -220,13 +370,29 @@ def preview_document(doc_id: str):
         if not rag_service.is_document_indexed(doc_id):
             return jsonify({'error': 'Document not indexed'}), 400
         
-        # 獲取前 2000 字符作為預覽
-        full_text = rag_service.get_full_text(doc_id)
-        preview = full_text[:2000] + ('...' if len(full_text) > 2000 else '')
+        offset = request.args.get('offset', type=int)
+        length = request.args.get('length', type=int)
+        
+        if offset is None and length is None:
+            # 獲取前 2000 字符作為預覽（UTF-8 每字符最多 4 位元組）
+            chunk = rag_service.get_text_range(doc_id, 0, PREVIEW_CHARS * 4)
+            preview = chunk['text'][:PREVIEW_CHARS]
+            end = len(preview.encode('utf-8'))
+            if end < chunk['total_bytes']:
+                preview += '...'
+        else:
+            length = min(max(length or PREVIEW_RANGE_MAX_BYTES, 0), PREVIEW_RANGE_MAX_BYTES)
+            chunk = rag_service.get_text_range(doc_id, max(offset or 0, 0), length)
+            preview = chunk['text']
+            end = chunk['end']
         
+        total_length = documents_store[doc_id].get('total_characters')
         return jsonify({
             'preview': preview,
-            'total_length': len(full_text)
+            'total_length': total_length if total_length is not None else len(rag_service.get_full_text(doc_id)),
+            'start': chunk['start'],
+            'end': end,
+            'total_bytes': chunk['total_bytes']
         })
         
     except Exception as e:
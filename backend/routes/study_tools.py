@@ -4,8 +4,9 @@
 """
 
 import os
+import json
 import uuid
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 
 from services import get_groq_service, get_rag_service
 from config import get_supabase
@@ -15,6 +16,80 @@ study_tools_bp = Blueprint('study_tools', __name__)
 # 是否使用 Supabase
 USE_SUPABASE = os.getenv('SUPABASE_URL') and os.getenv('SUPABASE_KEY')
 
+# 是否從歷史記錄表（quizzes / flashcards / summaries）提供快取結果
+GENERATION_CACHE_USE_DB = os.getenv('GENERATION_CACHE_USE_DB', 'true').lower() == 'true'
+
+
+def _find_cached_record(table: str, doc_id: str, cache_key: str):
+    """從歷史記錄表中查找相同快取鍵的生成結果（GENERATION_CACHE_USE_DB 開啟時）"""
+    if not (USE_SUPABASE and GENERATION_CACHE_USE_DB):
+        return None
+    
+    try:
+        result = get_supabase().find_generation(table, doc_id, cache_key)
+        return result.data[0] if result.data else None
+    except Exception as e:
+        print(f"Failed to look up cached {table} in Supabase: {e}")
+        return None
+
+
+def _record_loader(table: str, doc_id: str, cache_key: str, field: str, build):
+    """
+    建立從歷史記錄表讀取快取結果的函式：返回 (build(記錄), 記錄 ID)
+    
+    field 為空的記錄（例如舊版保存的解析失敗結果）不視為快取命中
+    """
+    def load():
+        record = _find_cached_record(table, doc_id, cache_key)
+        if not record or not record.get(field):
+            return None
+        return build(record), record['id']
+    return load
+
+
+def _wants_stream(data: dict) -> bool:
+    """請求是否要求串流回答（body 中 stream: true 或 Accept: text/event-stream）"""
+    return bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def _sse_event(event: str, data) -> str:
+    """格式化一個 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_answer(question: str, context: str, sources: list, meta: dict) -> Response:
+    """
+    以 SSE 串流回答：先送出 sources，再逐段送出 LLM 生成的 token
+    
+    事件順序：sources → token*（{"content": "..."}）→ done（完整回答）；失敗時送出 error
+    """
+    groq_service = get_groq_service()
+    
+    def generate():
+        yield _sse_event('sources', {**meta, 'question': question, 'sources': sources})
+        
+        parts = []
+        try:
+            for delta in groq_service.stream_answer(question, context):
+                parts.append(delta)
+                yield _sse_event('token', {'content': delta})
+        except Exception as e:
+            print(f"Streaming answer error: {e}")
+            yield _sse_event('error', {'error': str(e)})
+            return
+        
+        yield _sse_event('done', {'answer': ''.join(parts)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # 避免反向代理（nginx）緩衝串流
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 
 @study_tools_bp.route('/quiz/<doc_id>', methods=['POST'])
 def generate_quiz(doc_id: str):
@@ -24,7 +99,8 @@ def generate_quiz(doc_id: str):
     Request body:
     {
         "num_questions": 5,  // 可選，默認 5
-        "question_type": "mixed"  // 可選: multiple_choice, short_answer, mixed
+        "question_type": "mixed",  // 可選: multiple_choice, short_answer, mixed
+        "force_regenerate": false  // 可選，忽略快取重新生成
     }
     """
     try:
@@ -37,6 +113,7 @@ def generate_quiz(doc_id: str):
         data = request.get_json() or {}
         num_questions = min(max(data.get('num_questions', 5), 1), 10)
         question_type = data.get('question_type', 'mixed')
+        force_regenerate = bool(data.get('force_regenerate', False))
         
         if question_type not in ['multiple_choice', 'short_answer', 'mixed']:
             question_type = 'mixed'
@@ -44,29 +121,43 @@ def generate_quiz(doc_id: str):
         # 獲取文件內容
         content = rag_service.get_full_text(doc_id)
         
-        # 生成測驗
         groq_service = get_groq_service()
-        quiz = groq_service.generate_quiz(content, num_questions, question_type)
-        
-        # 存入 Supabase（如果已配置）
-        quiz_id = str(uuid.uuid4())
-        if USE_SUPABASE:
-            try:
-                supabase = get_supabase()
-                supabase.save_quiz({
-                    'id': quiz_id,
-                    'document_id': doc_id,
-                    'title': quiz.get('quiz_title', '自動生成測驗'),
-                    'questions': quiz.get('questions', []),
-                    'settings': {'num_questions': num_questions, 'question_type': question_type}
-                })
-            except Exception as e:
-                print(f"Failed to save quiz to Supabase: {e}")
+        settings = {'num_questions': num_questions, 'question_type': question_type}
+        cache_key = groq_service.cache_key('quiz', content, settings)
+        
+        # 查找快取（記憶體 → 歷史記錄表）或生成測驗；新結果以預先分配的 ID 保存
+        generation = groq_service.generate_quiz(
+            content, num_questions, question_type, force_regenerate,
+            doc_id=doc_id,
+            record_id=str(uuid.uuid4()),
+            load_record=_record_loader(
+                'quizzes', doc_id, cache_key, 'questions',
+                lambda record: {'quiz_title': record['title'], 'questions': record['questions']}
+            )
+        )
+        quiz, cache_source, quiz_id = generation.result, generation.source, generation.record_id
+        
+        # 存入 Supabase（如果已配置；快取命中或 LLM 回覆無法解析時不保存）
+        if cache_source is None and not generation.failed:
+            if USE_SUPABASE:
+                try:
+                    supabase = get_supabase()
+                    supabase.save_quiz({
+                        'id': quiz_id,
+                        'document_id': doc_id,
+                        'title': quiz.get('quiz_title', '自動生成測驗'),
+                        'questions': quiz.get('questions', []),
+                        'settings': {**settings, 'cache_key': cache_key}
+                    })
+                except Exception as e:
+                    print(f"Failed to save quiz to Supabase: {e}")
         
         return jsonify({
             'document_id': doc_id,
             'quiz_id': quiz_id,
             'quiz': quiz,
+            'cached': cache_source is not None,
+            'cache_source': cache_source,
             'saved_to_supabase': USE_SUPABASE
         })
         
@@ -84,7 +175,8 @@ def generate_flashcards(doc_id: str):
     
     Request body:
     {
-        "num_cards": 10  // 可選，默認 10
+        "num_cards": 10,  // 可選，默認 10
+        "force_regenerate": false  // 可選，忽略快取重新生成
     }
     """
     try:
@@ -96,32 +188,48 @@ def generate_flashcards(doc_id: str):
         # 獲取請求參數
         data = request.get_json() or {}
         num_cards = min(max(data.get('num_cards', 10), 5), 20)
+        force_regenerate = bool(data.get('force_regenerate', False))
         
         # 獲取文件內容
         content = rag_service.get_full_text(doc_id)
         
-        # 生成閃卡
         groq_service = get_groq_service()
-        flashcards = groq_service.generate_flashcards(content, num_cards)
-        
-        # 存入 Supabase（如果已配置）
-        flashcard_id = str(uuid.uuid4())
-        if USE_SUPABASE:
-            try:
-                supabase = get_supabase()
-                supabase.save_flashcards({
-                    'id': flashcard_id,
-                    'document_id': doc_id,
-                    'deck_title': flashcards.get('deck_title', '自動生成閃卡'),
-                    'cards': flashcards.get('cards', [])
-                })
-            except Exception as e:
-                print(f"Failed to save flashcards to Supabase: {e}")
+        settings = {'num_cards': num_cards}
+        cache_key = groq_service.cache_key('flashcards', content, settings)
+        
+        # 查找快取（記憶體 → 歷史記錄表）或生成閃卡；新結果以預先分配的 ID 保存
+        generation = groq_service.generate_flashcards(
+            content, num_cards, force_regenerate,
+            doc_id=doc_id,
+            record_id=str(uuid.uuid4()),
+            load_record=_record_loader(
+                'flashcards', doc_id, cache_key, 'cards',
+                lambda record: {'deck_title': record['deck_title'], 'cards': record['cards']}
+            )
+        )
+        flashcards, cache_source, flashcard_id = generation.result, generation.source, generation.record_id
+        
+        # 存入 Supabase（如果已配置；快取命中或 LLM 回覆無法解析時不保存）
+        if cache_source is None and not generation.failed:
+            if USE_SUPABASE:
+                try:
+                    supabase = get_supabase()
+                    supabase.save_flashcards({
+                        'id': flashcard_id,
+                        'document_id': doc_id,
+                        'deck_title': flashcards.get('deck_title', '自動生成閃卡'),
+                        'cards': flashcards.get('cards', []),
+                        'settings': {**settings, 'cache_key': cache_key}
+                    })
+                except Exception as e:
+                    print(f"Failed to save flashcards to Supabase: {e}")
         
         return jsonify({
             'document_id': doc_id,
             'flashcard_id': flashcard_id,
             'flashcards': flashcards,
+            'cached': cache_source is not None,
+            'cache_source': cache_source,
             'saved_to_supabase': USE_SUPABASE
         })
         
@@ -139,7 +247,8 @@ def generate_summary(doc_id: str):
     
     Request body:
     {
-        "num_points": 5  // 可選，默認 5
+        "num_points": 5,  // 可選，默認 5
+        "force_regenerate": false  // 可選，忽略快取重新生成
     }
     """
     try:
@@ -151,34 +260,55 @@ def generate_summary(doc_id: str):
         # 獲取請求參數
         data = request.get_json() or {}
         num_points = min(max(data.get('num_points', 5), 3), 10)
+        force_regenerate = bool(data.get('force_regenerate', False))
         
         # 獲取文件內容
         content = rag_service.get_full_text(doc_id)
         
-        # 生成摘要
         groq_service = get_groq_service()
-        summary = groq_service.generate_summary(content, num_points)
-        
-        # 存入 Supabase（如果已配置）
-        summary_id = str(uuid.uuid4())
-        if USE_SUPABASE:
-            try:
-                supabase = get_supabase()
-                supabase.client.table('summaries').insert({
-                    'id': summary_id,
-                    'document_id': doc_id,
-                    'document_title': summary.get('document_title', ''),
-                    'tldr': summary.get('tldr', ''),
-                    'key_points': summary.get('key_points', []),
-                    'keywords': summary.get('keywords', [])
-                }).execute()
-            except Exception as e:
-                print(f"Failed to save summary to Supabase: {e}")
+        settings = {'num_points': num_points}
+        cache_key = groq_service.cache_key('summary', content, settings)
+        
+        # 查找快取（記憶體 → 歷史記錄表）或生成摘要；新結果以預先分配的 ID 保存
+        generation = groq_service.generate_summary(
+            content, num_points, force_regenerate,
+            doc_id=doc_id,
+            record_id=str(uuid.uuid4()),
+            load_record=_record_loader(
+                'summaries', doc_id, cache_key, 'key_points',
+                lambda record: {
+                    'document_title': record.get('document_title', ''),
+                    'tldr': record['tldr'],
+                    'key_points': record['key_points'],
+                    'keywords': record.get('keywords') or []
+                }
+            )
+        )
+        summary, cache_source, summary_id = generation.result, generation.source, generation.record_id
+        
+        # 存入 Supabase（如果已配置；快取命中或 LLM 回覆無法解析時不保存）
+        if cache_source is None and not generation.failed:
+            if USE_SUPABASE:
+                try:
+                    supabase = get_supabase()
+                    supabase.client.table('summaries').insert({
+                        'id': summary_id,
+                        'document_id': doc_id,
+                        'document_title': summary.get('document_title', ''),
+                        'tldr': summary.get('tldr', ''),
+                        'key_points': summary.get('key_points', []),
+                        'keywords': summary.get('keywords', []),
+                        'settings': {**settings, 'cache_key': cache_key}
+                    }).execute()
+                except Exception as e:
+                    print(f"Failed to save summary to Supabase: {e}")
         
         return jsonify({
             'document_id': doc_id,
             'summary_id': summary_id,
             'summary': summary,
+            'cached': cache_source is not None,
+            'cache_source': cache_source,
             'saved_to_supabase': USE_SUPABASE
         })
         
@@ -196,7 +326,8 @@ def ask_question(doc_id: str):
     
     Request body:
     {
-        "question": "你的問題"
+        "question": "你的問題",
+        "stream": false  // 可選，true 時以 SSE 串流回答（先送 sources，再送 token）
     }
     """
     try:
@@ -212,11 +343,12 @@ def ask_question(doc_id: str):
         if not question:
             return jsonify({'error': 'Question is required'}), 400
         
-        # 獲取相關上下文
-        context = rag_service.get_context_for_query(doc_id, question)
+        # 一次檢索同時取得上下文與來源
+        retrieval = rag_service.retrieve(doc_id, question)
+        context, sources = retrieval['context'], retrieval['sources']
         
-        # 獲取相關區塊用於顯示來源
-        sources = rag_service.search(doc_id, question, top_k=3)
+        if _wants_stream(data):
+            return _stream_answer(question, context, sources, {'document_id': doc_id})
         
         # 生成回答
         groq_service = get_groq_service()
@@ -271,6 +403,109 @@ def search_document(doc_id: str):
         return jsonify({'error': str(e)}), 500
 
 
+# ============ 跨文件 API ============
+
+def _get_corpus_filters(data: dict):
+    """解析跨文件請求的使用者與文件範圍（語料依使用者隔離，必須指定 user_id）"""
+    user_id = data.get('user_id') or None
+    if not user_id:
+        raise ValueError('user_id is required')
+    document_ids = data.get('document_ids')
+    if document_ids is not None and not isinstance(document_ids, list):
+        raise ValueError('document_ids must be a list')
+    return user_id, document_ids
+
+
+@study_tools_bp.route('/search', methods=['POST'])
+def search_corpus():
+    """
+    在所有文件（或指定的課程資料夾）中搜索
+    
+    Request body:
+    {
+        "query": "搜索關鍵字",
+        "top_k": 5,  // 可選
+        "document_ids": ["..."],  // 可選，限定文件範圍
+        "user_id": "..."  // 必填，只搜索該使用者上傳的文件
+    }
+    """
+    try:
+        data = request.get_json() or {}
+        query = data.get('query', '').strip()
+        top_k = min(max(data.get('top_k', 5), 1), 50)
+        
+        if not query:
+            return jsonify({'error': 'Query is required'}), 400
+        
+        try:
+            user_id, document_ids = _get_corpus_filters(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        rag_service = get_rag_service()
+        results = rag_service.search_corpus(query, top_k, owner=user_id, doc_ids=document_ids)
+        
+        return jsonify({
+            'query': query,
+            'document_ids': document_ids,
+            'results': results
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@study_tools_bp.route('/ask', methods=['POST'])
+def ask_corpus():
+    """
+    向多個文件提問（跨文件 RAG 問答）
+    
+    Request body:
+    {
+        "question": "你的問題",
+        "document_ids": ["..."],  // 可選，限定文件範圍
+        "user_id": "...",  // 必填，只使用該使用者上傳的文件
+        "stream": false  // 可選，true 時以 SSE 串流回答
+    }
+    """
+    try:
+        data = request.get_json() or {}
+        question = data.get('question', '').strip()
+        
+        if not question:
+            return jsonify({'error': 'Question is required'}), 400
+        
+        try:
+            user_id, document_ids = _get_corpus_filters(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        rag_service = get_rag_service()
+        
+        # 一次檢索同時取得上下文與來源
+        retrieval = rag_service.retrieve_corpus(question, owner=user_id, doc_ids=document_ids)
+        context, sources = retrieval['context'], retrieval['sources']
+        if not context:
+            return jsonify({'error': 'No indexed documents matched the request'}), 404
+        
+        if _wants_stream(data):
+            return _stream_answer(question, context, sources, {'document_ids': document_ids})
+        
+        # 生成回答
+        groq_service = get_groq_service()
+        answer = groq_service.answer_question(question, context)
+        
+        return jsonify({
+            'question': question,
+            'document_ids': document_ids,
+            'answer': answer,
+            'sources': sources
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ============ 歷史記錄 API ============
 
 @study_tools_bp.route('/flashcards/<doc_id>', methods=['GET'])
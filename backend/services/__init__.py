@@ -5,9 +5,27 @@ Services package
 from .groq_service import get_groq_service, GroqService
 from .document_processor import get_document_processor, DocumentProcessor
 from .rag_service import get_rag_service, RAGService
+from .index_store import get_index_store, IndexStore
+from .index_cache import IndexCache
+from .document_registry import get_document_registry, DocumentRegistry
+from .ingestion_pipeline import get_ingestion_pipeline, IngestionPipeline
+from .ingestion_jobs import get_ingestion_queue, IngestionJobQueue
+from .generation_cache import get_generation_cache, GenerationCache
+from .llm_executor import get_llm_executor, LLMExecutor
+from .embedding_writer import get_embedding_writer, EmbeddingWriter
+from .warmup import start_warm_up, get_readiness
 
 __all__ = [
     'get_groq_service', 'GroqService',
     'get_document_processor', 'DocumentProcessor',
-    'get_rag_service', 'RAGService'
+    'get_rag_service', 'RAGService',
+    'get_index_store', 'IndexStore',
+    'IndexCache',
+    'get_document_registry', 'DocumentRegistry',
+    'get_ingestion_pipeline', 'IngestionPipeline',
+    'get_ingestion_queue', 'IngestionJobQueue',
+    'get_generation_cache', 'GenerationCache',
+    'get_llm_executor', 'LLMExecutor',
+    'get_embedding_writer', 'EmbeddingWriter',
+    'start_warm_up', 'get_readiness'
 ]
@@ -0,0 +1,441 @@
+"""
+跨文件語料索引
+每個使用者一個共享 FAISS 索引，向量 ID 對應到 (內容 ID, 區塊序號)；內容相同的重複文件共用同一份向量
+語料只保存 ID，區塊內容由各文件的索引（IndexCache / 磁碟）取得，不在語料中重複保存
+小語料使用精確的 Flat 索引，超過門檻後自動轉換為 IVF（CORPUS_INDEX_TYPE）以維持低延遲
+未指定使用者的文件不加入任何語料
+"""
+
+import os
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+import numpy as np
+import faiss
+
+from .index_store import get_index_store
+from .vector_index import create_index, configure_search, get_index_type, estimate_index_bytes
+
+
+class CorpusIndex:
+    """
+    單一使用者的語料索引
+
+    Args:
+        dim: 向量維度
+        ivf_threshold: 超過此向量數時轉換為 IVF 索引
+        index_type: 轉換後的類型 'ivf_flat' 或 'ivf_pq'（需支援按 ID 刪除，不使用 HNSW）
+        nprobe: IVF 搜索時探查的聚類數
+    """
+
+    def __init__(self, dim: int, ivf_threshold: int = None, index_type: str = None, nprobe: int = None):
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold or int(os.getenv("CORPUS_IVF_THRESHOLD", "20000"))
+        self.index_type = index_type or os.getenv("CORPUS_INDEX_TYPE", "ivf_flat")
+        if self.index_type not in ('ivf_flat', 'ivf_pq'):
+            raise ValueError(f"Unsupported corpus index type: {self.index_type}")
+        self.nprobe = nprobe or int(os.getenv("CORPUS_IVF_NPROBE", "16"))
+
+        self.index: faiss.Index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        # 內容相同的重複文件共用一份向量：以內容 ID（擁有索引的文件 ID）為單位保存
+        self.id_map: Dict[int, Tuple[str, int]] = {}       # 向量 ID -> (內容 ID, 區塊位置)
+        self.vector_ids: Dict[str, List[int]] = {}         # 內容 ID -> 向量 ID 列表
+        self.members: Dict[str, List[str]] = {}            # 內容 ID -> 使用這份內容的文件 ID
+        self.content_of: Dict[str, str] = {}               # 文件 ID -> 內容 ID
+        self.next_id = 0
+        self.lock = threading.RLock()
+
+    @property
+    def is_ivf(self) -> bool:
+        return isinstance(self.index, faiss.IndexIVF)
+
+    def _content_key(self, content_id: str) -> Optional[str]:
+        """內容在語料中的鍵（來源文件被刪除後，內容仍以原本的鍵保存）"""
+        if content_id in self.vector_ids:
+            return content_id
+        key = self.content_of.get(content_id)
+        return key if key in self.vector_ids else None
+
+    def has_content(self, content_id: str) -> bool:
+        with self.lock:
+            return self._content_key(content_id) is not None
+
+    def add_document(self, doc_id: str, embeddings: Optional[np.ndarray], content_id: Optional[str] = None) -> bool:
+        """
+        加入一個文件（已存在時先移除）
+
+        內容已在語料中時（重複文件）只登記文件 ID，不再加入向量
+
+        Args:
+            doc_id: 文件 ID
+            embeddings: 已正規化的向量，第 i 列對應第 i 個區塊（內容已存在時可為 None）
+            content_id: 內容來源的文件 ID（重複文件），預設為 doc_id
+
+        Returns:
+            是否已加入
+        """
+        with self.lock:
+            self._remove(doc_id)
+            content_id = content_id or doc_id
+
+            key = self._content_key(content_id)
+            if key is not None:
+                self.members[key].append(doc_id)
+                self.content_of[doc_id] = key
+                return True
+            if embeddings is None:
+                return False
+
+            ids = np.arange(self.next_id, self.next_id + len(embeddings), dtype=np.int64)
+            self.next_id += len(embeddings)
+
+            self.index.add_with_ids(np.ascontiguousarray(embeddings, dtype=np.float32), ids)
+            for position, vector_id in enumerate(ids.tolist()):
+                self.id_map[vector_id] = (content_id, position)
+            self.vector_ids[content_id] = ids.tolist()
+            self.members[content_id] = [doc_id]
+            self.content_of[doc_id] = content_id
+
+            if not self.is_ivf and self.index.ntotal >= self.ivf_threshold:
+                self._convert_to_ivf()
+            return True
+
+    def remove_document(self, doc_id: str) -> bool:
+        """移除文件（向量在沒有其他重複文件使用時才刪除），返回是否有移除"""
+        with self.lock:
+            return self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> bool:
+        key = self.content_of.pop(doc_id, None)
+        if key is None:
+            return False
+        members = self.members[key]
+        members.remove(doc_id)
+        if members:
+            return True
+        del self.members[key]
+
+        ids = self.vector_ids.pop(key, [])
+        if ids:
+            self.index.remove_ids(np.array(ids, dtype=np.int64))
+        for vector_id in ids:
+            self.id_map.pop(vector_id, None)
+        return True
+
+    def _convert_to_ivf(self):
+        """將 Flat 索引轉換為 IVF（以現有向量訓練聚類中心）"""
+        ntotal = self.index.ntotal
+        vectors = self.index.index.reconstruct_n(0, ntotal)
+        ids = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+
+        ivf = create_index(self.index_type, self.dim, vectors)
+        ivf.add_with_ids(vectors, ids)
+        configure_search(ivf, nprobe=self.nprobe)
+
+        self.index = ivf
+        print(f"語料索引已轉換為 {self.index_type}（{ntotal} 向量，nlist={ivf.nlist}）")
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 5,
+               doc_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        搜索語料
+
+        IVF 只探查 nprobe 個聚類，篩選文件時候選可能全部落在未探查的聚類；
+        結果少於應有數量時改為探查全部聚類（對篩選後的向量做完整搜索）
+
+        Args:
+            query_embedding: 已正規化的查詢向量，形狀 (1, dim)
+            top_k: 返回結果數量
+            doc_ids: 只在這些文件中搜索（例如同一課程資料夾）
+
+        Returns:
+            [{"document_id", "document_ids", "content_id", "position", "score"}]；
+            每份內容只出現一次，document_ids 為共用該內容的所有（符合篩選的）文件，
+            position 為區塊在文件索引中的位置
+        """
+        with self.lock:
+            if self.index.ntotal == 0:
+                return []
+
+            selector = None
+            wanted = None
+            candidates = self.index.ntotal
+            if doc_ids is not None:
+                wanted = set(doc_ids)
+                keys = {self.content_of[doc_id] for doc_id in wanted if doc_id in self.content_of}
+                allowed = [vector_id for key in keys for vector_id in self.vector_ids.get(key, [])]
+                if not allowed:
+                    return []
+                selector = faiss.IDSelectorBatch(np.array(allowed, dtype=np.int64))
+                candidates = len(allowed)
+
+            k = min(top_k, candidates)
+            scores, ids = self.index.search(query_embedding, k, params=self._search_params(selector, self.nprobe))
+            if self.is_ivf and np.count_nonzero(ids[0] >= 0) < k and self.nprobe < self.index.nlist:
+                scores, ids = self.index.search(
+                    query_embedding, k, params=self._search_params(selector, self.index.nlist)
+                )
+
+            results = []
+            for score, vector_id in zip(scores[0], ids[0]):
+                if vector_id < 0 or int(vector_id) not in self.id_map:
+                    continue
+                key, position = self.id_map[int(vector_id)]
+                members = [doc_id for doc_id in self.members.get(key, [key]) if wanted is None or doc_id in wanted]
+                results.append({
+                    "document_id": members[0],
+                    "document_ids": members,
+                    "content_id": key,
+                    "position": position,
+                    "score": float(score)
+                })
+            return results
+
+    def _search_params(self, selector, nprobe: int):
+        if self.is_ivf:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+        return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+    def snapshot(self) -> Tuple[faiss.Index, Dict[str, Any]]:
+        """
+        複製索引與 ID 映射，供寫回磁碟使用
+
+        只在複製時持有鎖，序列化與寫檔期間搜索與更新不受阻擋
+        """
+        with self.lock:
+            state = {
+                'next_id': self.next_id,
+                'documents': {key: list(ids) for key, ids in self.vector_ids.items()},
+                'members': {key: list(doc_ids) for key, doc_ids in self.members.items()}
+            }
+            return faiss.clone_index(self.index), state
+
+    @classmethod
+    def from_state(cls, dim: int, index: faiss.Index, state: Dict[str, Any]) -> 'CorpusIndex':
+        corpus = cls(dim)
+        corpus.index = index
+        if corpus.is_ivf:
+            configure_search(corpus.index, nprobe=corpus.nprobe)
+        corpus.next_id = state.get('next_id', 0)
+        corpus.vector_ids = {key: list(ids) for key, ids in state.get('documents', {}).items()}
+        for key, ids in corpus.vector_ids.items():
+            for position, vector_id in enumerate(ids):
+                corpus.id_map[vector_id] = (key, position)
+        # 舊版語料每個文件各自保存向量
+        members = state.get('members') or {key: [key] for key in corpus.vector_ids}
+        corpus.members = {key: list(doc_ids) for key, doc_ids in members.items()}
+        # 舊版語料映射中的區塊內容（chunks）不再載入，下次寫回時一併移除
+        corpus.content_of = {doc_id: key for key, doc_ids in corpus.members.items() for doc_id in doc_ids}
+        return corpus
+
+    def estimate_bytes(self) -> int:
+        """估算佔用的記憶體（向量）"""
+        with self.lock:
+            return estimate_index_bytes(self.index)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'type': get_index_type(self.index),
+                'vectors': self.index.ntotal,
+                'documents': len(self.content_of),
+                'contents': len(self.vector_ids),
+                'bytes': estimate_index_bytes(self.index)
+            }
+
+
+class CorpusIndexManager:
+    """
+    管理所有使用者的語料索引
+
+    索引延遲從磁碟載入，常駐的語料受 CORPUS_CACHE_MAX_MB 限制，超出時淘汰最久未使用者；
+    變更後以 CORPUS_SAVE_INTERVAL 秒為間隔合併寫回，避免每次上傳都重寫整個大型索引。
+
+    多個 worker 行程共用同一份磁碟檔案：寫回時持有檔案鎖並先載入磁碟上的最新版本，
+    再套用本行程尚未寫回的變更；讀取時最多每 CORPUS_VERSION_CHECK_INTERVAL 秒檢查一次
+    檔案是否已被其他行程更新，有更新時重新載入。
+
+    載入、寫回與變更只持有該使用者的鎖；寫回時先在語料鎖內複製快照，再於鎖外寫檔，
+    其他使用者（以及同一使用者的搜索）不會被大型索引的寫入阻擋。
+    """
+
+    def __init__(self, dim: int, save_interval: float = None, max_bytes: int = None,
+                 version_check_interval: float = None):
+        self.dim = dim
+        self.save_interval = save_interval if save_interval is not None else \
+            float(os.getenv("CORPUS_SAVE_INTERVAL", "30"))
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("CORPUS_CACHE_MAX_MB", "256")) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.version_check_interval = version_check_interval if version_check_interval is not None else \
+            float(os.getenv("CORPUS_VERSION_CHECK_INTERVAL", "2"))
+        self.index_store = get_index_store()
+        self.corpora: "OrderedDict[str, CorpusIndex]" = OrderedDict()  # 順序即最近使用順序
+        self.versions: Dict[str, Any] = {}        # 載入時磁碟檔案的版本
+        self.checked_at: Dict[str, float] = {}    # 上次檢查磁碟版本的時間
+        self.pending: Dict[str, List[tuple]] = {}  # 尚未寫回磁碟的變更
+        self.dirty: set = set()
+        self.evictions = 0
+        self.lock = threading.RLock()  # 只保護上述字典，不在持有時做磁碟 I/O
+        self.owner_locks: Dict[str, threading.RLock] = {}
+        self._save_timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
+
+    def _owner_lock(self, owner: str) -> threading.RLock:
+        with self.lock:
+            lock = self.owner_locks.get(owner)
+            if lock is None:
+                lock = self.owner_locks[owner] = threading.RLock()
+            return lock
+
+    def _is_stale(self, owner: str) -> bool:
+        """磁碟上是否有其他行程寫入的新版本（每個使用者最多每 version_check_interval 秒檢查一次）"""
+        now = time.monotonic()
+        if now - self.checked_at.get(owner, float('-inf')) < self.version_check_interval:
+            return False
+        self.checked_at[owner] = now
+        return self.index_store.corpus_version(owner) != self.versions.get(owner)
+
+    def get(self, owner: str) -> CorpusIndex:
+        """獲取使用者的語料索引（未載入或磁碟上已有新版本時從磁碟載入）"""
+        if not owner:
+            raise ValueError("A user_id is required for corpus operations")
+        corpus = self.corpora.get(owner)
+        if corpus is None or self._is_stale(owner):
+            # 載入只阻擋同一使用者的請求
+            with self._owner_lock(owner):
+                corpus = self.corpora.get(owner)
+                if corpus is None or self.index_store.corpus_version(owner) != self.versions.get(owner):
+                    with self.index_store.corpus_lock(owner):
+                        corpus = self._load(owner)
+        with self.lock:
+            if owner in self.corpora:
+                self.corpora.move_to_end(owner)
+        self._evict(keep=owner)
+        return corpus
+
+    def _load(self, owner: str) -> CorpusIndex:
+        """載入磁碟上的版本並重新套用本行程尚未寫回的變更（呼叫者需持有使用者鎖與檔案鎖）"""
+        version = self.index_store.corpus_version(owner)
+        loaded = self.index_store.load_corpus(owner)
+        if loaded is not None:
+            index, state = loaded
+            corpus = CorpusIndex.from_state(self.dim, index, state)
+        else:
+            corpus = CorpusIndex(self.dim)
+        for operation in self.pending.get(owner, []):
+            self._apply(corpus, operation)
+        with self.lock:
+            self.corpora[owner] = corpus
+            self.versions[owner] = version
+            self.checked_at[owner] = time.monotonic()
+        return corpus
+
+    @staticmethod
+    def _apply(corpus: CorpusIndex, operation: tuple) -> bool:
+        if operation[0] == 'add':
+            _, doc_id, embeddings, content_id = operation
+            return corpus.add_document(doc_id, embeddings, content_id)
+        return corpus.remove_document(operation[1])
+
+    def _record(self, owner: str, operation: tuple):
+        with self._owner_lock(owner):
+            if not self._apply(self.get(owner), operation):
+                return
+            with self.lock:
+                self.pending.setdefault(owner, []).append(operation)
+        # 在使用者鎖外排程寫回，flush 不會在持有某個使用者鎖時等待其他使用者
+        self._mark_dirty(owner)
+
+    def add_document(self, doc_id: str, embeddings: Optional[np.ndarray], owner: Optional[str] = None,
+                     content_id: Optional[str] = None):
+        """
+        加入文件到使用者的語料（未指定使用者時不加入）
+
+        重複文件傳入 content_id：內容已在語料中時共用既有向量，embeddings 可為 None
+        """
+        if owner:
+            self._record(owner, ('add', doc_id, embeddings, content_id))
+
+    def has_content(self, owner: Optional[str], content_id: str) -> bool:
+        """使用者的語料中是否已有這份內容的向量"""
+        return bool(owner) and self.get(owner).has_content(content_id)
+
+    def remove_document(self, doc_id: str, owner: Optional[str] = None):
+        """從使用者的語料中移除文件"""
+        if owner:
+            self._record(owner, ('remove', doc_id))
+
+    def _mark_dirty(self, owner: str):
+        with self.lock:
+            self.dirty.add(owner)
+            if self.save_interval > 0:
+                if self._save_timer is None:
+                    self._save_timer = threading.Timer(self.save_interval, self.flush)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """將有變更的語料索引寫回磁碟"""
+        with self.lock:
+            owners, self.dirty = self.dirty, set()
+            self._save_timer = None
+        for owner in owners:
+            self._save(owner)
+
+    def _save(self, owner: str):
+        """持有檔案鎖合併寫回：其他行程已更新磁碟檔案時，先載入該版本再套用本行程的變更"""
+        try:
+            with self._owner_lock(owner), self.index_store.corpus_lock(owner):
+                corpus = self.corpora.get(owner)
+                if corpus is None or self.index_store.corpus_version(owner) != self.versions.get(owner):
+                    corpus = self._load(owner)
+                index, state = corpus.snapshot()
+                self.index_store.save_corpus(owner, index, state)
+                with self.lock:
+                    self.versions[owner] = self.index_store.corpus_version(owner)
+                    self.pending.pop(owner, None)
+        except Exception as e:
+            print(f"Failed to persist corpus index for {owner}: {e}")
+
+    def _evict(self, keep: str):
+        """超出記憶體預算時淘汰最久未使用的語料（先寫回未保存的變更；正在使用中的語料留待下次）"""
+        while True:
+            with self.lock:
+                if len(self.corpora) <= 1 or \
+                        sum(corpus.estimate_bytes() for corpus in self.corpora.values()) <= self.max_bytes:
+                    return
+                victim = next(owner for owner in self.corpora if owner != keep)
+            lock = self._owner_lock(victim)
+            if not lock.acquire(blocking=False):
+                return
+            try:
+                with self.lock:
+                    dirty = victim in self.dirty
+                    self.dirty.discard(victim)
+                if dirty:
+                    self._save(victim)
+                with self.lock:
+                    if self.pending.get(victim):
+                        return  # 寫回失敗，保留在記憶體中
+                    self.corpora.pop(victim, None)
+                    self.versions.pop(victim, None)
+                    self.checked_at.pop(victim, None)
+                    self.evictions += 1
+            finally:
+                lock.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            corpora = {owner: corpus.get_stats() for owner, corpus in self.corpora.items()}
+            return {
+                'corpora': corpora,
+                'current_bytes': sum(stats['bytes'] for stats in corpora.values()),
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions
+            }
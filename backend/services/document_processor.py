@@ -4,17 +4,181 @@
 """
 
 import os
-from typing import List, Dict, Any
+import math
+import bisect
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
 from PyPDF2 import PdfReader
 from docx import Document
+import numpy as np
 import tiktoken
 
+from .semantic_chunker import SemanticChunker, blocks_from_text, blocks_from_docx
+
+# 頁數達到門檻時，以行程池並行提取 PDF 各頁文字（每個工作行程各自開啟檔案）
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "50"))
+PDF_EXTRACT_MP_CONTEXT = os.getenv("PDF_EXTRACT_MP_CONTEXT", "spawn")
+
+# 串流讀取 TXT 時每次讀取的字元數（在換行處切開）
+TXT_STREAM_BLOCK_CHARS = 64 * 1024
+
+# 串流切片時暫存待編碼文字的上限：超過仍找不到安全切點（換行後接非空白）時直接編碼，
+# 此時切點附近的 token 可能與整份文字一次編碼的結果不同
+STREAM_ENCODE_MAX_CHARS = 1024 * 1024
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """提取 [start, end) 頁的文字（在工作行程中執行）"""
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def join_pages(pages: List[str]) -> Tuple[str, List[int]]:
+    """
+    以空行連接各頁文字
+
+    Returns:
+        (完整文字, 每頁在完整文字中的起始字元位置)
+    """
+    offsets = []
+    parts = []
+    position = 0
+    for page_text in pages:
+        offsets.append(position)
+        if page_text:
+            parts.append(page_text)
+            parts.append("\n\n")
+            position += len(page_text) + 2
+
+    joined = "".join(parts)
+    text = joined.strip()
+    leading = len(joined) - len(joined.lstrip())
+    return text, [min(max(offset - leading, 0), len(text)) for offset in offsets]
+
+
+def strip_pieces(pieces: Iterable[Tuple[int, str]]) -> Iterator[Tuple[int, str]]:
+    """
+    去除串流文字整體的開頭與結尾空白（與 join_pages / extract_text 的 strip() 相同）
+
+    結尾的空白先保留，之後出現非空白文字時才連同原本的頁碼一起產生，
+    因此各段串接後等於 "".join(texts).strip()，頁面邊界也與 join_pages 一致
+    """
+    started = False
+    pending: List[Tuple[int, str]] = []  # 尚未確定是否位於結尾的空白
+    for page_number, text in pieces:
+        if not started:
+            text = text.lstrip()
+            if not text:
+                continue
+            started = True
+        body = text.rstrip()
+        if body:
+            yield from pending
+            pending = []
+            yield page_number, body
+        if len(body) < len(text):
+            pending.append((page_number, text[len(body):]))
+
+
+def _safe_cut(text: str) -> int:
+    """
+    最後一個「換行後接非空白字元」的位置（找不到時返回 0）
+
+    cl100k 的預分詞不會跨越這種位置，在此切開分別編碼與整份文字一次編碼的 token 相同
+    """
+    position = text.rfind("\n")
+    while position != -1:
+        if position + 1 < len(text) and not text[position + 1].isspace():
+            return position + 1
+        position = text.rfind("\n", 0, position)
+    return 0
+
+
+def reconstruct_from_offsets(chunks: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    依區塊的 start_byte / end_byte 拼接出原文，每個位置只取一次，結果與原文完全相同
+
+    區塊邊界切斷多位元組字元時，區塊邊緣會是替換字元，該字元在相鄰區塊的重疊區間內是完整的
+
+    Returns:
+        原文；有區塊缺少位元組位置或位置之間有空缺時返回 None
+    """
+    if not chunks or any(chunk.get("start_byte") is None for chunk in chunks):
+        return None
+
+    data = bytearray()
+    for chunk in chunks:
+        content = chunk["content"]
+        middle = content.strip('\ufffd')
+        # 開頭每個孤立的續位元組各解碼為一個替換字元
+        start = chunk["start_byte"] + len(content) - len(content.lstrip('\ufffd'))
+        if start > len(data):
+            return None
+        data += middle.encode('utf-8')[len(data) - start:]
+    return data.decode('utf-8')
+
+
+def reconstruct_text(chunks: List[Dict[str, Any]], overlap_ratio: float = 0.2) -> str:
+    """
+    由區塊還原全文（磁碟上沒有保存全文時的後備方案，例如從 Supabase 重建的舊文件）
+
+    - 帶 start_byte / end_byte 的區塊：見 reconstruct_from_offsets，結果與原文相同
+    - 其他區塊：以相鄰區塊的重疊接上（重複文字有多個候選時，取最接近 overlap_ratio 的一個）；
+      沒有重疊（語義區塊）時以空行連接。結果只是近似值，重複出現的段落可能被多接一次
+    """
+    if not chunks:
+        return ""
+
+    exact = reconstruct_from_offsets(chunks)
+    if exact is not None:
+        return exact
+
+    texts = [chunks[0]["content"]]
+    previous = chunks[0]["content"]
+    for chunk in chunks[1:]:
+        content = chunk["content"]
+        head, tail = previous.rstrip('\ufffd'), content.lstrip('\ufffd')
+        overlap = _overlap_length(head, tail, int(len(tail) * overlap_ratio))
+        if overlap:
+            dropped = len(previous) - len(head)
+            if dropped:
+                texts[-1] = texts[-1][:-dropped]
+            texts.append(tail[overlap:])
+        else:
+            texts.append("\n\n" + content)
+        previous = content
+    return "".join(texts)
+
+
+def _overlap_length(previous: str, current: str, expected: int, probe_chars: int = 16) -> int:
+    """previous 的結尾與 current 的開頭重疊的長度（有多個候選時取最接近 expected 者）"""
+    window = previous[-len(current):]
+    probe = current[:probe_chars]
+    best = 0
+    position = window.find(probe)
+    while position != -1:
+        length = len(window) - position
+        if current.startswith(window[position:]) and (not best or abs(length - expected) < abs(best - expected)):
+            best = length
+        position = window.find(probe, position + 1)
+    return best
+
 
 class DocumentProcessor:
     def __init__(self):
         self.encoding = tiktoken.get_encoding("cl100k_base")
         self.chunk_size = 1000  # tokens per chunk
         self.chunk_overlap = 200  # overlap tokens
+        # tokens：固定 token 視窗；semantic：依段落/標題/句子/表格切分（見 semantic_chunker）
+        self.chunking_strategy = os.getenv("CHUNKING_STRATEGY", "tokens").lower()
+        if self.chunking_strategy not in ('tokens', 'semantic'):
+            raise ValueError(f"Unsupported chunking strategy: {self.chunking_strategy}")
+        self._token_bytes: Optional[np.ndarray] = None  # 每個 token id 的 UTF-8 位元組長度
+        self._token_bytes_lock = threading.Lock()
     
     def extract_text(self, file_path: str) -> str:
         """
@@ -38,18 +202,119 @@ class DocumentProcessor:
         else:
             raise ValueError(f"Unsupported file type: {ext}")
     
+    def extract_pages(self, file_path: str) -> List[str]:
+        """
+        逐頁提取文字（保留頁面邊界，供區塊標記頁碼）
+
+        Returns:
+            每頁的文字；非 PDF 文件視為單一頁
+        """
+        _, ext = os.path.splitext(file_path)
+        if ext.lower() == '.pdf':
+            return self._extract_pdf_pages(file_path)
+        return [self.extract_text(file_path)]
+    
     def _extract_from_pdf(self, file_path: str) -> str:
         """從 PDF 提取文字"""
-        text = ""
+        text, _ = join_pages(self._extract_pdf_pages(file_path))
+        return text
+    
+    def _extract_pdf_pages(self, file_path: str) -> List[str]:
+        """提取 PDF 每頁的文字；大型文件將頁面範圍分給行程池並行處理"""
         try:
             reader = PdfReader(file_path)
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
+            num_pages = len(reader.pages)
+            if num_pages < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS <= 1:
+                return [page.extract_text() or "" for page in reader.pages]
+            
+            # 切成約 2 × 工作行程數的連續範圍，平衡各頁處理時間的差異
+            step = math.ceil(num_pages / (PDF_EXTRACT_WORKERS * 2))
+            ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+            pool = _get_pdf_pool()
+            futures = [pool.submit(_extract_pdf_page_range, file_path, start, end) for start, end in ranges]
+            return [page_text for future in futures for page_text in future.result()]
         except Exception as e:
             raise Exception(f"Failed to extract text from PDF: {str(e)}")
-        return text.strip()
+    
+    def iter_pages(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        """
+        串流提取文字，逐段產生 (頁碼, 文字)，不保留完整文件
+
+        PDF 每頁一段（大型文件以行程池預先提取後續頁面）；
+        DOCX 逐段落、TXT 逐區塊產生，頁碼固定為 1。
+        各段之間已包含與 extract_text 相同的分隔字元；
+        整份文字的開頭與結尾空白由 strip_pieces 去除。
+        """
+        _, ext = os.path.splitext(file_path)
+        ext = ext.lower()
+        
+        if ext == '.pdf':
+            yield from self._iter_pdf_pages(file_path)
+        elif ext in ['.docx', '.doc']:
+            doc = Document(file_path)
+            for para in doc.paragraphs:
+                yield 1, para.text + "\n"
+            for table in doc.tables:
+                for row in table.rows:
+                    yield 1, "".join(cell.text + " " for cell in row.cells) + "\n"
+        elif ext == '.txt':
+            yield from self._iter_txt_blocks(file_path)
+        else:
+            raise ValueError(f"Unsupported file type: {ext}")
+    
+    def _iter_pdf_pages(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        try:
+            reader = PdfReader(file_path)
+            num_pages = len(reader.pages)
+            if num_pages < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS <= 1:
+                pages = ((i + 1, reader.pages[i].extract_text() or "") for i in range(num_pages))
+                for page_number, page_text in pages:
+                    if page_text:
+                        yield page_number, page_text + "\n\n"
+                return
+            
+            # 以較小的範圍提交，最多同時進行 2 × 工作行程數個範圍，依序取回
+            step = max(1, min(8, math.ceil(num_pages / (PDF_EXTRACT_WORKERS * 2))))
+            ranges = deque((start, min(start + step, num_pages)) for start in range(0, num_pages, step))
+            pool = _get_pdf_pool()
+            pending = deque()
+            while ranges or pending:
+                while ranges and len(pending) < PDF_EXTRACT_WORKERS * 2:
+                    start, end = ranges.popleft()
+                    pending.append((start, pool.submit(_extract_pdf_page_range, file_path, start, end)))
+                start, future = pending.popleft()
+                for offset, page_text in enumerate(future.result()):
+                    if page_text:
+                        yield start + offset + 1, page_text + "\n\n"
+        except Exception as e:
+            raise Exception(f"Failed to extract text from PDF: {str(e)}")
+    
+    def _iter_txt_blocks(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        for encoding in ('utf-8', 'latin-1'):
+            try:
+                with open(file_path, 'r', encoding=encoding) as f:
+                    # 先完整解碼一次確認編碼，避免產生一半後才失敗
+                    if encoding == 'utf-8':
+                        while f.read(TXT_STREAM_BLOCK_CHARS):
+                            pass
+                        f.seek(0)
+                    carry = ""
+                    while True:
+                        block = f.read(TXT_STREAM_BLOCK_CHARS)
+                        if not block:
+                            break
+                        block = carry + block
+                        cut = block.rfind("\n") + 1
+                        if cut == 0:
+                            carry = block
+                            continue
+                        carry = block[cut:]
+                        yield 1, block[:cut]
+                    if carry:
+                        yield 1, carry
+                return
+            except UnicodeDecodeError:
+                continue
     
     def _extract_from_docx(self, file_path: str) -> str:
         """從 DOCX 提取文字"""
@@ -83,6 +348,31 @@ class DocumentProcessor:
         """計算文字的 token 數量"""
         return len(self.encoding.encode(text))
     
+    def tokenize(self, text: str) -> List[int]:
+        """將文字編碼為 token 列表（供統計與切片共用，避免重複編碼）"""
+        return self.encoding.encode(text)
+    
+    def encode_array(self, text: str) -> np.ndarray:
+        """將文字編碼為 int32 token 陣列（不建立 Python 整數列表）"""
+        encode_to_numpy = getattr(self.encoding, 'encode_to_numpy', None)
+        if encode_to_numpy is not None:
+            return encode_to_numpy(text).view(np.int32)
+        return np.asarray(self.encoding.encode(text), dtype=np.int32)
+    
+    def _token_byte_lengths(self) -> np.ndarray:
+        """所有 token id 的位元組長度查表（每個行程建立一次）"""
+        if self._token_bytes is None:
+            with self._token_bytes_lock:
+                if self._token_bytes is None:
+                    lengths = np.zeros(self.encoding.n_vocab, dtype=np.int64)
+                    for token in range(self.encoding.n_vocab):
+                        try:
+                            lengths[token] = len(self.encoding.decode_single_token_bytes(token))
+                        except KeyError:
+                            pass  # 詞表中未使用的 id
+                    self._token_bytes = lengths
+        return self._token_bytes
+    
     def split_into_chunks(self, text: str) -> List[Dict[str, Any]]:
         """
         將文字分割成區塊用於嵌入
@@ -93,7 +383,82 @@ class DocumentProcessor:
         Returns:
             區塊列表，每個區塊包含 content 和 metadata
         """
-        tokens = self.encoding.encode(text)
+        if self.chunking_strategy == 'semantic':
+            return self.split_semantic(text)
+        return self.split_text_into_chunks(text)
+    
+    def split_semantic(self, text: str, page_offsets: Optional[List[int]] = None,
+                       file_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        結構感知切分：區塊不跨越標題、不在句中截斷，表格依列分組
+        
+        Args:
+            text: 完整文字
+            page_offsets: 每頁起始字元位置（PDF），用於標記 page_start / page_end
+            file_path: 原始文件；DOCX 會直接讀取段落樣式與表格結構
+        
+        Returns:
+            區塊列表，另含 page_start、page_end、section（標題路徑）
+        """
+        if file_path and os.path.splitext(file_path)[1].lower() == '.docx':
+            blocks = blocks_from_docx(file_path)
+        else:
+            blocks = blocks_from_text(text, page_offsets)
+        
+        chunker = SemanticChunker(self.count_tokens, self.encoding.encode, self.encoding.decode)
+        return chunker.chunk(blocks)
+    
+    def split_text_into_chunks(self, text: str, tokens: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        以向量化運算切分區塊：只編碼一次，不逐區塊呼叫 decode
+        
+        token 的位元組長度累加後即為每個 token 在 UTF-8 文字中的位元組位置，
+        區塊內容直接從原文位元組切出（與 encoding.decode 結果相同），重疊部分不會重複解碼
+        
+        Args:
+            text: 完整文字
+            tokens: encode_array 的結果（已編碼時傳入以避免重複編碼）
+        
+        Returns:
+            與 split_tokens_into_chunks 相同的區塊，另含 start_byte / end_byte
+        """
+        if tokens is None:
+            tokens = self.encode_array(text)
+        num_tokens = len(tokens)
+        if num_tokens == 0:
+            return []
+        
+        byte_offsets = np.zeros(num_tokens + 1, dtype=np.int64)
+        np.cumsum(self._token_byte_lengths()[tokens], out=byte_offsets[1:])
+        
+        starts = np.arange(0, num_tokens, self.chunk_size - self.chunk_overlap, dtype=np.int64)
+        ends = np.minimum(starts + self.chunk_size, num_tokens)
+        start_bytes = byte_offsets[starts].tolist()
+        end_bytes = byte_offsets[ends].tolist()
+        
+        data = text.encode('utf-8')
+        return [{
+            "content": data[start_byte:end_byte].decode('utf-8', errors='replace'),
+            "chunk_index": chunk_index,
+            "token_count": end - start,
+            "start_token": start,
+            "end_token": end,
+            "start_byte": start_byte,
+            "end_byte": end_byte
+        } for chunk_index, (start, end, start_byte, end_byte) in enumerate(
+            zip(starts.tolist(), ends.tolist(), start_bytes, end_bytes)
+        )]
+    
+    def split_tokens_into_chunks(self, tokens: List[int]) -> List[Dict[str, Any]]:
+        """
+        將已編碼的 token 列表分割成區塊
+        
+        Args:
+            tokens: 完整文字的 token 列表
+        
+        Returns:
+            區塊列表，每個區塊包含 content 和 metadata
+        """
         chunks = []
         
         start = 0
@@ -122,28 +487,180 @@ class DocumentProcessor:
         
         return chunks
     
-    def get_document_info(self, file_path: str) -> Dict[str, Any]:
+    def iter_chunks(self, pieces: Iterable[Tuple[int, str]]) -> Iterator[Dict[str, Any]]:
         """
-        獲取文件資訊
+        以滑動 token 視窗將串流文字切成區塊，結果與 split_text_into_chunks + assign_pages 相同
+
+        文字暫存到安全切點（見 _safe_cut）才編碼，因此 token 序列與整份文字一次編碼相同；
+        只保留目前視窗內的 token 與位元組，累積滿 chunk_size 即產生區塊並前進
+        chunk_size - chunk_overlap 個 token，最後一個起點之後的區塊與批次模式一樣全部產生。
+        
+        Args:
+            pieces: strip_pieces(iter_pages(...)) 產生的 (頁碼, 文字)
+        
+        Yields:
+            與 split_text_into_chunks 相同的區塊，另含 page_start / page_end
+        """
+        lookup = self._token_byte_lengths()
+        step = self.chunk_size - self.chunk_overlap
+        tokens: List[int] = []     # 視窗內的 token
+        data = bytearray()         # 視窗內 token 的 UTF-8 位元組
+        window_start = 0           # 視窗第一個 token 在全文中的位置
+        window_start_byte = 0
+        page_bytes: List[int] = [] # 每頁起始位元組位置
+        received_bytes = 0
+        buffer = ""                # 等待安全切點的文字
+        chunk_index = 0
+        
+        def byte_length(count: int) -> int:
+            return int(lookup[np.asarray(tokens[:count], dtype=np.int64)].sum())
+        
+        def make_chunk(length: int) -> Dict[str, Any]:
+            end_byte = window_start_byte + byte_length(length)
+            return {
+                "content": bytes(data[:end_byte - window_start_byte]).decode('utf-8', errors='replace'),
+                "chunk_index": chunk_index,
+                "token_count": length,
+                "start_token": window_start,
+                "end_token": window_start + length,
+                "start_byte": window_start_byte,
+                "end_byte": end_byte,
+                "page_start": bisect.bisect_right(page_bytes, window_start_byte),
+                "page_end": bisect.bisect_right(page_bytes, max(end_byte - 1, window_start_byte))
+            }
+        
+        def advance():
+            nonlocal window_start, window_start_byte
+            dropped = byte_length(step)
+            del tokens[:step]
+            del data[:dropped]
+            window_start += step
+            window_start_byte += dropped
+        
+        def encode(text: str):
+            tokens.extend(self.encoding.encode(text))
+            data.extend(text.encode('utf-8'))
+        
+        for page_number, text in pieces:
+            if page_number > len(page_bytes):
+                # 沒有文字的頁面與下一頁從同一位置開始（與 join_pages 相同）
+                page_bytes.extend([received_bytes] * (page_number - len(page_bytes)))
+            received_bytes += len(text.encode('utf-8'))
+            
+            buffer += text
+            cut = _safe_cut(buffer)
+            if not cut and len(buffer) > STREAM_ENCODE_MAX_CHARS:
+                cut = len(buffer)
+            if cut:
+                encode(buffer[:cut])
+                buffer = buffer[cut:]
+            
+            while len(tokens) >= self.chunk_size:
+                yield make_chunk(self.chunk_size)
+                chunk_index += 1
+                advance()
+        
+        encode(buffer)
+        while len(tokens) >= self.chunk_size:
+            yield make_chunk(self.chunk_size)
+            chunk_index += 1
+            advance()
+        # 剩餘的每個起點（包括完全落在前一區塊重疊內的最後一段）
+        while tokens:
+            yield make_chunk(len(tokens))
+            chunk_index += 1
+            if len(tokens) <= step:
+                break
+            advance()
+    
+    def assign_pages(self, chunks: List[Dict[str, Any]], text: str, page_offsets: List[int]):
+        """
+        依各頁起始位置為區塊標記頁碼（page_start / page_end，從 1 開始）
+        
+        Args:
+            chunks: split_text_into_chunks 產生的區塊（使用 start_byte / end_byte，原地更新）
+            text: 完整文字
+            page_offsets: join_pages 返回的每頁起始字元位置
+        """
+        if not chunks or not page_offsets:
+            return
+        
+        # 字元位置轉為位元組位置（逐頁累加，只編碼一次全文）
+        page_bytes = [0]
+        for previous, offset in zip(page_offsets, page_offsets[1:]):
+            page_bytes.append(page_bytes[-1] + len(text[previous:offset].encode('utf-8')))
+        
+        for chunk in chunks:
+            chunk["page_start"] = bisect.bisect_right(page_bytes, chunk["start_byte"])
+            chunk["page_end"] = bisect.bisect_right(page_bytes, max(chunk["end_byte"] - 1, chunk["start_byte"]))
+    
+    def get_document_stats(self, file_path: str, text: str, total_tokens: int,
+                           chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        根據已解析的內容計算文件資訊（不重新提取或編碼）
         
         Args:
             file_path: 文件路徑
+            text: 已提取的文字
+            total_tokens: 全文的 token 數
+            chunks: 已切分的區塊
         
         Returns:
             文件資訊字典
         """
-        text = self.extract_text(file_path)
-        chunks = self.split_into_chunks(text)
-        
         return {
             "total_characters": len(text),
-            "total_tokens": self.count_tokens(text),
+            "total_tokens": total_tokens,
             "total_chunks": len(chunks),
             "file_size": os.path.getsize(file_path),
             "file_name": os.path.basename(file_path)
         }
+    
+    def get_document_info(self, file_path: str) -> Dict[str, Any]:
+        """
+        獲取文件資訊
+        
+        Args:
+            file_path: 文件路徑
+        
+        Returns:
+            文件資訊字典
+        """
+        text = self.extract_text(file_path)
+        tokens = self.encode_array(text)
+        if self.chunking_strategy == 'semantic':
+            chunks = self.split_semantic(text, file_path=file_path)
+        else:
+            chunks = self.split_text_into_chunks(text, tokens)
+        
+        return self.get_document_stats(file_path, text, len(tokens), chunks)
+
+
+# PDF 提取行程池（延遲建立；gunicorn fork 後由 prefork.after_fork 重置）
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                # 預設 spawn：服務行程已有多個執行緒（攝取佇列、嵌入批次、寫入池），
+                # fork 可能複製到被其他執行緒持有的鎖而卡死；PDF_EXTRACT_MP_CONTEXT 可改為 forkserver
+                context = multiprocessing.get_context(PDF_EXTRACT_MP_CONTEXT)
+                _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=context)
+    return _pdf_pool
+
 
+# 單例實例（處理器無可變狀態，tiktoken 編碼器可跨執行緒共用）
+_document_processor: Optional[DocumentProcessor] = None
+_document_processor_lock = threading.Lock()
 
 def get_document_processor() -> DocumentProcessor:
     """獲取文件處理器實例"""
-    return DocumentProcessor()
+    global _document_processor
+    if _document_processor is None:
+        with _document_processor_lock:
+            if _document_processor is None:
+                _document_processor = DocumentProcessor()
+    return _document_processor
@@ -0,0 +1,184 @@
+"""
+文件去重登記表
+記錄每個文件的檔案雜湊與正規化文字雜湊，以及重複文件指向的內容來源
+重複上傳時直接重用既有的區塊、嵌入與 FAISS 索引
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Optional
+
+from .embedding_cache import normalize_text
+
+
+def file_sha256(file_path: str) -> str:
+    """計算檔案位元組的 SHA-256（分段讀取）"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    """計算正規化文字的 SHA-256"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class TextHasher:
+    """
+    分段計算與 text_sha256 相同的雜湊（串流攝取時不保留完整文字）
+
+    各段先做 NFKC 與空白合併；跨段的空白延後到下一段有內容時才寫入，
+    以符合整份文字 strip 後的結果
+    """
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.started = False
+        self.pending_space = False
+
+    def update(self, text: str):
+        normalized = normalize_text(text)
+        if not normalized:
+            self.pending_space = self.pending_space or (self.started and bool(text))
+            return
+        if self.started and (self.pending_space or text[:1].isspace()):
+            self.digest.update(b' ')
+        self.digest.update(normalized.encode('utf-8'))
+        self.started = True
+        self.pending_space = text[-1:].isspace()
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+
+class DocumentRegistry:
+    """
+    文件雜湊與內容來源的本地登記表（SQLite）
+
+    source_doc_id 為 NULL 表示該文件擁有自己的索引；
+    否則表示內容與 source_doc_id 相同，共用其索引。
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            from .index_store import get_index_store
+            path = os.path.join(get_index_store().base_dir, 'documents.sqlite3')
+        self.path = path
+
+        self.reopen()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                file_hash TEXT,
+                text_hash TEXT,
+                source_doc_id TEXT,
+                total_characters INTEGER,
+                total_tokens INTEGER,
+                total_chunks INTEGER
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS documents_file_hash_idx ON documents(file_hash)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS documents_text_hash_idx ON documents(text_hash)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS documents_source_idx ON documents(source_doc_id)")
+        self.conn.commit()
+
+    def reopen(self):
+        """建立新的 SQLite 連線（fork 後的子行程不可沿用父行程的連線）"""
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+
+    def register(self, doc_id: str, file_hash: Optional[str], text_hash: Optional[str],
+                 stats: Dict[str, Any], source_doc_id: Optional[str] = None):
+        """登記文件（重複文件需指定 source_doc_id）"""
+        with self.lock:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO documents
+                   (doc_id, file_hash, text_hash, source_doc_id, total_characters, total_tokens, total_chunks)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (doc_id, file_hash, text_hash, source_doc_id,
+                 stats.get('total_characters'), stats.get('total_tokens'), stats.get('total_chunks'))
+            )
+            self.conn.commit()
+
+    def find(self, file_hash: Optional[str] = None, text_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        依檔案雜湊或文字雜湊查找既有內容
+
+        Returns:
+            {"content_document_id", "total_characters", "total_tokens", "total_chunks"}，找不到時返回 None
+        """
+        if file_hash:
+            column, value = 'file_hash', file_hash
+        elif text_hash:
+            column, value = 'text_hash', text_hash
+        else:
+            return None
+
+        with self.lock:
+            row = self.conn.execute(
+                f"""SELECT COALESCE(source_doc_id, doc_id), total_characters, total_tokens, total_chunks
+                    FROM documents WHERE {column} = ? LIMIT 1""",
+                (value,)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return {
+            'content_document_id': row[0],
+            'total_characters': row[1],
+            'total_tokens': row[2],
+            'total_chunks': row[3]
+        }
+
+    def resolve(self, doc_id: str) -> Optional[str]:
+        """返回文件的內容來源 ID；未登記時返回 None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COALESCE(source_doc_id, doc_id) FROM documents WHERE doc_id = ?",
+                (doc_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def remove(self, doc_id: str) -> Optional[str]:
+        """
+        移除文件登記
+
+        若該文件的內容仍被其他重複文件引用，將第一個重複文件提升為新的內容來源
+
+        Returns:
+            新的內容來源 ID（呼叫者需將索引檔轉移給它）；沒有引用時返回 None
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            row = self.conn.execute(
+                "SELECT doc_id FROM documents WHERE source_doc_id = ? ORDER BY rowid LIMIT 1",
+                (doc_id,)
+            ).fetchone()
+            new_owner = row[0] if row else None
+            if new_owner:
+                self.conn.execute("UPDATE documents SET source_doc_id = NULL WHERE doc_id = ?", (new_owner,))
+                self.conn.execute(
+                    "UPDATE documents SET source_doc_id = ? WHERE source_doc_id = ?",
+                    (new_owner, doc_id)
+                )
+            self.conn.commit()
+        return new_owner
+
+
+# 單例實例
+_document_registry: Optional[DocumentRegistry] = None
+_document_registry_lock = threading.Lock()
+
+def get_document_registry() -> DocumentRegistry:
+    """獲取文件去重登記表實例"""
+    global _document_registry
+    if _document_registry is None:
+        with _document_registry_lock:
+            if _document_registry is None:
+                _document_registry = DocumentRegistry()
+    return _document_registry
@@ -0,0 +1,121 @@
+"""
+嵌入推論後端
+EMBEDDING_MODEL 可加上前綴選擇後端：
+
+    shibing624/text2vec-base-chinese            PyTorch（SentenceTransformer，預設）
+    onnx:shibing624/text2vec-base-chinese       ONNX Runtime（fp32）
+    onnx-int8:shibing624/text2vec-base-chinese  ONNX Runtime + 動態 int8 量化
+
+ONNX 後端需要 sentence-transformers>=3.2 以及 onnxruntime、optimum（pip install "sentence-transformers[onnx]"）
+"""
+
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+# 量化模型的輸出目錄（只需匯出一次）
+ONNX_EXPORT_DIR = os.getenv(
+    "EMBEDDING_ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'onnx')
+)
+
+
+def parse_model_spec(spec: str) -> Tuple[str, str]:
+    """將 EMBEDDING_MODEL 拆成 (後端, 模型名稱)"""
+    prefix, sep, name = spec.partition(':')
+    if sep and prefix in BACKENDS:
+        return prefix, name
+    return 'torch', spec
+
+
+class SentenceTransformerBackend:
+    """PyTorch 推論（原本的實作）"""
+
+    backend = 'torch'
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.model = self._load(model_name)
+
+    def _load(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """批次編碼並正規化"""
+        return self.model.encode(
+            texts,
+            convert_to_numpy=True,
+            normalize_embeddings=True,  # 自動正規化
+            show_progress_bar=len(texts) > 10  # 大量文字時顯示進度
+        )
+
+
+class OnnxBackend(SentenceTransformerBackend):
+    """ONNX Runtime 推論（CPU 上通常比 PyTorch 快）"""
+
+    backend = 'onnx'
+
+    def _load(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        try:
+            return SentenceTransformer(model_name, backend='onnx')
+        except (ImportError, TypeError) as e:
+            raise ImportError(
+                'ONNX embedding backend requires sentence-transformers>=3.2 with onnxruntime and optimum '
+                '(pip install "sentence-transformers[onnx]")'
+            ) from e
+
+
+class QuantizedOnnxBackend(OnnxBackend):
+    """
+    ONNX Runtime + 動態 int8 量化
+
+    首次使用時匯出 fp32 ONNX 模型並量化，存放於 EMBEDDING_ONNX_DIR；
+    EMBEDDING_ONNX_QUANTIZATION 指定目標指令集（avx2、avx512、avx512_vnni、arm64）
+    """
+
+    backend = 'onnx-int8'
+
+    def _load(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        config = os.getenv("EMBEDDING_ONNX_QUANTIZATION", "avx2")
+        export_dir = os.path.join(ONNX_EXPORT_DIR, model_name.replace('/', '__'))
+        file_name = f"onnx/model_qint8_{config}.onnx"
+
+        if not os.path.exists(os.path.join(export_dir, file_name)):
+            try:
+                from sentence_transformers import export_dynamic_quantized_onnx_model
+            except ImportError as e:
+                raise ImportError(
+                    'int8 ONNX embedding backend requires sentence-transformers>=3.2 with onnxruntime and optimum '
+                    '(pip install "sentence-transformers[onnx]")'
+                ) from e
+
+            print(f"匯出並量化 ONNX 模型: {model_name} ({config})")
+            base = super()._load(model_name)
+            base.save(export_dir)
+            export_dynamic_quantized_onnx_model(base, config, export_dir)
+
+        return SentenceTransformer(export_dir, backend='onnx', model_kwargs={'file_name': file_name})
+
+
+_BACKEND_CLASSES = {
+    'torch': SentenceTransformerBackend,
+    'onnx': OnnxBackend,
+    'onnx-int8': QuantizedOnnxBackend
+}
+
+
+def create_embedding_backend(spec: str) -> SentenceTransformerBackend:
+    """依 EMBEDDING_MODEL 建立推論後端"""
+    backend, model_name = parse_model_spec(spec)
+    return _BACKEND_CLASSES[backend](model_name)
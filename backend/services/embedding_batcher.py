@@ -0,0 +1,119 @@
+"""
+嵌入微批次處理
+收集多個並行請求的查詢文字，等待數毫秒後合併成一個批次送入模型編碼，
+再把結果分發回各請求；CPU 上單筆編碼的固定開銷因此被多個請求分攤
+"""
+
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Dict, Any, Callable, Optional
+
+import numpy as np
+
+# 統計最近多少個批次
+_STATS_WINDOW = 1000
+
+
+class EmbeddingBatcher:
+    """
+    單一背景執行緒的微批次編碼器
+
+    Args:
+        encode_fn: 實際的批次編碼函數（texts -> 向量陣列）
+        max_batch_size: 每批最多的文字數（預設讀取 EMBEDDING_BATCH_MAX_SIZE）
+        max_wait_ms: 收到第一筆後最多等待的毫秒數（預設讀取 EMBEDDING_BATCH_MAX_WAIT_MS）
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray],
+                 max_batch_size: int = None, max_wait_ms: float = None):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else
+                         float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))) / 1000.0
+
+        self.queue: "queue.Queue" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+        self.batches = 0
+        self.texts = 0
+        self.batch_sizes = deque(maxlen=_STATS_WINDOW)
+        self.waits_ms = deque(maxlen=_STATS_WINDOW)
+
+    def _ensure_started(self):
+        # 延遲啟動：gunicorn 主行程預載時不會建立執行緒
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+                    self.thread.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """排入文字並等待所在批次編碼完成"""
+        future: Future = Future()
+        self._ensure_started()
+        self.queue.put((texts, future, time.monotonic()))
+        return future.result()
+
+    def _loop(self):
+        carry = None  # 放不進上一批的請求，作為下一批的第一筆
+        while True:
+            first = carry if carry is not None else self.queue.get()
+            carry = None
+            batch = [first]
+            size = len(first[0])
+            deadline = time.monotonic() + self.max_wait
+
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                # 加入後會超過上限時留給下一批（單筆本身超過上限時仍單獨成批）
+                if size + len(item[0]) > self.max_batch_size:
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            self._run(batch)
+
+    def _run(self, batch: list):
+        started = time.monotonic()
+        texts = [text for item in batch for text in item[0]]
+        try:
+            embeddings = self.encode_fn(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for item_texts, future, _ in batch:
+            future.set_result(embeddings[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+
+        with self.lock:
+            self.batches += 1
+            self.texts += len(texts)
+            self.batch_sizes.append(len(texts))
+            self.waits_ms.extend((started - enqueued) * 1000 for _, _, enqueued in batch)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            sizes = list(self.batch_sizes)
+            waits = list(self.waits_ms)
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self.queue.qsize(),
+                'batches': self.batches,
+                'texts': self.texts,
+                'avg_batch_size': round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+                'avg_wait_ms': round(sum(waits) / len(waits), 2) if waits else 0.0
+            }
@@ -0,0 +1,276 @@
+"""
+嵌入向量快取
+以 (模型名稱, 正規化區塊文字雜湊) 為鍵，將向量存放在本地 SQLite
+同一份講義被多位學生上傳時，重複區塊可直接跳過模型編碼；
+超過筆數或容量上限時淘汰最久未使用的向量
+"""
+
+import os
+import re
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """正規化文字：NFKC（全形/半形統一）並合併空白"""
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def text_hash(text: str) -> bytes:
+    """正規化文字的 SHA-256 雜湊"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).digest()
+
+
+# 超出上限時淘汰到上限的此比例，避免每次寫入都觸發淘汰
+_PRUNE_TARGET_RATIO = 0.9
+
+# 命中時只在記錄的使用時間早於此秒數時才更新（LRU 不需要秒級精度，避免每次查詢都寫入）
+_TOUCH_INTERVAL = 60
+
+
+class EmbeddingCache:
+    """
+    內容定址的嵌入快取（SQLite 存儲 float32 向量）
+
+    每筆記錄最後使用的時間，寫入後超過 max_entries 或 max_bytes 時依 LRU 淘汰；
+    淘汰後釋放的頁面由後續寫入重複使用，檔案不再無限成長
+
+    筆數與容量以計數器追蹤（開啟時讀取一次，寫入與淘汰時更新），
+    計數器超出上限時才重新計算實際數量（包含其他 worker 行程的寫入）並淘汰
+
+    Args:
+        path: SQLite 檔案路徑（預設讀取 EMBEDDING_CACHE_PATH）
+        max_entries: 最多保留的向量數（預設讀取 EMBEDDING_CACHE_MAX_ENTRIES，0 為不限制）
+        max_bytes: 向量資料的容量上限（預設讀取 EMBEDDING_CACHE_MAX_MB，0 為不限制）
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None, max_bytes: int = None):
+        self.path = path or os.getenv(
+            "EMBEDDING_CACHE_PATH",
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'embeddings.sqlite3')
+        )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.max_entries = max_entries if max_entries is not None else \
+            int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+        self.max_bytes = max_bytes
+
+        self.reopen()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash BLOB NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+        """)
+        # 舊版資料表沒有 last_used，視為最久未使用
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(embeddings)")]
+        if 'last_used' not in columns:
+            self.conn.execute("ALTER TABLE embeddings ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used_idx ON embeddings (last_used)")
+        self.conn.commit()
+        self._count_entries()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def reopen(self):
+        """建立新的 SQLite 連線（fork 後的子行程不可沿用父行程的連線）"""
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def _count_entries(self):
+        """重新計算實際的筆數與容量（全表掃描，只在開啟與即將淘汰時執行）"""
+        self.entry_count, self.total_bytes = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+
+    def get_many(self, model: str, texts: List[str]) -> Tuple[Dict[int, np.ndarray], List[bytes]]:
+        """
+        查詢多段文字的快取向量
+
+        Args:
+            model: 模型名稱
+            texts: 文字列表
+
+        Returns:
+            ({文字位置: 向量}, 每段文字的雜湊)
+        """
+        hashes = [text_hash(text) for text in texts]
+        unique = list(set(hashes))
+        found: Dict[bytes, np.ndarray] = {}
+        stale: List[bytes] = []
+        now = int(time.time())
+        stale_before = now - _TOUCH_INTERVAL
+
+        with self.lock:
+            # SQLite 參數數量有上限，分批查詢
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector, last_used FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for hash_value, vector, last_used in rows:
+                    found[bytes(hash_value)] = np.frombuffer(vector, dtype=np.float32)
+                    if last_used < stale_before:
+                        stale.append(bytes(hash_value))
+
+            # 更新命中向量的使用時間（LRU）；最近已更新過的不再寫入
+            if stale:
+                for start in range(0, len(stale), 500):
+                    batch = stale[start:start + 500]
+                    placeholders = ','.join('?' * len(batch))
+                    self.conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash IN ({placeholders})",
+                        [now, model, *batch]
+                    )
+                self.conn.commit()
+
+            result = {i: found[h] for i, h in enumerate(hashes) if h in found}
+            self.hits += len(result)
+            self.misses += len(texts) - len(result)
+
+        return result, hashes
+
+    def put_many(self, model: str, hashes: List[bytes], vectors: np.ndarray):
+        """寫入向量（已存在的鍵會被忽略），超出上限時淘汰最久未使用者"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        now = int(time.time())
+        rows = [(model, h, vectors.shape[1], vectors[i].tobytes(), now) for i, h in enumerate(hashes)]
+        with self.lock:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            # 已存在而被忽略的鍵不計入
+            self.entry_count += cursor.rowcount
+            self.total_bytes += cursor.rowcount * vectors.shape[1] * 4
+            if self._over_limit():
+                self._prune()
+            self.conn.commit()
+
+    def _over_limit(self) -> bool:
+        return 0 < self.max_entries < self.entry_count or 0 < self.max_bytes < self.total_bytes
+
+    def _prune(self):
+        """超出筆數或容量上限時，刪除最久未使用的向量直到上限的 90%（需持有 lock）"""
+        # 其他行程可能已寫入或淘汰，先以實際數量校正計數器
+        self._count_entries()
+        excess = 0
+        if 0 < self.max_entries < self.entry_count:
+            excess = self.entry_count - int(self.max_entries * _PRUNE_TARGET_RATIO)
+        if 0 < self.max_bytes < self.total_bytes:
+            average = self.total_bytes / self.entry_count
+            excess = max(excess, math.ceil((self.total_bytes - self.max_bytes * _PRUNE_TARGET_RATIO) / average))
+        if excess <= 0:
+            return
+
+        victims = self.conn.execute(
+            "SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT ?",
+            (excess,)
+        ).fetchall()
+        self.conn.executemany(
+            "DELETE FROM embeddings WHERE model = ? AND text_hash = ?",
+            [(model, hash_value) for model, hash_value, _ in victims]
+        )
+        self.entry_count -= len(victims)
+        self.total_bytes -= sum(size for _, _, size in victims)
+        self.evictions += len(victims)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': self.entry_count,
+                'bytes': self.total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class QueryEmbeddingCache:
+    """
+    查詢向量的記憶體 LRU 快取，重複的問題不需再經過編碼器
+
+    Args:
+        max_entries: 最多保留的查詢數（預設讀取 QUERY_EMBEDDING_CACHE_SIZE）
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries if max_entries is not None else \
+            int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+        self.entries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model: str, query: str) -> Optional[np.ndarray]:
+        key = (model, normalize_text(query))
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return vector
+
+    def put(self, model: str, query: str, vector: np.ndarray):
+        if self.max_entries <= 0:
+            return
+        # 唯讀副本，避免呼叫者修改快取內容
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self.lock:
+            self.entries[(model, normalize_text(query))] = vector
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# 單例實例
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """獲取嵌入快取實例"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+    return _embedding_cache
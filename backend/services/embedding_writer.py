@@ -0,0 +1,243 @@
+"""
+嵌入資料批次寫入
+將 document_embeddings 資料列切成有大小上限的批次，經共用的連線池並行寫入 Supabase：
+- 每批以 (document_id, chunk_index) upsert，失敗重試不會產生重複資料列
+- 429 / 5xx、可重試的 SQLSTATE（序列化失敗、逾時、連線類）與連線錯誤時抖動指數退避
+- 設定 DATABASE_URL 且已安裝 psycopg 時，改以 COPY 直接寫入 Postgres（單一交易）
+"""
+
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+# 每列除文字與向量外的估計 JSON 開銷（欄位名稱、UUID 等）
+ROW_OVERHEAD_BYTES = 96
+
+_COPY_COLUMNS = ('document_id', 'content', 'chunk_index', 'start_byte', 'end_byte', 'embedding')
+
+# 重試可能成功的 SQLSTATE：序列化失敗、死結，以及整個類別的連線錯誤、資源不足、
+# 操作員介入（含 57014 查詢逾時取消）與系統錯誤
+_RETRYABLE_SQLSTATES = ('40001', '40P01')
+_RETRYABLE_SQLSTATE_CLASSES = ('08', '53', '57', '58')
+
+
+def estimate_row_bytes(row: Dict[str, Any]) -> int:
+    """估算一列在請求主體中的大小"""
+    embedding = row.get('embedding')
+    embedding_bytes = len(embedding) if isinstance(embedding, str) else len(embedding or []) * 20
+    return len(row.get('content', '').encode('utf-8')) + embedding_bytes + ROW_OVERHEAD_BYTES
+
+
+def split_batches(rows: List[Dict[str, Any]], max_rows: int, max_bytes: int) -> List[List[Dict[str, Any]]]:
+    """依列數與位元組上限切分批次（單列超過上限時自成一批）"""
+    batches = []
+    batch, batch_bytes = [], 0
+    for row in rows:
+        size = estimate_row_bytes(row)
+        if batch and (len(batch) >= max_rows or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(row)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _sqlstate(error: Exception) -> Optional[str]:
+    """PostgREST APIError.code 或 psycopg 的 sqlstate（SQLSTATE 為 5 碼，PostgREST 自身錯誤為 PGRST*）"""
+    code = str(getattr(error, 'sqlstate', None) or getattr(error, 'code', None) or '')
+    if code.startswith('PGRST') or (len(code) == 5 and code.isalnum()):
+        return code
+    return None
+
+
+def _http_status(error: Exception) -> Optional[int]:
+    """底層 HTTP 回應的狀態碼（httpx 例外的 response；PostgREST 回應非 JSON 時 code 即為狀態碼）"""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status
+    code = str(getattr(error, 'code', None) or '')
+    if len(code) == 3 and code.isdigit():
+        return int(code)
+    return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    判斷寫入錯誤是否值得重試
+
+    先看 SQLSTATE：資料錯誤（22）、約束違反（23）、語法或權限錯誤（42）與 PGRST* 重試無效；
+    再看 HTTP 狀態：429 與 5xx 可重試，其他 4xx 不可；兩者皆無時（連線中斷、逾時）重試
+    """
+    sqlstate = _sqlstate(error)
+    if sqlstate is not None:
+        return sqlstate in _RETRYABLE_SQLSTATES or sqlstate[:2] in _RETRYABLE_SQLSTATE_CLASSES
+
+    status = _http_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return True
+
+
+class EmbeddingWriter:
+    """
+    document_embeddings 的批次寫入器
+
+    Args:
+        max_workers: 並行寫入的批次數（預設讀取 EMBEDDING_WRITE_CONCURRENCY）
+        max_rows: 每批最多列數（預設讀取 EMBEDDING_WRITE_BATCH_ROWS）
+        max_bytes: 每批估計的最大位元組數（預設讀取 EMBEDDING_WRITE_BATCH_KB）
+        database_url: 直連 Postgres 的連線字串（預設讀取 DATABASE_URL），設定時使用 COPY
+    """
+
+    def __init__(self, max_workers: int = None, max_rows: int = None, max_bytes: int = None,
+                 database_url: Optional[str] = None):
+        self.max_workers = max_workers or int(os.getenv("EMBEDDING_WRITE_CONCURRENCY", "4"))
+        self.max_rows = max_rows or int(os.getenv("EMBEDDING_WRITE_BATCH_ROWS", "200"))
+        self.max_bytes = max_bytes or int(float(os.getenv("EMBEDDING_WRITE_BATCH_KB", "1024")) * 1024)
+        self.max_retries = int(os.getenv("EMBEDDING_WRITE_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("EMBEDDING_WRITE_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("EMBEDDING_WRITE_BACKOFF_MAX", "10.0"))
+        self.database_url = database_url if database_url is not None else os.getenv("DATABASE_URL")
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="embedding-writer")
+        self.lock = threading.Lock()
+        self.rows_written = 0
+        self.batches_written = 0
+        self.retries = 0
+        self.failed = 0
+
+    @property
+    def method(self) -> str:
+        return 'copy' if self.database_url and _psycopg_available() else 'rest'
+
+    def write(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        寫入所有資料列，任一批次重試後仍失敗時拋出例外
+
+        Returns:
+            寫入統計：rows、batches、retries、seconds、rows_per_sec、method
+        """
+        if not rows:
+            return {'rows': 0, 'batches': 0, 'retries': 0, 'seconds': 0.0, 'rows_per_sec': 0.0,
+                    'method': self.method}
+
+        started = time.perf_counter()
+        method = self.method
+        if method == 'copy':
+            batches, retries = 1, self._with_retry(self._copy_rows, rows)
+        else:
+            batches = split_batches(rows, self.max_rows, self.max_bytes)
+            futures = [self.executor.submit(self._with_retry, self._upsert_batch, batch) for batch in batches]
+            # 等待所有批次結束後才回報錯誤，避免失敗時仍有批次在背景寫入
+            errors, retries = [], 0
+            for future in futures:
+                try:
+                    retries += future.result()
+                except Exception as e:
+                    errors.append(e)
+            if errors:
+                with self.lock:
+                    self.failed += len(errors)
+                raise errors[0]
+            batches = len(batches)
+
+        seconds = time.perf_counter() - started
+        with self.lock:
+            self.rows_written += len(rows)
+            self.batches_written += batches
+
+        stats = {
+            'rows': len(rows),
+            'batches': batches,
+            'retries': retries,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': round(len(rows) / seconds, 1) if seconds > 0 else 0.0,
+            'method': method
+        }
+        print(f"已寫入 {stats['rows']} 筆嵌入（{method}，{batches} 批，{stats['rows_per_sec']} rows/s）")
+        return stats
+
+    def _with_retry(self, fn, rows: List[Dict[str, Any]]) -> int:
+        """執行寫入並在可重試錯誤時退避，返回重試次數"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                fn(rows)
+                return attempt
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                with self.lock:
+                    self.retries += 1
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                print(f"Embedding batch write failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _upsert_batch(self, rows: List[Dict[str, Any]]):
+        from config import get_supabase
+        get_supabase().upsert_embeddings(rows)
+
+    def _copy_rows(self, rows: List[Dict[str, Any]]):
+        """
+        COPY 到暫存表後合併進 document_embeddings（整批在同一交易內，重試時可安全重做）
+        向量以 pgvector 文字格式傳送
+        """
+        import psycopg
+
+        with psycopg.connect(self.database_url) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "CREATE TEMP TABLE embeddings_staging "
+                    "(LIKE document_embeddings INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                with cur.copy(f"COPY embeddings_staging ({', '.join(_COPY_COLUMNS)}) FROM STDIN") as copy:
+                    for row in rows:
+                        embedding = row['embedding']
+                        if not isinstance(embedding, str):
+                            embedding = '[' + ','.join(str(v) for v in embedding) + ']'
+                        copy.write_row((row['document_id'], row['content'], row['chunk_index'],
+                                        row.get('start_byte'), row.get('end_byte'), embedding))
+                cur.execute(
+                    f"INSERT INTO document_embeddings ({', '.join(_COPY_COLUMNS)}) "
+                    f"SELECT {', '.join(_COPY_COLUMNS)} FROM embeddings_staging "
+                    "ON CONFLICT (document_id, chunk_index) DO UPDATE "
+                    "SET content = EXCLUDED.content, start_byte = EXCLUDED.start_byte, "
+                    "end_byte = EXCLUDED.end_byte, embedding = EXCLUDED.embedding"
+                )
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'method': self.method,
+                'concurrency': self.max_workers,
+                'rows_written': self.rows_written,
+                'batches_written': self.batches_written,
+                'retries': self.retries,
+                'failed_batches': self.failed
+            }
+
+
+def _psycopg_available() -> bool:
+    try:
+        import psycopg  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# 單例實例
+_embedding_writer: Optional[EmbeddingWriter] = None
+_embedding_writer_lock = threading.Lock()
+
+def get_embedding_writer() -> EmbeddingWriter:
+    """獲取嵌入寫入器實例"""
+    global _embedding_writer
+    if _embedding_writer is None:
+        with _embedding_writer_lock:
+            if _embedding_writer is None:
+                _embedding_writer = EmbeddingWriter()
+    return _embedding_writer
@@ -0,0 +1,135 @@
+"""
+LLM 生成結果快取
+以 (模型, 提示模板版本, 內容雜湊, 生成參數, temperature) 為鍵，
+相同內容與參數的測驗、閃卡、摘要請求不再重複呼叫遠端 LLM
+"""
+
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, NamedTuple, Tuple
+
+
+def make_generation_key(kind: str, model: str, prompt_version: str, content: str,
+                        params: Dict[str, Any], temperature: float) -> str:
+    """
+    計算生成結果的快取鍵
+
+    Args:
+        kind: 生成類型（quiz、flashcards、summary）
+        model: LLM 模型名稱
+        prompt_version: 提示模板版本，模板變更時遞增即可使舊結果失效
+        content: 文件內容
+        params: 生成參數（num_questions、question_type 等）
+        temperature: 取樣溫度
+    """
+    payload = {
+        'kind': kind,
+        'model': model,
+        'prompt_version': prompt_version,
+        'content_hash': hashlib.sha256(content.encode('utf-8')).hexdigest(),
+        'params': params,
+        'temperature': temperature
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class CachedGeneration(NamedTuple):
+    """
+    生成結果與其來源
+
+    source 為 None 表示本次新生成，'memory' / 'database' 表示快取命中；
+    record_id 為歷史記錄表中對應的記錄 ID；
+    failed 表示 LLM 回覆無法解析，result 只是錯誤提示，不應保存或快取
+    """
+    result: Dict[str, Any]
+    source: Optional[str]
+    record_id: Optional[str]
+    failed: bool = False
+
+
+class GenerationCache:
+    """
+    有 TTL 與容量上限的記憶體快取（LRU 淘汰）
+
+    Args:
+        max_entries: 最多保留的結果數（預設讀取 GENERATION_CACHE_MAX_ENTRIES）
+        ttl_seconds: 結果有效時間（預設讀取 GENERATION_CACHE_TTL）
+    """
+
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None):
+        self.max_entries = max_entries or int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "512"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else \
+            float(os.getenv("GENERATION_CACHE_TTL", str(24 * 3600)))
+
+        # key -> (expires_at, result, record_id)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """獲取快取結果（返回副本，避免呼叫者修改快取內容）"""
+        entry = self.lookup(key)
+        return entry[0] if entry is not None else None
+
+    def lookup(self, key: str) -> Optional[Tuple[Dict[str, Any], Optional[str]]]:
+        """獲取快取結果與其記錄 ID（同一次加鎖內讀取，兩者必定屬於同一筆結果）"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return copy.deepcopy(entry[1]), entry[2]
+
+    def set(self, key: str, result: Dict[str, Any], record_id: Optional[str] = None):
+        """存入結果（與歷史記錄 ID），超出容量時淘汰最久未使用者"""
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl_seconds, copy.deepcopy(result), record_id)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# 單例實例
+_generation_cache: Optional[GenerationCache] = None
+_generation_cache_lock = threading.Lock()
+
+def get_generation_cache() -> GenerationCache:
+    """獲取生成結果快取實例"""
+    global _generation_cache
+    if _generation_cache is None:
+        with _generation_cache_lock:
+            if _generation_cache is None:
+                _generation_cache = GenerationCache()
+    return _generation_cache
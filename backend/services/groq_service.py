@@ -5,38 +5,214 @@ Groq LLM 服務
 
 import os
 import json
-from typing import List, Dict, Any
-from groq import Groq
+import threading
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Iterator, Optional, Callable, Tuple
 from dotenv import load_dotenv
 
+from .generation_cache import get_generation_cache, make_generation_key, CachedGeneration
+from .llm_executor import get_llm_executor
+
 load_dotenv()
 
+# 提示模板版本：修改對應的 system/user prompt 時遞增，使舊的快取結果失效
+PROMPT_VERSIONS = {
+    'quiz': '1',
+    'flashcards': '1',
+    'summary': '1'
+}
+
+# 各生成類型的取樣溫度
+TEMPERATURES = {
+    'quiz': 0.5,
+    'flashcards': 0.3,
+    'summary': 0.3
+}
+
+# 單次提示可放入的內容長度（字元）；超過時改用 map-reduce，不再截斷
+PROMPT_CONTENT_CHARS = {
+    'quiz': 8000,
+    'flashcards': 8000,
+    'summary': 12000
+}
+
+# 筆記仍過長時最多再濃縮的層數
+MAP_REDUCE_MAX_DEPTH = 3
+
+# 單次生成同時送入 LLM 執行器的 map 請求上限；其餘段落在前面的請求完成後才提交，
+# 長文件不會佔滿共用執行器的佇列，讓其他使用者的請求排在後面
+MAP_REDUCE_FANOUT = int(os.getenv("MAP_REDUCE_FANOUT", "4"))
+
+
+def split_content(content: str, max_chars: int) -> List[str]:
+    """
+    將長內容切成不超過 max_chars 的段落組（優先在段落、換行處切分）
+    """
+    groups = []
+    current = ""
+    for paragraph in content.split("\n"):
+        # 單一段落過長時硬切
+        while len(paragraph) > max_chars:
+            if current:
+                groups.append(current)
+                current = ""
+            groups.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        
+        if current and len(current) + len(paragraph) + 1 > max_chars:
+            groups.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n{paragraph}" if current else paragraph
+    
+    if current.strip():
+        groups.append(current)
+    return [group for group in groups if group.strip()]
+
+
+# 從歷史記錄表讀取快取結果：返回 (結果, 記錄 ID)，找不到時返回 None
+RecordLoader = Callable[[], Optional[Tuple[Dict[str, Any], str]]]
+
+
 class GroqService:
     def __init__(self):
         api_key = os.getenv("GROQ_API_KEY")
         if not api_key:
             raise ValueError("GROQ_API_KEY must be set in environment variables")
         
-        self.client = Groq(api_key=api_key)
+        # 共用執行器：HTTP 連線池、限流、重試與進行中請求合併
+        self.executor = get_llm_executor()
+        self.client = self.executor.client
         self.model = os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile")
+        self.generation_cache = get_generation_cache()
+    
+    def cache_key(self, kind: str, content: str, params: Dict[str, Any]) -> str:
+        """生成結果的快取鍵（模型、模板版本、內容雜湊、參數、溫度）"""
+        return make_generation_key(
+            kind, self.model, PROMPT_VERSIONS[kind], content, params, TEMPERATURES[kind]
+        )
+    
+    @staticmethod
+    def _memory_key(cache_key: str, doc_id: Optional[str]) -> str:
+        """
+        記憶體快取鍵：加上文件 ID
+        
+        歷史記錄依文件保存，內容相同的兩份上傳各自擁有記錄 ID，不共用另一份文件的記錄
+        """
+        return f"{doc_id}:{cache_key}" if doc_id else cache_key
+    
+    def _find_cached(self, cache_key: str, doc_id: Optional[str], force_regenerate: bool,
+                     load_record: Optional[RecordLoader]) -> Optional[CachedGeneration]:
+        """
+        查找快取：記憶體 → 歷史記錄表（load_record）
+        
+        結果與記錄 ID 一併取出，避免先檢查再讀取之間快取被淘汰或替換
+        """
+        if force_regenerate:
+            return None
+        
+        memory_key = self._memory_key(cache_key, doc_id)
+        entry = self.generation_cache.lookup(memory_key)
+        if entry is not None:
+            return CachedGeneration(entry[0], 'memory', entry[1])
+        
+        record = load_record() if load_record is not None else None
+        if record is not None:
+            result, record_id = record
+            self.generation_cache.set(memory_key, result, record_id)
+            return CachedGeneration(result, 'database', record_id)
+        return None
+    
+    @staticmethod
+    def _messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def _submit_llm(self, system_prompt: str, user_prompt: str, temperature: float = 0.7) -> Future:
+        """提交 Groq LLM 請求（不等待結果）"""
+        return self.executor.submit(
+            self.model, self._messages(system_prompt, user_prompt), temperature=temperature, max_tokens=4096
+        )
     
     def _call_llm(self, system_prompt: str, user_prompt: str, temperature: float = 0.7) -> str:
         """調用 Groq LLM"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=temperature,
-                max_tokens=4096
-            )
-            return response.choices[0].message.content
+            return self._submit_llm(system_prompt, user_prompt, temperature).result()
         except Exception as e:
             raise Exception(f"LLM call failed: {str(e)}")
     
-    def generate_quiz(self, content: str, num_questions: int = 5, question_type: str = "mixed") -> Dict[str, Any]:
+    def _submit_notes(self, content: str, max_chars: int) -> Future:
+        """map 步驟：從一段內容中提取學習筆記"""
+        system_prompt = """你是一位專業的教育專家，負責為長篇學習材料的其中一段整理學習筆記。
+
+請保留這段內容中：
+1. 專業術語與定義
+2. 關鍵概念、原理與公式
+3. 重要事實、數據、人物與事件
+4. 可用於出題的細節
+
+以條列方式輸出純文字筆記，不要加入原文沒有的資訊。"""
+
+        user_prompt = f"""請將以下內容整理成不超過 {max_chars} 字的學習筆記。
+
+內容：
+{content}
+"""
+        return self._submit_llm(system_prompt, user_prompt, temperature=0.2)
+    
+    def _map_notes(self, groups: List[str], notes_chars: int) -> List[str]:
+        """
+        map 步驟：各段並行提取筆記，同時進行的請求不超過 MAP_REDUCE_FANOUT
+        
+        執行器會合併相同的進行中請求，內容相同的段落可能共用同一個 Future
+        """
+        notes: List[Optional[str]] = [None] * len(groups)
+        pending: Dict[Future, List[int]] = {}
+        next_group = 0
+        while next_group < len(groups) or pending:
+            while next_group < len(groups) and len(pending) < MAP_REDUCE_FANOUT:
+                future = self._submit_notes(groups[next_group], notes_chars)
+                pending.setdefault(future, []).append(next_group)
+                next_group += 1
+            
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for i in pending.pop(future):
+                    notes[i] = future.result()
+        return notes
+    
+    def _prepare_content(self, kind: str, content: str) -> str:
+        """
+        讓內容符合單次提示長度
+        
+        內容過長時分段並行提取筆記（map），再合併成一份內容（reduce），
+        合併後仍過長則再濃縮一層，最多 MAP_REDUCE_MAX_DEPTH 層
+        """
+        limit = PROMPT_CONTENT_CHARS[kind]
+        for depth in range(MAP_REDUCE_MAX_DEPTH):
+            if len(content) <= limit:
+                return content
+            
+            groups = split_content(content, limit)
+            # 每段筆記的長度預算，使合併結果盡量放得進最終提示
+            notes_chars = max(limit // len(groups), 500)
+            print(f"Map-reduce {kind}: {len(content)} 字元 → {len(groups)} 段（第 {depth + 1} 層）")
+            
+            try:
+                notes = self._map_notes(groups, notes_chars)
+            except Exception as e:
+                raise Exception(f"LLM call failed: {str(e)}")
+            
+            content = "\n\n".join(f"【第 {i} 部分】\n{note.strip()}" for i, note in enumerate(notes, 1))
+        
+        return content if len(content) <= limit else content[:limit]
+    
+    def generate_quiz(self, content: str, num_questions: int = 5, question_type: str = "mixed",
+                      force_regenerate: bool = False, doc_id: Optional[str] = None,
+                      record_id: Optional[str] = None,
+                      load_record: Optional[RecordLoader] = None) -> CachedGeneration:
         """
         生成隨堂考
         
@@ -44,10 +220,19 @@ class GroqService:
             content: 文件內容
             num_questions: 題目數量 (5-10)
             question_type: 題目類型 (multiple_choice, short_answer, mixed)
+            force_regenerate: 忽略快取，重新呼叫 LLM
+            doc_id: 文件 ID（記憶體快取依文件區分）
+            record_id: 新生成結果將保存的歷史記錄 ID，與結果一起存入快取
+            load_record: 記憶體快取未命中時，從歷史記錄表讀取結果
         
         Returns:
-            包含測驗題目的字典
+            CachedGeneration：包含測驗題目的字典、快取來源與記錄 ID
         """
+        cache_key = self.cache_key('quiz', content, {'num_questions': num_questions, 'question_type': question_type})
+        cached = self._find_cached(cache_key, doc_id, force_regenerate, load_record)
+        if cached is not None:
+            return cached
+        
         system_prompt = """你是一位專業的教育專家，擅長根據學習材料創建高品質的測驗題目。
         
 你的任務是根據提供的內容生成測驗題目。請確保：
@@ -86,14 +271,16 @@ class GroqService:
             "mixed": "混合生成選擇題和簡答題（各半）"
         }
         
+        content = self._prepare_content('quiz', content)
+        
         user_prompt = f"""請根據以下學習內容生成 {num_questions} 道測驗題目。
 題目類型要求：{type_instruction.get(question_type, type_instruction['mixed'])}
 
 學習內容：
-{content[:8000]}  # 限制內容長度避免 token 超限
+{content}
 """
 
-        response = self._call_llm(system_prompt, user_prompt, temperature=0.5)
+        response = self._call_llm(system_prompt, user_prompt, temperature=TEMPERATURES['quiz'])
         
         # 解析 JSON 回應
         try:
@@ -106,26 +293,40 @@ class GroqService:
             if response.endswith("```"):
                 response = response[:-3]
             
-            return json.loads(response.strip())
+            result = json.loads(response.strip())
+            self.generation_cache.set(self._memory_key(cache_key, doc_id), result, record_id)
+            return CachedGeneration(result, None, record_id)
         except json.JSONDecodeError:
-            return {
+            return CachedGeneration({
                 "quiz_title": "自動生成測驗",
                 "questions": [],
                 "raw_response": response,
                 "error": "無法解析生成的測驗，請重試"
-            }
+            }, None, None, failed=True)
     
-    def generate_flashcards(self, content: str, num_cards: int = 10) -> Dict[str, Any]:
+    def generate_flashcards(self, content: str, num_cards: int = 10,
+                            force_regenerate: bool = False, doc_id: Optional[str] = None,
+                            record_id: Optional[str] = None,
+                            load_record: Optional[RecordLoader] = None) -> CachedGeneration:
         """
         生成閃卡
         
         Args:
             content: 文件內容
             num_cards: 閃卡數量
+            force_regenerate: 忽略快取，重新呼叫 LLM
+            doc_id: 文件 ID（記憶體快取依文件區分）
+            record_id: 新生成結果將保存的歷史記錄 ID，與結果一起存入快取
+            load_record: 記憶體快取未命中時，從歷史記錄表讀取結果
         
         Returns:
-            包含閃卡的字典
+            CachedGeneration：包含閃卡的字典、快取來源與記錄 ID
         """
+        cache_key = self.cache_key('flashcards', content, {'num_cards': num_cards})
+        cached = self._find_cached(cache_key, doc_id, force_regenerate, load_record)
+        if cached is not None:
+            return cached
+        
         system_prompt = """你是一位專業的教育專家，擅長提取學習材料中的關鍵概念並製作閃卡。
 
 你的任務是從提供的內容中識別重要的：
@@ -149,13 +350,15 @@ class GroqService:
 
 只返回 JSON，不要包含其他文字。閃卡應該簡潔明瞭，適合快速複習。"""
 
+        content = self._prepare_content('flashcards', content)
+        
         user_prompt = f"""請從以下學習內容中提取 {num_cards} 個最重要的概念，製作成閃卡。
 
 學習內容：
-{content[:8000]}
+{content}
 """
 
-        response = self._call_llm(system_prompt, user_prompt, temperature=0.3)
+        response = self._call_llm(system_prompt, user_prompt, temperature=TEMPERATURES['flashcards'])
         
         try:
             response = response.strip()
@@ -166,26 +369,40 @@ class GroqService:
             if response.endswith("```"):
                 response = response[:-3]
             
-            return json.loads(response.strip())
+            result = json.loads(response.strip())
+            self.generation_cache.set(self._memory_key(cache_key, doc_id), result, record_id)
+            return CachedGeneration(result, None, record_id)
         except json.JSONDecodeError:
-            return {
+            return CachedGeneration({
                 "deck_title": "自動生成閃卡",
                 "cards": [],
                 "raw_response": response,
                 "error": "無法解析生成的閃卡，請重試"
-            }
+            }, None, None, failed=True)
     
-    def generate_summary(self, content: str, num_points: int = 5) -> Dict[str, Any]:
+    def generate_summary(self, content: str, num_points: int = 5,
+                         force_regenerate: bool = False, doc_id: Optional[str] = None,
+                         record_id: Optional[str] = None,
+                         load_record: Optional[RecordLoader] = None) -> CachedGeneration:
         """
         生成 TL;DR 摘要
         
         Args:
             content: 文件內容
             num_points: 摘要要點數量
+            force_regenerate: 忽略快取，重新呼叫 LLM
+            doc_id: 文件 ID（記憶體快取依文件區分）
+            record_id: 新生成結果將保存的歷史記錄 ID，與結果一起存入快取
+            load_record: 記憶體快取未命中時，從歷史記錄表讀取結果
         
         Returns:
-            包含摘要的字典
+            CachedGeneration：包含摘要的字典、快取來源與記錄 ID
         """
+        cache_key = self.cache_key('summary', content, {'num_points': num_points})
+        cached = self._find_cached(cache_key, doc_id, force_regenerate, load_record)
+        if cached is not None:
+            return cached
+        
         system_prompt = """你是一位專業的文件分析專家，擅長將複雜的學術內容精煉成易於理解的重點摘要。
 
 你的任務是提取文件的核心要點，每個要點應該：
@@ -211,13 +428,15 @@ class GroqService:
 
 只返回 JSON，不要包含其他文字。"""
 
+        content = self._prepare_content('summary', content)
+        
         user_prompt = f"""請為以下學習內容生成 {num_points} 個核心重點摘要（TL;DR）。
 
 學習內容：
-{content[:12000]}
+{content}
 """
 
-        response = self._call_llm(system_prompt, user_prompt, temperature=0.3)
+        response = self._call_llm(system_prompt, user_prompt, temperature=TEMPERATURES['summary'])
         
         try:
             response = response.strip()
@@ -228,28 +447,21 @@ class GroqService:
             if response.endswith("```"):
                 response = response[:-3]
             
-            return json.loads(response.strip())
+            result = json.loads(response.strip())
+            self.generation_cache.set(self._memory_key(cache_key, doc_id), result, record_id)
+            return CachedGeneration(result, None, record_id)
         except json.JSONDecodeError:
-            return {
+            return CachedGeneration({
                 "document_title": "文件摘要",
                 "tldr": "",
                 "key_points": [],
                 "keywords": [],
                 "raw_response": response,
                 "error": "無法解析生成的摘要，請重試"
-            }
+            }, None, None, failed=True)
     
-    def answer_question(self, question: str, context: str) -> str:
-        """
-        基於上下文回答問題（RAG）
-        
-        Args:
-            question: 使用者問題
-            context: 相關文件內容
-        
-        Returns:
-            回答字串
-        """
+    def _answer_prompts(self, question: str, context: str):
+        """問答的 system/user prompt"""
         system_prompt = """你是一位知識淵博的學習助手。請根據提供的學習材料內容回答使用者的問題。
 
 規則：
@@ -265,9 +477,51 @@ class GroqService:
 
 請根據以上參考資料回答問題。"""
 
+        return system_prompt, user_prompt
+    
+    def answer_question(self, question: str, context: str) -> str:
+        """
+        基於上下文回答問題（RAG）
+        
+        Args:
+            question: 使用者問題
+            context: 相關文件內容
+        
+        Returns:
+            回答字串
+        """
+        system_prompt, user_prompt = self._answer_prompts(question, context)
         return self._call_llm(system_prompt, user_prompt, temperature=0.5)
+    
+    def stream_answer(self, question: str, context: str) -> Iterator[str]:
+        """
+        基於上下文回答問題，以串流方式逐段返回生成的文字
+        
+        Args:
+            question: 使用者問題
+            context: 相關文件內容
+        
+        Yields:
+            LLM 新生成的文字片段
+        """
+        system_prompt, user_prompt = self._answer_prompts(question, context)
+        try:
+            yield from self.executor.stream(
+                self.model, self._messages(system_prompt, user_prompt), temperature=0.5, max_tokens=4096
+            )
+        except Exception as e:
+            raise Exception(f"LLM call failed: {str(e)}")
+
 
+# 單例實例（無請求狀態；生成快取與 LLM 執行器皆為執行緒安全）
+_groq_service: Optional[GroqService] = None
+_groq_service_lock = threading.Lock()
 
 def get_groq_service() -> GroqService:
     """獲取 Groq 服務實例"""
-    return GroqService()
+    global _groq_service
+    if _groq_service is None:
+        with _groq_service_lock:
+            if _groq_service is None:
+                _groq_service = GroqService()
+    return _groq_service
@@ -0,0 +1,200 @@
+"""
+向量索引快取
+以記憶體預算限制常駐的文件索引，超出時依 LRU / LFU 淘汰
+被淘汰的文件會在下次存取時從磁碟或 Supabase 重新載入
+另有文件全文的 LRU 快取（TextCache）
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+import faiss
+
+from .vector_index import estimate_index_bytes
+
+# 每個區塊除文字外的估計額外開銷（dict、字串物件等）
+CHUNK_OVERHEAD_BYTES = 256
+
+
+def estimate_entry_bytes(index: faiss.Index, chunks: List[Dict[str, Any]]) -> int:
+    """估算一個文件索引（向量 + 區塊文字）佔用的記憶體"""
+    vector_bytes = estimate_index_bytes(index)
+    text_bytes = sum(len(chunk.get("content", "")) * 2 + CHUNK_OVERHEAD_BYTES for chunk in chunks)
+    return vector_bytes + text_bytes
+
+
+class IndexCache:
+    """
+    有記憶體上限的索引快取
+
+    Args:
+        max_bytes: 記憶體預算（預設讀取 INDEX_CACHE_MAX_MB，預設 1024MB）
+        policy: 淘汰策略 'lru' 或 'lfu'（預設讀取 INDEX_CACHE_POLICY）
+    """
+
+    def __init__(self, max_bytes: int = None, policy: str = None):
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("INDEX_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.policy = (policy or os.getenv("INDEX_CACHE_POLICY", "lru")).lower()
+        if self.policy not in ('lru', 'lfu'):
+            raise ValueError(f"Unsupported index cache policy: {self.policy}")
+
+        # doc_id -> (index, chunks, size_bytes, vectors)，順序即最近使用順序
+        self.entries: "OrderedDict[str, Tuple[faiss.Index, List[Dict], int, Optional[np.ndarray]]]" = OrderedDict()
+        self.frequencies: Dict[str, int] = {}
+        self.current_bytes = 0
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, doc_id: str) -> Optional[Tuple[faiss.Index, List[Dict]]]:
+        """獲取快取的索引，命中時更新使用紀錄"""
+        with self.lock:
+            entry = self.entries.get(doc_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(doc_id)
+            self.frequencies[doc_id] = self.frequencies.get(doc_id, 0) + 1
+            return entry[0], entry[1]
+
+    def get_vectors(self, doc_id: str) -> Optional[np.ndarray]:
+        """
+        獲取與索引一起快取的全精度向量（量化索引重新排序用，不計入命中統計）
+
+        向量為唯讀 mmap，頁面由作業系統快取管理，不計入記憶體預算
+        """
+        with self.lock:
+            entry = self.entries.get(doc_id)
+            return entry[3] if entry is not None else None
+
+    def put(self, doc_id: str, index: faiss.Index, chunks: List[Dict], vectors: Optional[np.ndarray] = None):
+        """加入索引（與其全精度向量），超出預算時淘汰其他文件"""
+        size = estimate_entry_bytes(index, chunks)
+        with self.lock:
+            self._remove(doc_id)
+            self.entries[doc_id] = (index, chunks, size, vectors)
+            self.frequencies[doc_id] = 1
+            self.current_bytes += size
+            self._evict(keep=doc_id)
+
+    def pop(self, doc_id: str):
+        """移除索引（不計入淘汰次數）"""
+        with self.lock:
+            self._remove(doc_id)
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self.lock:
+            return doc_id in self.entries
+
+    def _remove(self, doc_id: str):
+        entry = self.entries.pop(doc_id, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+        self.frequencies.pop(doc_id, None)
+
+    def _evict(self, keep: str):
+        """淘汰直到低於預算；剛加入的文件即使單獨超出預算也保留"""
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            victim = self._select_victim(keep)
+            if victim is None:
+                break
+            self._remove(victim)
+            self.evictions += 1
+
+    def _select_victim(self, keep: str) -> Optional[str]:
+        candidates = [doc_id for doc_id in self.entries if doc_id != keep]
+        if not candidates:
+            return None
+        if self.policy == 'lfu':
+            # 使用次數最少者；同分時取最久未使用者（OrderedDict 順序）
+            return min(candidates, key=lambda doc_id: self.frequencies.get(doc_id, 0))
+        return candidates[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """快取統計"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'policy': self.policy,
+                'documents': len(self.entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class TextCache:
+    """
+    文件全文的 LRU 快取（測驗、閃卡、摘要與預覽重複讀取同一份全文）
+
+    Args:
+        max_bytes: 記憶體預算（預設讀取 FULL_TEXT_CACHE_MB，預設 128MB）
+    """
+
+    def __init__(self, max_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("FULL_TEXT_CACHE_MB", "128")) * 1024 * 1024)
+        self.max_bytes = max_bytes
+
+        # doc_id -> (text, size_bytes)，順序即最近使用順序
+        self.entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc_id: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(doc_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(doc_id)
+            return entry[0]
+
+    def put(self, doc_id: str, text: str):
+        """加入全文，超出預算時淘汰最久未使用者（單份超出預算時不快取）"""
+        size = len(text) * 2
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(doc_id)
+            self.entries[doc_id] = (text, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def pop(self, doc_id: str):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        entry = self.entries.pop(doc_id, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'documents': len(self.entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,292 @@
+"""
+向量索引持久化
+將每個文件的 FAISS 索引與區塊元數據寫入本地磁碟，重啟後可直接載入
+"""
+
+import os
+import re
+import json
+import hashlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 開發環境：單一行程，不需要跨行程鎖
+    fcntl = None
+from typing import List, Dict, Any, Optional, Tuple, Iterator, TextIO
+
+import faiss
+import numpy as np
+
+
+class IndexStore:
+    """
+    本地磁碟上的索引存儲
+
+    每個文件對應以下檔案：
+    - <doc_id>.faiss        faiss.write_index 序列化的索引
+    - <doc_id>.chunks.json  區塊內容與元數據（緊湊 JSON）
+    - <doc_id>.vectors.npy  全精度（float32）向量，供量化索引重新排序時以 mmap 讀取
+    - <doc_id>.text         提取出的原始全文（UTF-8），供全文讀取與依位元組範圍預覽
+
+    跨文件語料索引存放在 corpus/ 子目錄：
+    - <owner>.faiss         共享索引
+    - <owner>.map.json      向量 ID 與（內容 ID, 區塊位置）、文件的對應關係
+    - <owner>.lock          多個 worker 行程讀寫時的檔案鎖
+    """
+
+    def __init__(self, base_dir: str = None):
+        self.base_dir = base_dir or os.getenv(
+            "INDEX_STORE_DIR",
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'index_store')
+        )
+        self.corpus_dir = os.path.join(self.base_dir, 'corpus')
+        os.makedirs(self.corpus_dir, exist_ok=True)
+
+    def _index_path(self, doc_id: str) -> str:
+        return os.path.join(self.base_dir, f"{doc_id}.faiss")
+
+    def _chunks_path(self, doc_id: str) -> str:
+        return os.path.join(self.base_dir, f"{doc_id}.chunks.json")
+
+    def _vectors_path(self, doc_id: str) -> str:
+        return os.path.join(self.base_dir, f"{doc_id}.vectors.npy")
+
+    def _text_path(self, doc_id: str) -> str:
+        return os.path.join(self.base_dir, f"{doc_id}.text")
+
+    def exists(self, doc_id: str) -> bool:
+        """檢查文件索引是否已存在於磁碟"""
+        return os.path.exists(self._index_path(doc_id)) and os.path.exists(self._chunks_path(doc_id))
+
+    def save(self, doc_id: str, index: faiss.Index, chunks: List[Dict[str, Any]],
+             vectors: Optional[np.ndarray] = None):
+        """
+        保存索引和區塊（先寫暫存檔再原子替換，避免讀到半寫入的檔案）
+
+        Args:
+            doc_id: 文件 ID
+            index: FAISS 索引
+            chunks: 區塊列表
+            vectors: 全精度向量（索引為量化類型時用於重新排序）
+        """
+        index_path = self._index_path(doc_id)
+        chunks_path = self._chunks_path(doc_id)
+        vectors_path = self._vectors_path(doc_id)
+
+        faiss.write_index(index, index_path + '.tmp')
+        with open(chunks_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(chunks, f, ensure_ascii=False, separators=(',', ':'))
+        if vectors is not None:
+            with open(vectors_path + '.tmp', 'wb') as f:
+                np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+
+        # 先替換區塊與向量檔，索引檔最後落地代表整組寫入完成
+        os.replace(chunks_path + '.tmp', chunks_path)
+        if vectors is not None:
+            os.replace(vectors_path + '.tmp', vectors_path)
+        elif os.path.exists(vectors_path):
+            os.remove(vectors_path)
+        os.replace(index_path + '.tmp', index_path)
+
+    def load(self, doc_id: str) -> Optional[Tuple[faiss.Index, List[Dict[str, Any]]]]:
+        """
+        從磁碟載入索引和區塊
+
+        Returns:
+            (index, chunks)，不存在或損壞時返回 None
+        """
+        if not self.exists(doc_id):
+            return None
+
+        try:
+            index = faiss.read_index(self._index_path(doc_id))
+            with open(self._chunks_path(doc_id), 'r', encoding='utf-8') as f:
+                chunks = json.load(f)
+            return index, chunks
+        except Exception as e:
+            print(f"Failed to load index for {doc_id} from disk: {e}")
+            return None
+
+    def load_vectors(self, doc_id: str) -> Optional[np.ndarray]:
+        """
+        以唯讀 mmap 開啟全精度向量，只有被讀取的列會載入記憶體
+
+        Returns:
+            (N, dim) float32 陣列，不存在或損壞時返回 None
+        """
+        path = self._vectors_path(doc_id)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            return np.load(path, mmap_mode='r')
+        except Exception as e:
+            print(f"Failed to load vectors for {doc_id} from disk: {e}")
+            return None
+
+    def delete(self, doc_id: str):
+        """刪除磁碟上的索引檔案"""
+        for path in (self._index_path(doc_id), self._chunks_path(doc_id), self._vectors_path(doc_id),
+                     self._text_path(doc_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def rename(self, doc_id: str, new_doc_id: str):
+        """將索引檔案轉移給另一個文件 ID"""
+        for old_path, new_path in ((self._chunks_path(doc_id), self._chunks_path(new_doc_id)),
+                                   (self._vectors_path(doc_id), self._vectors_path(new_doc_id)),
+                                   (self._text_path(doc_id), self._text_path(new_doc_id)),
+                                   (self._index_path(doc_id), self._index_path(new_doc_id))):
+            if os.path.exists(old_path):
+                os.replace(old_path, new_path)
+
+    # ============ 原始全文 ============
+
+    @contextmanager
+    def write_text(self, doc_id: str) -> Iterator[TextIO]:
+        """
+        以串流方式寫入文件全文（寫入暫存檔，區塊結束時原子替換；發生例外則捨棄）
+
+        用法:
+            with store.write_text(doc_id) as f:
+                f.write(page_text)
+        """
+        path = self._text_path(doc_id)
+        # newline='' 保留原始換行，位元組位置與切片時的 start_byte / end_byte 一致
+        f = open(path + '.tmp', 'w', encoding='utf-8', newline='')
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            os.remove(path + '.tmp')
+            raise
+        f.close()
+        os.replace(path + '.tmp', path)
+
+    def save_text(self, doc_id: str, text: str):
+        """保存文件全文"""
+        with self.write_text(doc_id) as f:
+            f.write(text)
+
+    def has_text(self, doc_id: str) -> bool:
+        return os.path.exists(self._text_path(doc_id))
+
+    def text_size(self, doc_id: str) -> Optional[int]:
+        """全文的 UTF-8 位元組數，不存在時返回 None"""
+        try:
+            return os.path.getsize(self._text_path(doc_id))
+        except OSError:
+            return None
+
+    def load_text(self, doc_id: str) -> Optional[str]:
+        """讀取完整全文，不存在時返回 None"""
+        try:
+            with open(self._text_path(doc_id), 'r', encoding='utf-8', newline='') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Failed to load text for {doc_id} from disk: {e}")
+            return None
+
+    def read_text_range(self, doc_id: str, start: int = 0, length: int = 4096) -> Optional[Tuple[str, int, int]]:
+        """
+        以 seek 讀取全文的位元組範圍，不需載入整份文字
+
+        範圍兩端會對齊到 UTF-8 字元邊界（不切斷多位元組字元）
+
+        Returns:
+            (文字, 實際起始位元組, 實際結束位元組)，不存在時返回 None
+        """
+        try:
+            with open(self._text_path(doc_id), 'rb') as f:
+                start = max(0, start)
+                f.seek(start)
+                # 多讀 3 個位元組，讓結尾可以補齊被切斷的字元
+                data = f.read(max(0, length) + 3)
+        except FileNotFoundError:
+            return None
+        return align_text_range(data, start, length)
+
+    # ============ 語料索引 ============
+
+    def _corpus_paths(self, owner: str) -> Tuple[str, str]:
+        # 使用者 ID 只允許安全字元，其他情況以雜湊作為檔名
+        name = owner if re.fullmatch(r'[A-Za-z0-9_-]+', owner) else hashlib.sha1(owner.encode()).hexdigest()
+        return (os.path.join(self.corpus_dir, f"{name}.faiss"),
+                os.path.join(self.corpus_dir, f"{name}.map.json"))
+
+    @contextmanager
+    def corpus_lock(self, owner: str) -> Iterator[None]:
+        """跨行程的語料檔案鎖（gunicorn 的各 worker 共用同一份語料檔案）"""
+        index_path, _ = self._corpus_paths(owner)
+        with open(index_path[:-len('.faiss')] + '.lock', 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def corpus_version(self, owner: str) -> Optional[Tuple[int, int, int]]:
+        """語料映射檔的版本（每次保存都以新檔案原子替換，inode 與修改時間隨之改變）"""
+        _, map_path = self._corpus_paths(owner)
+        try:
+            stat = os.stat(map_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def save_corpus(self, owner: str, index: faiss.Index, state: Dict[str, Any]):
+        """保存使用者的語料索引與 ID 映射"""
+        index_path, map_path = self._corpus_paths(owner)
+        faiss.write_index(index, index_path + '.tmp')
+        with open(map_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'owner': owner, **state}, f, separators=(',', ':'))
+        os.replace(map_path + '.tmp', map_path)
+        os.replace(index_path + '.tmp', index_path)
+
+    def load_corpus(self, owner: str) -> Optional[Tuple[faiss.Index, Dict[str, Any]]]:
+        """載入使用者的語料索引，不存在時返回 None（呼叫者需持有 corpus_lock）"""
+        index_path, map_path = self._corpus_paths(owner)
+        if not (os.path.exists(index_path) and os.path.exists(map_path)):
+            return None
+
+        try:
+            index = faiss.read_index(index_path)
+            with open(map_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return index, state
+        except Exception as e:
+            print(f"Failed to load corpus index for {owner}: {e}")
+            return None
+
+
+def align_text_range(data: bytes, start: int, length: int) -> Tuple[str, int, int]:
+    """
+    將從 start 開始讀取的位元組（多讀 3 個位元組）對齊到 UTF-8 字元邊界並解碼
+
+    Returns:
+        (文字, 實際起始位元組, 實際結束位元組)
+    """
+    # 跳過開頭的續位元組（0b10xxxxxx）
+    head = 0
+    while head < len(data) and head < 3 and (data[head] & 0xC0) == 0x80:
+        head += 1
+    end = min(len(data), max(head, length))
+    while head < end < len(data) and (data[end] & 0xC0) == 0x80:
+        end += 1
+    return data[head:end].decode('utf-8', errors='replace'), start + head, start + end
+
+
+# 單例實例
+_index_store: Optional[IndexStore] = None
+
+def get_index_store() -> IndexStore:
+    """獲取索引存儲實例"""
+    global _index_store
+    if _index_store is None:
+        _index_store = IndexStore()
+    return _index_store
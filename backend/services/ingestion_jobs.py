@@ -0,0 +1,177 @@
+"""
+背景攝取任務佇列
+上傳請求只負責保存文件並排入佇列，解析、編碼、嵌入由背景執行緒池完成
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable
+
+from .ingestion_pipeline import IngestionPipeline, IngestionContext, INGESTION_STREAMING
+
+
+class IngestionJobQueue:
+    """
+    進程內的攝取任務佇列
+
+    任務狀態流轉：queued → processing → ready / degraded / failed，
+    與 documents 表的 status 欄位保持一致（degraded：本地索引可用但未能保存到 Supabase）。
+    """
+
+    def __init__(self, max_workers: int = None, max_finished_jobs: int = 1000):
+        self.max_workers = max_workers or int(os.getenv("INGESTION_WORKERS", "2"))
+        self.max_finished_jobs = max_finished_jobs
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="ingestion"
+        )
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.jobs_by_doc: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, doc_id: str, file_path: str, metadata: Dict[str, Any],
+               use_supabase: bool = False,
+               on_success: Optional[Callable[[IngestionContext], None]] = None,
+               on_failure: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        排入一個攝取任務
+
+        Args:
+            doc_id: 文件 ID
+            file_path: 已保存的文件路徑
+            metadata: 上傳資訊
+            use_supabase: 是否保存到 Supabase
+            on_success: 完成後的回調（參數為 IngestionContext）
+            on_failure: 失敗後的回調（參數為錯誤訊息）
+
+        Returns:
+            任務狀態快照
+        """
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        job = {
+            'job_id': job_id,
+            'document_id': doc_id,
+            'status': 'queued',
+            'current_stage': None,
+            'stages': {
+                stage: {'status': 'pending', 'duration_ms': None}
+                for stage in (IngestionPipeline.STREAMING_STAGES if INGESTION_STREAMING else IngestionPipeline.STAGES)
+            },
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+
+        with self.lock:
+            self.jobs[job_id] = job
+            self.jobs_by_doc[doc_id] = job_id
+            self._trim_finished_jobs()
+
+        self.executor.submit(
+            self._run_job, job_id, doc_id, file_path, metadata,
+            use_supabase, on_success, on_failure
+        )
+        return self._snapshot(job)
+
+    def _run_job(self, job_id: str, doc_id: str, file_path: str, metadata: Dict[str, Any],
+                 use_supabase: bool, on_success, on_failure):
+        """在背景執行緒中執行攝取管線"""
+        self._update(job_id, status='processing')
+
+        def on_stage(stage: str, state: str, duration_ms: Optional[float]):
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    return
+                job['current_stage'] = stage
+                job['stages'][stage] = {
+                    'status': 'running' if state == 'running' else 'done',
+                    'duration_ms': duration_ms
+                }
+                job['updated_at'] = time.time()
+
+        try:
+            pipeline = IngestionPipeline(use_supabase=use_supabase)
+            context = pipeline.run(doc_id, file_path, metadata, on_stage=on_stage)
+            if on_success:
+                on_success(context)
+            # 未能保存到 Supabase 時為 degraded，與 documents 記錄的 status 欄位一致
+            self._update(job_id, status=context.status, error=context.persist_error, current_stage=None)
+
+        except Exception as e:
+            print(f"Ingestion job {job_id} failed: {e}")
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job and job['current_stage']:
+                    job['stages'][job['current_stage']]['status'] = 'failed'
+            self._update(job_id, status='failed', error=str(e))
+            if on_failure:
+                try:
+                    on_failure(str(e))
+                except Exception as callback_error:
+                    print(f"Ingestion failure callback error: {callback_error}")
+
+    def _update(self, job_id: str, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+                job['updated_at'] = time.time()
+
+    def _trim_finished_jobs(self):
+        """只保留最近的已完成任務，避免記錄無限增長（呼叫者需持有鎖）"""
+        finished = [
+            job_id for job_id, job in self.jobs.items()
+            if job['status'] in ('ready', 'degraded', 'failed')
+        ]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            job = self.jobs.pop(job_id)
+            if self.jobs_by_doc.get(job['document_id']) == job_id:
+                del self.jobs_by_doc[job['document_id']]
+
+    def _snapshot(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            **job,
+            'stages': {stage: dict(info) for stage, info in job['stages'].items()}
+        }
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """依任務 ID 獲取狀態"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def get_job_for_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """依文件 ID 獲取最近一次任務的狀態"""
+        with self.lock:
+            job_id = self.jobs_by_doc.get(doc_id)
+            job = self.jobs.get(job_id) if job_id else None
+            return self._snapshot(job) if job else None
+
+    def get_stats(self) -> Dict[str, int]:
+        """佇列統計"""
+        with self.lock:
+            counts = {'queued': 0, 'processing': 0, 'ready': 0, 'degraded': 0, 'failed': 0}
+            for job in self.jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        counts['workers'] = self.max_workers
+        return counts
+
+
+# 單例實例
+_ingestion_queue: Optional[IngestionJobQueue] = None
+_ingestion_queue_lock = threading.Lock()
+
+def get_ingestion_queue() -> IngestionJobQueue:
+    """獲取攝取任務佇列實例"""
+    global _ingestion_queue
+    if _ingestion_queue is None:
+        with _ingestion_queue_lock:
+            if _ingestion_queue is None:
+                _ingestion_queue = IngestionJobQueue()
+    return _ingestion_queue
@@ -0,0 +1,399 @@
+"""
+文件攝取管線
+單次解析文件，依序執行：提取 → 去重 → 統計/切片 → 向量嵌入 → 持久化
+每個階段共用同一份文字、token 列表與區塊，並記錄各階段耗時
+與既有文件內容相同時，跳過切片與嵌入，直接共用既有索引
+
+串流模式（INGESTION_STREAMING=true）改為：提取 → 切片 → 嵌入 → 寫入 Supabase 同時進行，
+不保留完整文字與 token 列表，嵌入在解析完成前就開始；
+全文、區塊與批次模式相同，文字雜湊去重在串流結束後進行
+"""
+
+import os
+import time
+import queue
+import threading
+from typing import List, Dict, Any, Optional, Callable, Iterable, Iterator
+
+import numpy as np
+
+from .document_processor import get_document_processor, join_pages, strip_pieces
+from .rag_service import get_rag_service
+from .document_registry import text_sha256, TextHasher
+from .embedding_writer import get_embedding_writer
+
+
+# 預設是否使用串流攝取
+INGESTION_STREAMING = os.getenv("INGESTION_STREAMING", "false").lower() == "true"
+
+# 串流模式下每批嵌入的區塊數，以及提取端最多領先的區塊數（限制記憶體）
+STREAM_BATCH_SIZE = int(os.getenv("INGESTION_STREAM_BATCH_SIZE", "64"))
+STREAM_PREFETCH_CHUNKS = int(os.getenv("INGESTION_STREAM_PREFETCH", "128"))
+
+_END = object()
+
+
+def _prefetch(items: Iterable, maxsize: int) -> Iterator:
+    """
+    在背景執行緒迭代 items，經有界佇列交給呼叫者
+
+    生產端（提取、切片）與消費端（嵌入）因此可同時進行；
+    佇列滿時生產端等待，消費端提前結束時生產端隨之停止
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(entry) -> bool:
+        # 消費端已停止時放棄，避免在滿佇列上永久阻塞
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except Exception as e:
+            put((_END, e))
+
+    thread = threading.Thread(target=produce, name="ingestion-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+class IngestionContext:
+    """在各階段之間傳遞的攝取狀態"""
+
+    def __init__(self, doc_id: str, file_path: str, metadata: Optional[Dict[str, Any]] = None):
+        self.doc_id = doc_id
+        self.file_path = file_path
+        self.metadata = metadata or {}  # 檔名等上傳資訊
+        self.text: str = ""
+        self.page_offsets: List[int] = []  # 每頁在 text 中的起始字元位置
+        self.tokens = np.zeros(0, dtype=np.int32)  # 全文的 token 陣列
+        self.chunks: List[Dict[str, Any]] = []
+        self.stats: Dict[str, Any] = {}
+        self.index_result: Dict[str, Any] = {}
+        self.text_hash: Optional[str] = None
+        self.duplicate: Optional[Dict[str, Any]] = None  # 內容相同的既有文件
+        self.saved_to_supabase = False
+        self.write_stats: Dict[str, Any] = {}  # 嵌入寫入統計（rows/sec 等）
+        self.write_error: Optional[str] = None  # 串流寫入 Supabase 失敗時的錯誤
+        self.persist_error: Optional[str] = None  # 未能保存到 Supabase 的原因
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def status(self) -> str:
+        """完成後的文件狀態：ready，或 degraded（本地索引可用，但未能保存到 Supabase）"""
+        return 'degraded' if self.persist_error else 'ready'
+
+
+class IngestionPipeline:
+    """
+    文件攝取管線
+
+    文件只被解析和編碼一次，結果依序交給後續階段使用。
+    """
+
+    STAGES = ['extract', 'dedup', 'stats', 'embed', 'persist']
+    STREAMING_STAGES = ['stream', 'persist']
+
+    def __init__(self, use_supabase: bool = False, streaming: Optional[bool] = None):
+        self.use_supabase = use_supabase
+        self.streaming = INGESTION_STREAMING if streaming is None else streaming
+        self.stages = self.STREAMING_STAGES if self.streaming else self.STAGES
+        self.document_processor = get_document_processor()
+        self.rag_service = get_rag_service()
+
+    def run(self, doc_id: str, file_path: str, metadata: Optional[Dict[str, Any]] = None,
+            on_stage: Optional[Callable[[str, str, Optional[float]], None]] = None) -> IngestionContext:
+        """
+        執行完整的攝取流程
+
+        Args:
+            doc_id: 文件 ID
+            file_path: 已保存的文件路徑
+            metadata: 上傳資訊（original_filename、stored_filename、user_id、file_hash、
+                      document_saved 表示 Supabase 中已建立 processing 狀態的記錄）
+            on_stage: 進度回調 on_stage(stage, 'running' | 'done', duration_ms)
+
+        Returns:
+            包含所有階段結果與耗時的 IngestionContext
+        """
+        context = IngestionContext(doc_id, file_path, metadata)
+        return self._run_stages(context, self.stages, on_stage)
+
+    def run_duplicate(self, doc_id: str, file_path: str, metadata: Dict[str, Any],
+                      duplicate: Dict[str, Any]) -> IngestionContext:
+        """
+        檔案位元組與既有文件完全相同：不解析，只建立指向既有內容的文件記錄
+
+        Args:
+            duplicate: RAGService.find_duplicate 的返回值
+        """
+        context = IngestionContext(doc_id, file_path, metadata)
+        context.duplicate = duplicate
+        return self._run_stages(context, ['stats', 'embed', 'persist'])
+
+    def _run_stages(self, context: IngestionContext, stages: List[str],
+                    on_stage: Optional[Callable[[str, str, Optional[float]], None]] = None) -> IngestionContext:
+        for stage in stages:
+            if on_stage:
+                on_stage(stage, 'running', None)
+            started = time.perf_counter()
+            getattr(self, f'_stage_{stage}')(context)
+            context.timings[stage] = round((time.perf_counter() - started) * 1000, 2)
+            if on_stage:
+                on_stage(stage, 'done', context.timings[stage])
+
+        return context
+
+    def _stage_extract(self, context: IngestionContext):
+        """逐頁提取純文字（大型 PDF 以行程池並行）"""
+        pages = self.document_processor.extract_pages(context.file_path)
+        context.text, context.page_offsets = join_pages(pages)
+
+    def _stage_dedup(self, context: IngestionContext):
+        """以正規化文字雜湊查找內容相同的既有文件"""
+        context.text_hash = text_sha256(context.text)
+        context.duplicate = self.rag_service.find_duplicate(text_hash=context.text_hash)
+
+    def _stage_stats(self, context: IngestionContext):
+        """編碼一次，同時產生統計資訊和區塊（重複文件直接沿用來源的統計）"""
+        if context.duplicate:
+            context.stats = {
+                "total_characters": len(context.text) if context.text else context.duplicate['total_characters'],
+                "total_tokens": context.duplicate['total_tokens'],
+                "total_chunks": context.duplicate['total_chunks'],
+                "file_size": os.path.getsize(context.file_path),
+                "file_name": os.path.basename(context.file_path)
+            }
+            return
+
+        if self.document_processor.chunking_strategy == 'semantic':
+            # 語義區塊之間不重疊，token 總數即各區塊之和（不需再次編碼全文）
+            context.chunks = self.document_processor.split_semantic(
+                context.text, context.page_offsets, context.file_path
+            )
+            total_tokens = sum(chunk["token_count"] for chunk in context.chunks)
+        else:
+            context.tokens = self.document_processor.encode_array(context.text)
+            context.chunks = self.document_processor.split_text_into_chunks(context.text, context.tokens)
+            self.document_processor.assign_pages(context.chunks, context.text, context.page_offsets)
+            total_tokens = len(context.tokens)
+        context.stats = self.document_processor.get_document_stats(
+            context.file_path, context.text, total_tokens, context.chunks
+        )
+
+    def _stage_embed(self, context: IngestionContext):
+        """生成向量嵌入並建立 FAISS 索引（重複文件改為共用既有索引）"""
+        file_hash = context.metadata.get('file_hash')
+        owner = context.metadata.get('user_id')
+
+        if context.duplicate:
+            context.index_result = self.rag_service.link_duplicate(
+                context.doc_id, context.duplicate, owner=owner,
+                file_hash=file_hash, text_hash=context.text_hash
+            )
+            return
+
+        context.index_result = self.rag_service.index_chunks(
+            context.doc_id, context.chunks, owner=owner, text=context.text
+        )
+        self.rag_service.register_document(context.doc_id, file_hash, context.text_hash, {
+            **context.stats,
+            'total_chunks': context.index_result['chunks_indexed']
+        })
+
+    def _stage_stream(self, context: IngestionContext):
+        """
+        串流攝取：逐頁提取 → 滑動視窗切片 → 分批嵌入，每批嵌入完成即寫入 Supabase
+
+        全文與區塊和批次模式相同（同樣的正規化與 token 序列）。
+        文字雜湊要到串流結束才能得知：內容與既有文件相同時，捨棄剛建立的索引與已寫入的嵌入，
+        改為共用既有內容（嵌入已在快取中，重複的代價只有一次索引）。
+        串流失敗時刪除已寫入的嵌入並將記錄標記為 failed
+        """
+        file_hash = context.metadata.get('file_hash')
+        owner = context.metadata.get('user_id')
+        hasher = TextHasher()
+        counts = {'characters': 0, 'tokens': 0}
+
+        def pieces(text_file):
+            for page_number, text in strip_pieces(self.document_processor.iter_pages(context.file_path)):
+                hasher.update(text)
+                text_file.write(text)
+                counts['characters'] += len(text)
+                yield page_number, text
+
+        def chunks(text_file):
+            for chunk in self.document_processor.iter_chunks(pieces(text_file)):
+                counts['tokens'] = chunk['end_token']
+                yield chunk
+
+        on_batch = None
+        if self.use_supabase:
+            on_batch = self._stream_writer(context)
+
+        try:
+            # 全文邊提取邊寫入磁碟，get_full_text 不需在記憶體中組合整份文字
+            with self.rag_service.index_store.write_text(context.doc_id) as text_file:
+                context.index_result = self.rag_service.index_chunk_stream(
+                    context.doc_id, _prefetch(chunks(text_file), STREAM_PREFETCH_CHUNKS), owner=owner,
+                    batch_size=STREAM_BATCH_SIZE, on_batch=on_batch
+                )
+        except Exception as e:
+            context.persist_error = str(e)
+            self.rag_service.remove_document(context.doc_id, owner)
+            self._mark_failed(context)
+            raise
+
+        context.text_hash = hasher.hexdigest()
+        context.stats = {
+            "total_characters": counts['characters'],
+            "total_tokens": counts['tokens'],
+            "total_chunks": context.index_result['chunks_indexed'],
+            "file_size": os.path.getsize(context.file_path),
+            "file_name": os.path.basename(context.file_path)
+        }
+
+        context.duplicate = self.rag_service.find_duplicate(text_hash=context.text_hash)
+        if context.duplicate:
+            self.rag_service.remove_document(context.doc_id, owner)
+            if context.metadata.get('document_saved'):
+                self._delete_embeddings(context)
+            context.index_result = self.rag_service.link_duplicate(
+                context.doc_id, context.duplicate, owner=owner,
+                file_hash=file_hash, text_hash=context.text_hash
+            )
+            return
+
+        self.rag_service.register_document(context.doc_id, file_hash, context.text_hash, context.stats)
+
+    def _stream_writer(self, context: IngestionContext) -> Callable[[List[Dict[str, Any]], Any], None]:
+        """建立串流模式下每批嵌入的 Supabase 寫入回調（失敗後停止寫入，不中斷索引）"""
+        totals = {'rows': 0, 'batches': 0, 'retries': 0, 'seconds': 0.0}
+
+        def write(chunks: List[Dict[str, Any]], embeddings):
+            if context.write_error:
+                return
+            try:
+                from config import get_supabase
+                if not context.metadata.get('document_saved'):
+                    # 嵌入資料列參照 documents，需先建立 processing 狀態的記錄
+                    get_supabase().save_document({
+                        'id': context.doc_id,
+                        'original_filename': context.metadata.get('original_filename'),
+                        'stored_filename': context.metadata.get('stored_filename'),
+                        'file_size': os.path.getsize(context.file_path),
+                        'file_hash': context.metadata.get('file_hash'),
+                        'status': 'processing'
+                    })
+                    context.metadata['document_saved'] = True
+
+                stats = get_embedding_writer().write(self.rag_service.embedding_rows(context.doc_id, chunks, embeddings))
+                for key in totals:
+                    totals[key] += stats[key]
+                context.write_stats = {
+                    **totals,
+                    'seconds': round(totals['seconds'], 3),
+                    'rows_per_sec': round(totals['rows'] / totals['seconds'], 1) if totals['seconds'] > 0 else 0.0,
+                    'method': stats['method']
+                }
+            except Exception as e:
+                print(f"Supabase streaming write failed: {e}")
+                context.write_error = str(e)
+
+        return write
+
+    def _stage_persist(self, context: IngestionContext):
+        """
+        保存文件元數據和嵌入到 Supabase（如果已配置）
+
+        結束時 documents 記錄一定是 ready 或 degraded（附錯誤訊息），
+        不會停留在 processing；Supabase 失敗不影響本地索引，
+        背景任務與 documents 記錄都以 context.status 回報 degraded
+        """
+        if not self.use_supabase:
+            return
+
+        from config import get_supabase
+        error = context.write_error
+        try:
+            if error is None:
+                self._persist(context, get_supabase())
+                context.saved_to_supabase = True
+        except Exception as supabase_error:
+            print(f"Supabase save failed: {supabase_error}")
+            error = str(supabase_error)
+        finally:
+            if not context.saved_to_supabase:
+                context.persist_error = error or 'Supabase save failed'
+                self._mark_failed(context, status='degraded')
+
+    def _persist(self, context: IngestionContext, supabase):
+        doc_stats = {
+            'total_characters': context.stats['total_characters'],
+            'total_tokens': context.stats['total_tokens'],
+            'total_chunks': context.index_result['chunks_indexed'],
+            'file_hash': context.metadata.get('file_hash'),
+            'text_hash': context.text_hash,
+            'content_document_id': context.index_result.get('content_document_id')
+        }
+
+        if not context.metadata.get('document_saved'):
+            supabase.save_document({
+                'id': context.doc_id,
+                'original_filename': context.metadata.get('original_filename'),
+                'stored_filename': context.metadata.get('stored_filename'),
+                'file_size': context.stats['file_size'],
+                'status': 'processing',
+                **doc_stats
+            })
+            context.metadata['document_saved'] = True
+
+        # 分批並行寫入（或經 DATABASE_URL 以 COPY 寫入）
+        embeddings_data = context.index_result.get('embeddings_for_db', [])
+        if embeddings_data:
+            context.write_stats = get_embedding_writer().write(embeddings_data)
+
+        # 嵌入寫入完成後才標記為 ready
+        supabase.update_document(context.doc_id, {**doc_stats, 'status': 'ready'})
+
+    def _mark_failed(self, context: IngestionContext, status: str = 'failed'):
+        """將 documents 記錄標記為 failed / degraded 並刪除已寫入的部分嵌入（記錄不存在時不做任何事）"""
+        if not context.metadata.get('document_saved'):
+            return
+        self._delete_embeddings(context)
+        try:
+            from config import get_supabase
+            get_supabase().mark_document_failed(context.doc_id, context.persist_error, status=status)
+        except Exception as e:
+            print(f"Supabase status update failed for {context.doc_id}: {e}")
+
+    def _delete_embeddings(self, context: IngestionContext):
+        try:
+            from config import get_supabase
+            get_supabase().delete_document_embeddings(context.doc_id)
+        except Exception as e:
+            print(f"Supabase embedding cleanup failed for {context.doc_id}: {e}")
+
+
+def get_ingestion_pipeline(use_supabase: bool = False, streaming: Optional[bool] = None) -> IngestionPipeline:
+    """獲取攝取管線實例"""
+    return IngestionPipeline(use_supabase=use_supabase, streaming=streaming)
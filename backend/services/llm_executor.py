@@ -0,0 +1,355 @@
+"""
+LLM 請求執行器
+以執行緒池並行呼叫 Groq，並提供：
+- 依每分鐘請求數（RPM）與 token 數（TPM）的令牌桶限流
+- 429 / 5xx / 連線錯誤時的抖動指數退避重試
+- 相同提示的進行中請求合併（只呼叫一次 LLM）
+- 串流回答與執行緒池共用同一個並行上限（LLM_MAX_CONCURRENCY）
+- 佇列深度與等待時間統計
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Any, Optional, Iterator
+
+import httpx
+import tiktoken
+from groq import Groq, APIStatusError, APIConnectionError, APITimeoutError
+
+# 預估回覆長度（token），實際用量在回應後校正
+EXPECTED_COMPLETION_TOKENS = 1024
+
+# 統計最近多少筆等待時間
+_LATENCY_WINDOW = 1000
+
+
+class TokenBucket:
+    """
+    令牌桶：容量為每分鐘預算，按時間連續補充
+
+    Args:
+        per_minute: 每分鐘可用量；0 或負數表示不限制
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """
+        取得 amount 個令牌，不足時阻塞等待
+
+        Returns:
+            等待的秒數
+        """
+        if not self.enabled:
+            return 0.0
+
+        # 單次請求超過整個桶容量時，最多等到桶滿
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, delta: float):
+        """校正已扣除的用量（正數退還、負數補扣，可暫時為負）"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + delta)
+
+    def penalize(self, seconds: float):
+        """伺服器要求等待（Retry-After）時清空桶，讓其他請求一起退讓"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """讀取 Retry-After 標頭（秒）"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMExecutor:
+    """
+    Groq 聊天補全的共用執行器
+
+    Args:
+        client: Groq 客戶端（自身的重試需關閉，由執行器負責）
+        max_workers: 同時進行的請求數，包含串流（預設讀取 LLM_MAX_CONCURRENCY）
+        requests_per_minute: RPM 預算（預設讀取 GROQ_RPM，0 為不限制）
+        tokens_per_minute: TPM 預算（預設讀取 GROQ_TPM，0 為不限制）
+        max_retries: 可重試錯誤的最大重試次數（預設讀取 LLM_MAX_RETRIES）
+    """
+
+    def __init__(self, client: Groq, max_workers: int = None, requests_per_minute: float = None,
+                 tokens_per_minute: float = None, max_retries: int = None):
+        self.client = client
+        self.max_workers = max_workers or int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "4"))
+        self.backoff_base = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+        self.backoff_max = float(os.getenv("LLM_BACKOFF_MAX", "30.0"))
+
+        self.request_bucket = TokenBucket(
+            requests_per_minute if requests_per_minute is not None else float(os.getenv("GROQ_RPM", "30"))
+        )
+        self.token_bucket = TokenBucket(
+            tokens_per_minute if tokens_per_minute is not None else float(os.getenv("GROQ_TPM", "30000"))
+        )
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="llm")
+        # 執行緒池的請求與串流各佔一個名額，合計不超過 max_workers
+        self.slots = threading.BoundedSemaphore(self.max_workers)
+
+        # 進行中的請求：提示鍵 -> Future
+        self.in_flight: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.queue_waits_ms = deque(maxlen=_LATENCY_WINDOW)
+        self.limiter_waits_ms = deque(maxlen=_LATENCY_WINDOW)
+
+    @staticmethod
+    def _request_key(request: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _estimate_tokens(self, messages: List[Dict[str, str]], max_tokens: int) -> int:
+        prompt_tokens = sum(len(self.encoding.encode(message["content"])) for message in messages)
+        return prompt_tokens + min(max_tokens, EXPECTED_COMPLETION_TOKENS)
+
+    def _acquire(self, estimated_tokens: int):
+        """等待 RPM 與 TPM 預算"""
+        waited = self.request_bucket.acquire(1)
+        waited += self.token_bucket.acquire(estimated_tokens)
+        with self.lock:
+            self.limiter_waits_ms.append(waited * 1000)
+
+    def _with_retries(self, call, estimated_tokens: int):
+        """限流後呼叫 call()，可重試錯誤時以抖動指數退避重試"""
+        attempt = 0
+        while True:
+            self._acquire(estimated_tokens)
+            try:
+                return call()
+            except Exception as e:
+                # 請求失敗時 token 未必被消耗，退還預估用量
+                self.token_bucket.adjust(estimated_tokens)
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    delay = retry_after
+                    self.request_bucket.penalize(retry_after)
+                else:
+                    # full jitter：在 [0, base·2^attempt] 之間隨機等待
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+                attempt += 1
+                with self.lock:
+                    self.retries += 1
+                print(f"LLM request failed ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _run(self, request: Dict[str, Any], submitted_at: float) -> str:
+        with self.slots:
+            return self._call(request, submitted_at)
+
+    def _call(self, request: Dict[str, Any], submitted_at: float) -> str:
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.queue_waits_ms.append((time.monotonic() - submitted_at) * 1000)
+
+        estimated_tokens = self._estimate_tokens(request["messages"], request["max_tokens"])
+        try:
+            response = self._with_retries(
+                lambda: self.client.chat.completions.create(**request), estimated_tokens
+            )
+            # 以實際用量校正 TPM 預算
+            usage = getattr(response, 'usage', None)
+            if usage is not None and getattr(usage, 'total_tokens', None):
+                self.token_bucket.adjust(estimated_tokens - usage.total_tokens)
+            with self.lock:
+                self.completed += 1
+            return response.choices[0].message.content
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def submit(self, model: str, messages: List[Dict[str, str]], temperature: float = 0.7,
+               max_tokens: int = 4096) -> Future:
+        """
+        提交聊天補全請求；相同的進行中請求會共用同一個 Future
+
+        Returns:
+            結果為回覆文字的 Future
+        """
+        request = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        key = self._request_key(request)
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            self.queued += 1
+            future = self.executor.submit(self._run, request, time.monotonic())
+            self.in_flight[key] = future
+
+        def _release(_):
+            with self.lock:
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
+
+        future.add_done_callback(_release)
+        return future
+
+    def complete(self, model: str, messages: List[Dict[str, str]], temperature: float = 0.7,
+                 max_tokens: int = 4096) -> str:
+        """提交請求並等待回覆文字"""
+        return self.submit(model, messages, temperature, max_tokens).result()
+
+    def stream(self, model: str, messages: List[Dict[str, str]], temperature: float = 0.7,
+               max_tokens: int = 4096) -> Iterator[str]:
+        """
+        串流聊天補全（在呼叫者執行緒中進行，仍受限流與建立連線時的重試保護）
+
+        串流期間佔用一個與執行緒池共用的名額，池已滿時等待其他請求完成
+
+        Yields:
+            新生成的文字片段
+        """
+        estimated_tokens = self._estimate_tokens(messages, max_tokens)
+        submitted_at = time.monotonic()
+        with self.slots:
+            with self.lock:
+                self.running += 1
+                self.queue_waits_ms.append((time.monotonic() - submitted_at) * 1000)
+            try:
+                stream = self._with_retries(
+                    lambda: self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True
+                    ),
+                    estimated_tokens
+                )
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            queue_waits = sorted(self.queue_waits_ms)
+            limiter_waits = list(self.limiter_waits_ms)
+            return {
+                'max_workers': self.max_workers,
+                'queue_depth': self.queued,
+                'running': self.running,
+                'in_flight_prompts': len(self.in_flight),
+                'completed': self.completed,
+                'failed': self.failed,
+                'retries': self.retries,
+                'coalesced': self.coalesced,
+                'avg_queue_wait_ms': round(sum(queue_waits) / len(queue_waits), 1) if queue_waits else 0.0,
+                'p95_queue_wait_ms': round(queue_waits[int(len(queue_waits) * 0.95) - 1], 1) if queue_waits else 0.0,
+                'avg_rate_limit_wait_ms': round(sum(limiter_waits) / len(limiter_waits), 1) if limiter_waits else 0.0,
+                'requests_per_minute': self.request_bucket.capacity,
+                'tokens_per_minute': self.token_bucket.capacity
+            }
+
+
+# 單例實例（每個工作行程一個，連線池與限流狀態跨請求共用）
+_llm_executor: Optional[LLMExecutor] = None
+_llm_executor_lock = threading.Lock()
+
+def get_llm_executor() -> LLMExecutor:
+    """獲取 LLM 執行器實例"""
+    global _llm_executor
+    if _llm_executor is None:
+        with _llm_executor_lock:
+            if _llm_executor is None:
+                api_key = os.getenv("GROQ_API_KEY")
+                if not api_key:
+                    raise ValueError("GROQ_API_KEY must be set in environment variables")
+                max_workers = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+                # 長連線池：執行緒池與串流回答共用，避免每次請求重新 TLS 握手
+                http_client = httpx.Client(
+                    timeout=httpx.Timeout(float(os.getenv("GROQ_TIMEOUT", "120")), connect=10.0),
+                    limits=httpx.Limits(
+                        max_connections=max_workers * 4,
+                        max_keepalive_connections=max_workers * 2,
+                        keepalive_expiry=float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "60"))
+                    )
+                )
+                # 關閉 SDK 內建重試，統一由執行器依限流狀態重試
+                _llm_executor = LLMExecutor(
+                    Groq(api_key=api_key, max_retries=0, http_client=http_client), max_workers=max_workers
+                )
+    return _llm_executor
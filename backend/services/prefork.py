@@ -0,0 +1,57 @@
+"""
+多工作行程部署（gunicorn preload_app）支援
+主行程在 fork 前載入嵌入模型，工作行程以寫時複製（copy-on-write）共用模型權重；
+fork 後每個工作行程需重建不可跨行程共用的資源（SQLite 連線、鎖、執行緒池）
+"""
+
+import gc
+import threading
+
+from .embedding_batcher import EmbeddingBatcher
+
+
+def preload():
+    """在主行程載入嵌入模型（不執行編碼，避免 fork 前啟動推論執行緒池）"""
+    from .rag_service import get_rag_service
+
+    get_rag_service()
+
+    # 將目前所有物件移出 GC 追蹤，避免工作行程的垃圾回收寫入共用頁面觸發複製
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork():
+    """
+    fork 後在工作行程中呼叫
+
+    - SQLite 連線不可跨 fork 使用，重新連線
+    - 鎖在 fork 時可能處於持有狀態，重新建立
+    - 執行緒池、連線池、批次編碼執行緒不會被複製到子行程，清除單例以便延遲重建
+    """
+    from . import rag_service, llm_executor, groq_service, ingestion_jobs, embedding_writer, document_processor
+
+    service = rag_service._rag_service
+    if service is not None:
+        service._load_lock = threading.Lock()
+        if service.embedding_cache is not None:
+            service.embedding_cache.reopen()
+        service.registry.reopen()
+        if service.batcher is not None:
+            service.batcher = EmbeddingBatcher(service._encode)
+
+        # 主行程不會有待寫回的語料（尚未處理請求），只需重建鎖與計時器狀態
+        service.corpus.lock = threading.RLock()
+        service.corpus.owner_locks = {}
+        service.corpus._save_timer = None
+
+    llm_executor._llm_executor = None
+    llm_executor._llm_executor_lock = threading.Lock()
+    groq_service._groq_service = None
+    groq_service._groq_service_lock = threading.Lock()
+    ingestion_jobs._ingestion_queue = None
+    ingestion_jobs._ingestion_queue_lock = threading.Lock()
+    embedding_writer._embedding_writer = None
+    embedding_writer._embedding_writer_lock = threading.Lock()
+    document_processor._pdf_pool = None
+    document_processor._pdf_pool_lock = threading.Lock()
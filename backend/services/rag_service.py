@@ -4,27 +4,78 @@ RAG（檢索增強生成）服務
 """
 
 import os
+import json
+import threading
 import numpy as np
-from typing import List, Dict, Any, Optional
-from sentence_transformers import SentenceTransformer
+from typing import List, Dict, Any, Optional, Iterable, Callable
 import faiss
 
-from .document_processor import get_document_processor
+from .document_processor import get_document_processor, reconstruct_text, reconstruct_from_offsets
+from .index_store import get_index_store, align_text_range
+from .index_cache import IndexCache, TextCache
+from .corpus_index import CorpusIndexManager
+from .vector_index import build_index, configure_search, get_index_type, is_quantized, rerank, RERANK_FACTOR
+from .embedding_cache import get_embedding_cache, QueryEmbeddingCache
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_backends import create_embedding_backend
+from .document_registry import get_document_registry
+
+# 是否使用 Supabase（用於從 document_embeddings 重建索引）
+USE_SUPABASE = os.getenv('SUPABASE_URL') and os.getenv('SUPABASE_KEY')
+
+# 問答檢索的預設候選數與上下文 token 上限（語義切片的區塊較小且集中，可調低以縮短提示）
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "10"))
+RETRIEVAL_MAX_TOKENS = int(os.getenv("RETRIEVAL_MAX_TOKENS", "4000"))
+
+
+def to_halfvec_literal(embedding: np.ndarray) -> str:
+    """
+    將向量轉為 pgvector halfvec 文字格式
+
+    先捨入到 float16，再以 5 位有效數字輸出（足以精確還原 float16），
+    請求大小約為 float32 JSON 列表的一半
+    """
+    values = np.asarray(embedding, dtype=np.float16).astype(np.float32).tolist()
+    return '[' + ','.join(f'{v:.5g}' for v in values) + ']'
 
 
 class RAGService:
     def __init__(self):
-        # 使用中文優化的嵌入模型
+        # 使用中文優化的嵌入模型；前綴選擇推論後端（onnx: / onnx-int8:，見 embedding_backends）
         model_name = os.getenv("EMBEDDING_MODEL", "shibing624/text2vec-base-chinese")
         print(f"載入嵌入模型: {model_name}")
-        self.embedding_model = SentenceTransformer(model_name)
-        self.embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
-        print(f"嵌入維度: {self.embedding_dim}")
+        # 完整規格（含後端前綴）作為嵌入快取的鍵，不同後端的向量不會混用
+        self.model_name = model_name
+        self.embedding_backend = create_embedding_backend(model_name)
+        self.embedding_dim = self.embedding_backend.dimension
+        print(f"嵌入維度: {self.embedding_dim}（{self.embedding_backend.backend}）")
         self.document_processor = get_document_processor()
         
-        # 內存中的向量索引（每個文件一個）
-        self.indices: Dict[str, faiss.IndexFlatIP] = {}
-        self.chunks_store: Dict[str, List[Dict]] = {}
+        # 內存中的向量索引（每個文件一個），受記憶體預算限制
+        self.index_cache = IndexCache()
+        
+        # 文件全文（測驗、閃卡、摘要與預覽共用）
+        self.text_cache = TextCache()
+        
+        # 以區塊內容雜湊為鍵的嵌入快取，重複上傳的講義不需重新編碼
+        self.embedding_cache = get_embedding_cache() if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true" else None
+        
+        # 查詢向量 LRU，重複的問題跳過編碼器
+        self.query_cache = QueryEmbeddingCache()
+        
+        # 並行的小請求（查詢）合併成批次編碼
+        self.batcher = EmbeddingBatcher(self._encode) \
+            if os.getenv("EMBEDDING_BATCHING", "true").lower() == "true" else None
+        
+        # 磁碟持久化，重啟或被淘汰後延遲載入
+        self.index_store = get_index_store()
+        self._load_lock = threading.Lock()
+        
+        # 文件雜湊登記，重複上傳的文件共用既有索引
+        self.registry = get_document_registry()
+        
+        # 跨文件語料索引（每個使用者一個共享索引）
+        self.corpus = CorpusIndexManager(self.embedding_dim)
     
     def create_embeddings(self, texts: List[str]) -> np.ndarray:
         """
@@ -37,17 +88,77 @@ class RAGService:
         Returns:
             嵌入向量陣列 (768 維)
         """
+        # 文件區塊（含快取未命中的少數區塊）直接編碼；只有查詢經過微批次處理（見 embed_query）
+        return self._encode(texts)
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """以嵌入模型批次編碼"""
         # 使用 batch 處理提高效率
-        embeddings = self.embedding_model.encode(
-            texts, 
-            convert_to_numpy=True,
-            normalize_embeddings=True,  # 自動正規化
-            show_progress_bar=len(texts) > 10  # 大量文字時顯示進度
-        )
+        embeddings = np.ascontiguousarray(self.embedding_backend.encode(texts), dtype=np.float32)
         # 確保正規化（用於餘弦相似度）
         faiss.normalize_L2(embeddings)
         return embeddings
     
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        創建查詢嵌入（優先使用查詢快取）
+        
+        Returns:
+            形狀為 (1, 維度) 的向量
+        """
+        cached = self.query_cache.get(self.model_name, query)
+        if cached is not None:
+            return cached.reshape(1, -1)
+        
+        # 並行請求的查詢合併成批次編碼
+        if self.batcher is not None:
+            query_embedding = self.batcher.encode([query])
+        else:
+            query_embedding = self._encode([query])
+        self.query_cache.put(self.model_name, query, query_embedding[0])
+        return query_embedding
+    
+    def create_document_embeddings(self, texts: List[str]):
+        """
+        為文件區塊創建嵌入，優先使用內容定址快取
+        
+        Args:
+            texts: 區塊文字列表
+        
+        Returns:
+            (嵌入向量陣列, 快取統計 {"hits", "misses", "hit_rate"})
+        """
+        if self.embedding_cache is None:
+            return self.create_embeddings(texts), {'hits': 0, 'misses': len(texts), 'hit_rate': 0.0}
+        
+        cached, hashes = self.embedding_cache.get_many(self.model_name, texts)
+        
+        # 只編碼未命中的區塊（同一文件內重複的區塊也只編碼一次）
+        missing = {}
+        for i, h in enumerate(hashes):
+            if i not in cached and h not in missing:
+                missing[h] = i
+        
+        embeddings = np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
+        for i, vector in cached.items():
+            embeddings[i] = vector
+        
+        if missing:
+            missing_hashes = list(missing)
+            encoded = self.create_embeddings([texts[missing[h]] for h in missing_hashes])
+            self.embedding_cache.put_many(self.model_name, missing_hashes, encoded)
+            encoded_by_hash = dict(zip(missing_hashes, encoded))
+            for i, h in enumerate(hashes):
+                if i not in cached:
+                    embeddings[i] = encoded_by_hash[h]
+        
+        hits = len(cached)
+        return embeddings, {
+            'hits': hits,
+            'misses': len(texts) - hits,
+            'hit_rate': round(hits / len(texts), 4) if texts else 0.0
+        }
+    
     def index_document(self, doc_id: str, file_path: str) -> Dict[str, Any]:
         """
         索引一個文件
@@ -65,39 +176,134 @@ class RAGService:
         # 分割成區塊
         chunks = self.document_processor.split_into_chunks(text)
         
+        result = self.index_chunks(doc_id, chunks, text=text)
+        result["full_text"] = text  # 返回完整文字供後續使用
+        return result
+    
+    def index_chunks(self, doc_id: str, chunks: List[Dict[str, Any]], owner: Optional[str] = None,
+                     text: Optional[str] = None) -> Dict[str, Any]:
+        """
+        為已切分的區塊建立嵌入和索引（不重新提取文字）
+        
+        Args:
+            doc_id: 文件 ID
+            chunks: DocumentProcessor 產生的區塊列表
+            owner: 使用者 ID，文件會同時加入該使用者的語料索引
+            text: 提取出的完整文字，與索引一起保存供 get_full_text 使用
+        
+        Returns:
+            索引結果資訊（包含可保存到 Supabase 的嵌入數據）
+        """
         if not chunks:
             raise ValueError("No content could be extracted from the document")
         
-        # 創建嵌入
+        # 創建嵌入（命中快取的區塊跳過模型編碼）
         texts = [chunk["content"] for chunk in chunks]
-        embeddings = self.create_embeddings(texts)
-        
-        # 創建 FAISS 索引
-        index = faiss.IndexFlatIP(self.embedding_dim)
-        index.add(embeddings)
-        
-        # 存儲索引和區塊
-        self.indices[doc_id] = index
-        self.chunks_store[doc_id] = chunks
-        
-        # 準備 Supabase 嵌入數據
-        embeddings_for_db = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            embeddings_for_db.append({
-                'document_id': doc_id,
-                'content': chunk['content'],
-                'chunk_index': chunk['chunk_index'],
-                'embedding': embedding.tolist()  # 轉換為列表以便 JSON 序列化
-            })
+        embeddings, cache_stats = self.create_document_embeddings(texts)
+        
+        result = self._store_index(doc_id, chunks, embeddings, owner, cache_stats, text)
+        result["embeddings_for_db"] = self.embedding_rows(doc_id, chunks, embeddings)  # 供 Supabase 保存
+        return result
+    
+    def index_chunk_stream(self, doc_id: str, chunks: Iterable[Dict[str, Any]], owner: Optional[str] = None,
+                           batch_size: int = 64,
+                           on_batch: Optional[Callable[[List[Dict[str, Any]], np.ndarray], None]] = None) -> Dict[str, Any]:
+        """
+        邊接收區塊邊嵌入（提取與切片尚未結束時即開始編碼）
+        全文不經過這裡，由呼叫端以 IndexStore.write_text 邊提取邊寫入
+        
+        Args:
+            doc_id: 文件 ID
+            chunks: 區塊的迭代器（例如 DocumentProcessor.iter_chunks）
+            owner: 使用者 ID
+            batch_size: 每次送入模型的區塊數
+            on_batch: 每批嵌入完成後的回調 on_batch(區塊, 向量)，用於即時寫入 Supabase
+        
+        Returns:
+            與 index_chunks 相同格式的索引結果（embeddings_for_db 為空，已由 on_batch 處理）
+        """
+        all_chunks: List[Dict[str, Any]] = []
+        batches: List[np.ndarray] = []
+        hits = 0
+        batch: List[Dict[str, Any]] = []
+        
+        def flush():
+            nonlocal hits
+            embeddings, stats = self.create_document_embeddings([chunk["content"] for chunk in batch])
+            hits += stats['hits']
+            batches.append(embeddings)
+            all_chunks.extend(batch)
+            if on_batch:
+                on_batch(batch, embeddings)
+        
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+        if batch:
+            flush()
+        
+        if not all_chunks:
+            raise ValueError("No content could be extracted from the document")
+        
+        cache_stats = {
+            'hits': hits,
+            'misses': len(all_chunks) - hits,
+            'hit_rate': round(hits / len(all_chunks), 4)
+        }
+        result = self._store_index(doc_id, all_chunks, np.concatenate(batches), owner, cache_stats)
+        result["embeddings_for_db"] = []
+        return result
+    
+    def _store_index(self, doc_id: str, chunks: List[Dict[str, Any]], embeddings: np.ndarray,
+                     owner: Optional[str], cache_stats: Dict[str, Any], text: Optional[str] = None) -> Dict[str, Any]:
+        """建立 FAISS 索引，寫入磁碟、快取與語料索引"""
+        # 創建 FAISS 索引（依區塊數量或 VECTOR_INDEX_TYPE 選擇 Flat / HNSW / IVF）
+        index = build_index(embeddings)
+        
+        # 先寫入磁碟，重啟或被快取淘汰後無需重新嵌入
+        try:
+            if text is not None:
+                self.index_store.save_text(doc_id, text)
+            self.index_store.save(doc_id, index, chunks, embeddings if is_quantized(index) else None)
+        except Exception as e:
+            print(f"Failed to persist index for {doc_id}: {e}")
+        
+        # 上傳後通常緊接著產生測驗或摘要
+        if text is not None:
+            self.text_cache.put(doc_id, text)
+        else:
+            self.text_cache.pop(doc_id)
+        
+        # 存儲索引和區塊（量化索引一併開啟全精度向量的 mmap）
+        vectors = self.index_store.load_vectors(doc_id) if is_quantized(index) else None
+        self.index_cache.put(doc_id, index, chunks, vectors)
+        
+        # 加入跨文件語料索引
+        self.corpus.add_document(doc_id, embeddings, owner)
         
         return {
             "doc_id": doc_id,
             "chunks_indexed": len(chunks),
             "total_tokens": sum(chunk["token_count"] for chunk in chunks),
-            "full_text": text,  # 返回完整文字供後續使用
-            "embeddings_for_db": embeddings_for_db  # 供 Supabase 保存
+            "index_type": get_index_type(index),
+            "embedding_cache": cache_stats
         }
     
+    @staticmethod
+    def embedding_rows(doc_id: str, chunks: List[Dict[str, Any]], embeddings: np.ndarray) -> List[Dict[str, Any]]:
+        """準備 Supabase 嵌入數據（halfvec 欄位只保留 float16 精度）"""
+        return [{
+            'document_id': doc_id,
+            'content': chunk['content'],
+            'chunk_index': chunk['chunk_index'],
+            # 區塊在全文中的位元組位置，從 Supabase 重建時可精確還原全文（語義區塊沒有）
+            'start_byte': chunk.get('start_byte'),
+            'end_byte': chunk.get('end_byte'),
+            'embedding': to_halfvec_literal(embedding)
+        } for chunk, embedding in zip(chunks, embeddings)]
+    
     def search(self, doc_id: str, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """
         在文件中搜索相關內容
@@ -110,25 +316,44 @@ class RAGService:
         Returns:
             相關區塊列表
         """
-        if doc_id not in self.indices:
+        return self._search_document(doc_id, self.embed_query(query), top_k)
+    
+    def _search_document(self, doc_id: str, query_embedding: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        """以已編碼的查詢向量搜索單一文件"""
+        loaded = self._get_document(doc_id)
+        if loaded is None:
             raise ValueError(f"Document {doc_id} not indexed")
+        index, chunks = loaded
         
-        # 創建查詢嵌入
-        query_embedding = self.create_embeddings([query])
+        # 量化索引先多取候選，再以磁碟上的全精度向量重新排序；
+        # mmap 與索引一起快取，只有快取項目在載入後被替換時才重新開啟
+        vectors = None
+        if is_quantized(index):
+            content_id = self.registry.resolve(doc_id) or doc_id
+            vectors = self.index_cache.get_vectors(content_id)
+            if vectors is None:
+                vectors = self.index_store.load_vectors(content_id)
         
         # 搜索
-        index = self.indices[doc_id]
-        scores, indices = index.search(query_embedding, min(top_k, index.ntotal))
+        if vectors is not None and len(vectors) == index.ntotal:
+            _, candidates = index.search(query_embedding, min(top_k * RERANK_FACTOR, index.ntotal))
+            indices, scores = rerank(query_embedding[0], candidates[0], vectors, top_k)
+            scores, indices = scores[None, :], indices[None, :]
+        else:
+            scores, indices = index.search(query_embedding, min(top_k, index.ntotal))
         
         # 獲取結果
         results = []
-        chunks = self.chunks_store[doc_id]
         
         for score, idx in zip(scores[0], indices[0]):
-            if idx < len(chunks):
+            # 近似索引在候選不足時會返回 -1
+            if 0 <= idx < len(chunks):
                 results.append({
                     "content": chunks[idx]["content"],
                     "chunk_index": chunks[idx]["chunk_index"],
+                    "token_count": chunks[idx]["token_count"],
+                    "page": chunks[idx].get("page_start"),
+                    "section": chunks[idx].get("section"),
                     "score": float(score)
                 })
         
@@ -136,7 +361,11 @@ class RAGService:
     
     def get_full_text(self, doc_id: str) -> str:
         """
-        獲取文件的完整文字
+        獲取文件的完整文字（索引時保存的原文）
+        依序嘗試：全文快取 → 本地磁碟 → 由區塊還原
+        
+        區塊帶有位元組位置時還原結果與原文相同，寫回磁碟並快取；
+        否則（舊資料）只返回近似的還原結果，不當作原文保存
         
         Args:
             doc_id: 文件 ID
@@ -144,23 +373,64 @@ class RAGService:
         Returns:
             完整文字
         """
-        if doc_id not in self.chunks_store:
-            raise ValueError(f"Document {doc_id} not indexed")
+        content_id = self.registry.resolve(doc_id) or doc_id
+        text = self.text_cache.get(content_id)
+        if text is not None:
+            return text
         
-        chunks = self.chunks_store[doc_id]
-        # 合併所有區塊（考慮重疊，只取每個區塊的前半部分，最後一個區塊除外）
-        full_text = ""
-        for i, chunk in enumerate(chunks):
-            if i == len(chunks) - 1:
-                full_text += chunk["content"]
-            else:
-                # 只取非重疊部分
-                content = chunk["content"]
-                # 大約取 80% 避免重複
-                cut_point = int(len(content) * 0.8)
-                full_text += content[:cut_point]
+        text = self.index_store.load_text(content_id)
+        if text is None:
+            loaded = self._get_document(doc_id)
+            if loaded is None:
+                raise ValueError(f"Document {doc_id} not indexed")
+            # _get_document 可能經 Supabase 解析到另一個內容來源
+            content_id = self.registry.resolve(doc_id) or doc_id
+            text = self.index_store.load_text(content_id)
+            if text is None:
+                text = reconstruct_from_offsets(loaded[1])
+                if text is None:
+                    return reconstruct_text(loaded[1])
+                try:
+                    self.index_store.save_text(content_id, text)
+                except Exception as e:
+                    print(f"Failed to persist text for {content_id}: {e}")
         
-        return full_text
+        self.text_cache.put(content_id, text)
+        return text
+    
+    def get_text_range(self, doc_id: str, start: int = 0, length: int = 4096) -> Dict[str, Any]:
+        """
+        讀取全文的位元組範圍（從磁碟 seek 讀取，不載入整份文字）
+        
+        Args:
+            doc_id: 文件 ID
+            start: 起始位元組
+            length: 讀取的位元組數（兩端對齊到 UTF-8 字元邊界）
+        
+        Returns:
+            {"text", "start", "end", "total_bytes"}
+        """
+        content_id = self.registry.resolve(doc_id) or doc_id
+        if not self.index_store.has_text(content_id):
+            # 舊文件沒有保存全文，先還原（可精確還原時會寫回磁碟）
+            text = self.get_full_text(doc_id)
+            content_id = self.registry.resolve(doc_id) or doc_id
+            if not self.index_store.has_text(content_id):
+                data = text.encode('utf-8')
+                start = max(0, start)
+                text, start, end = align_text_range(data[start:start + max(0, length) + 3], start, length)
+                return {"text": text, "start": start, "end": end, "total_bytes": len(data)}
+        
+        ranged = self.index_store.read_text_range(content_id, start, length)
+        if ranged is None:
+            raise ValueError(f"Text for document {doc_id} not available")
+        text, start, end = ranged
+        return {
+            "text": text,
+            "start": start,
+            "end": end,
+            "total_bytes": self.index_store.text_size(content_id)
+        }
     
     def get_context_for_query(self, doc_id: str, query: str, max_tokens: int = 4000) -> str:
         """
@@ -174,38 +444,361 @@ class RAGService:
         Returns:
             相關上下文
         """
-        results = self.search(doc_id, query, top_k=10)
+        return self.retrieve(doc_id, query, max_tokens=max_tokens)["context"]
+    
+    def retrieve(self, doc_id: str, query: str, top_k: int = None, max_tokens: int = None,
+                 num_sources: int = 3) -> Dict[str, Any]:
+        """
+        一次查詢編碼與搜索，同時取得問答上下文與來源
+        
+        Args:
+            doc_id: 文件 ID
+            query: 問題
+            top_k: 候選區塊數量（預設 RETRIEVAL_TOP_K）
+            max_tokens: 上下文最大 token 數量（預設 RETRIEVAL_MAX_TOKENS）
+            num_sources: 返回的來源數量
         
+        Returns:
+            {"context": 上下文, "sources": 前 num_sources 個區塊, "results": 所有候選區塊}
+        """
+        top_k = top_k or RETRIEVAL_TOP_K
+        max_tokens = max_tokens or RETRIEVAL_MAX_TOKENS
+        results = self._search_document(doc_id, self.embed_query(query), max(top_k, num_sources))
+        return self._build_retrieval(results, max_tokens, num_sources)
+    
+    @staticmethod
+    def _build_retrieval(results: List[Dict[str, Any]], max_tokens: int, num_sources: int) -> Dict[str, Any]:
+        """依區塊切分時記錄的 token_count 組合上下文（不重新 tokenize）"""
         context_parts = []
         total_tokens = 0
         
         for result in results:
-            chunk_tokens = self.document_processor.count_tokens(result["content"])
-            if total_tokens + chunk_tokens > max_tokens:
+            if total_tokens + result["token_count"] > max_tokens:
                 break
             context_parts.append(result["content"])
-            total_tokens += chunk_tokens
+            total_tokens += result["token_count"]
         
-        return "\n\n---\n\n".join(context_parts)
+        return {
+            "context": "\n\n---\n\n".join(context_parts),
+            "context_tokens": total_tokens,
+            "sources": results[:num_sources],
+            "results": results
+        }
+    
+    def search_corpus(self, query: str, top_k: int = 5, owner: Optional[str] = None,
+                      doc_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        在使用者的所有文件（或指定的文件集合）中搜索
+        
+        Args:
+            query: 搜索查詢
+            top_k: 返回結果數量
+            owner: 使用者 ID（必填，每個使用者的語料互相隔離）
+            doc_ids: 限定搜索的文件 ID 列表（例如同一課程資料夾）
+        
+        Returns:
+            相關區塊列表（包含 document_id）
+        """
+        hits = self.corpus.get(owner).search(self.embed_query(query), top_k, doc_ids)
+        
+        # 語料只保存 ID，區塊內容由文件索引取得（通常已在 IndexCache 中，每個文件只查一次）
+        documents = {}
+        results = []
+        for hit in hits:
+            doc_id = hit["document_id"]
+            if doc_id not in documents:
+                documents[doc_id] = self._get_document(doc_id)
+            loaded = documents[doc_id]
+            if loaded is None or hit["position"] >= len(loaded[1]):
+                continue
+            chunk = loaded[1][hit["position"]]
+            results.append({
+                "document_id": hit["document_id"],
+                "document_ids": hit["document_ids"],
+                "content": chunk["content"],
+                "chunk_index": chunk["chunk_index"],
+                "token_count": chunk["token_count"],
+                "page": chunk.get("page_start"),
+                "section": chunk.get("section"),
+                "score": hit["score"]
+            })
+        
+        return results
+    
+    def get_corpus_context(self, query: str, owner: Optional[str] = None,
+                           doc_ids: Optional[List[str]] = None, max_tokens: int = 4000) -> str:
+        """
+        獲取跨文件問答的上下文
+        
+        Args:
+            query: 問題
+            owner: 使用者 ID
+            doc_ids: 限定的文件 ID 列表
+            max_tokens: 最大 token 數量
+        
+        Returns:
+            相關上下文
+        """
+        return self.retrieve_corpus(query, owner=owner, doc_ids=doc_ids, max_tokens=max_tokens)["context"]
+    
+    def retrieve_corpus(self, query: str, owner: Optional[str] = None, doc_ids: Optional[List[str]] = None,
+                        top_k: int = None, max_tokens: int = None, num_sources: int = 3) -> Dict[str, Any]:
+        """
+        跨文件版本的 retrieve：一次編碼與搜索取得上下文與來源
+        
+        Returns:
+            {"context", "sources", "results"}
+        """
+        top_k = top_k or RETRIEVAL_TOP_K
+        max_tokens = max_tokens or RETRIEVAL_MAX_TOKENS
+        results = self.search_corpus(query, top_k=max(top_k, num_sources), owner=owner, doc_ids=doc_ids)
+        return self._build_retrieval(results, max_tokens, num_sources)
+    
+    # ============ 文件去重 ============
+    
+    def find_duplicate(self, file_hash: Optional[str] = None, text_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        查找內容相同且已索引的文件
+        
+        Args:
+            file_hash: 檔案位元組的 SHA-256
+            text_hash: 正規化文字的 SHA-256
+        
+        Returns:
+            {"content_document_id", "total_characters", "total_tokens", "total_chunks"}，找不到時返回 None
+        """
+        duplicate = self.registry.find(file_hash=file_hash, text_hash=text_hash)
+        
+        if duplicate is None and USE_SUPABASE:
+            try:
+                from config import get_supabase
+                column, value = ('file_hash', file_hash) if file_hash else ('text_hash', text_hash)
+                result = get_supabase().find_document_by_hash(column, value)
+                if result.data:
+                    row = result.data[0]
+                    duplicate = {
+                        'content_document_id': row.get('content_document_id') or row['id'],
+                        'total_characters': row.get('total_characters'),
+                        'total_tokens': row.get('total_tokens'),
+                        'total_chunks': row.get('total_chunks')
+                    }
+            except Exception as e:
+                print(f"Failed to look up duplicate document in Supabase: {e}")
+        
+        # 來源索引必須仍可載入
+        if duplicate is None or self._get_document(duplicate['content_document_id']) is None:
+            return None
+        return duplicate
+    
+    def register_document(self, doc_id: str, file_hash: Optional[str], text_hash: Optional[str],
+                          stats: Dict[str, Any]):
+        """登記新索引文件的雜湊，供之後的重複上傳使用"""
+        self.registry.register(doc_id, file_hash, text_hash, stats)
+    
+    def link_duplicate(self, doc_id: str, duplicate: Dict[str, Any], owner: Optional[str] = None,
+                       file_hash: Optional[str] = None, text_hash: Optional[str] = None) -> Dict[str, Any]:
+        """
+        將新文件指向既有內容，不解析、不嵌入、不產生新的嵌入資料列
+        
+        Args:
+            doc_id: 新文件 ID
+            duplicate: find_duplicate 的返回值
+            owner: 使用者 ID（加入其語料索引）
+        
+        Returns:
+            與 index_chunks 相同格式的索引結果
+        """
+        content_id = duplicate['content_document_id']
+        loaded = self._get_document(content_id)
+        if loaded is None:
+            raise ValueError(f"Document {content_id} not indexed")
+        index, chunks = loaded
+        
+        self.registry.register(doc_id, file_hash, text_hash, duplicate, source_doc_id=content_id)
+        
+        # 語料中已有這份內容時只登記文件 ID，不重複加入向量
+        if owner:
+            embeddings = None
+            if not self.corpus.has_content(owner, content_id):
+                embeddings = self._get_document_embeddings(content_id, index, chunks)
+            self.corpus.add_document(doc_id, embeddings, owner, content_id=content_id)
+        
+        return {
+            "doc_id": doc_id,
+            "content_document_id": content_id,
+            "chunks_indexed": len(chunks),
+            "total_tokens": sum(chunk["token_count"] for chunk in chunks),
+            "index_type": get_index_type(index),
+            "embedding_cache": {'hits': len(chunks), 'misses': 0, 'hit_rate': 1.0},
+            "embeddings_for_db": []
+        }
+    
+    def _get_document_embeddings(self, doc_id: str, index: faiss.Index, chunks: List[Dict[str, Any]]) -> np.ndarray:
+        """取回文件的全精度向量；依序嘗試磁碟向量檔 → 非量化索引重建 → 嵌入快取"""
+        vectors = self.index_store.load_vectors(doc_id)
+        if vectors is not None and len(vectors) == len(chunks):
+            return np.array(vectors, dtype=np.float32)
+        if not is_quantized(index) and not isinstance(index, faiss.IndexIVF):
+            try:
+                return index.reconstruct_n(0, index.ntotal)
+            except Exception:
+                pass
+        embeddings, _ = self.create_document_embeddings([chunk["content"] for chunk in chunks])
+        return embeddings
+    
+    def _get_document(self, doc_id: str):
+        """
+        獲取文件的 (index, chunks)
+        重複文件會解析為其內容來源；
+        依序嘗試：內存快取 → 本地磁碟 → Supabase document_embeddings（使用已存的嵌入，不重新編碼）
+        
+        Returns:
+            (index, chunks)，文件不存在時返回 None
+        """
+        content_id = self.registry.resolve(doc_id) or doc_id
+        
+        cached = self.index_cache.get(content_id)
+        if cached is not None:
+            return cached
+        
+        with self._load_lock:
+            if content_id in self.index_cache:
+                return self.index_cache.get(content_id)
+            
+            loaded = self.index_store.load(content_id)
+            if loaded is None:
+                source_id = self._resolve_from_supabase(content_id)
+                if source_id != content_id:
+                    loaded = self.index_store.load(source_id)
+                    content_id = source_id
+                if loaded is None:
+                    loaded = self._rebuild_from_supabase(content_id)
+            if loaded is None:
+                return None
+            
+            index, chunks = loaded
+            configure_search(index)
+            vectors = self.index_store.load_vectors(content_id) if is_quantized(index) else None
+            self.index_cache.put(content_id, index, chunks, vectors)
+            return index, chunks
+    
+    def _resolve_from_supabase(self, doc_id: str) -> str:
+        """未在本地登記的文件，從 documents.content_document_id 查詢其內容來源"""
+        if not USE_SUPABASE:
+            return doc_id
+        
+        try:
+            from config import get_supabase
+            result = get_supabase().get_document(doc_id)
+            source_id = (result.data or {}).get('content_document_id')
+        except Exception:
+            return doc_id
+        
+        if source_id and source_id != doc_id:
+            self.registry.register(doc_id, None, None, result.data, source_doc_id=source_id)
+            return source_id
+        return doc_id
+    
+    def _rebuild_from_supabase(self, doc_id: str):
+        """從 Supabase 已保存的嵌入重建索引，並寫回磁碟"""
+        if not USE_SUPABASE:
+            return None
+        
+        try:
+            from config import get_supabase
+            result = get_supabase().get_document_chunks(doc_id, include_embeddings=True)
+            rows = result.data or []
+        except Exception as e:
+            print(f"Failed to load chunks for {doc_id} from Supabase: {e}")
+            return None
+        
+        rows = [row for row in rows if row.get('embedding') is not None]
+        if not rows:
+            return None
+        
+        embeddings = np.array([
+            # pgvector 經 PostgREST 返回 "[0.1,0.2,...]" 字串
+            json.loads(row['embedding']) if isinstance(row['embedding'], str) else row['embedding']
+            for row in rows
+        ], dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        
+        index = build_index(embeddings)
+        
+        chunks = []
+        for row in rows:
+            chunk = {
+                "content": row['content'],
+                "chunk_index": row['chunk_index'],
+                "token_count": self.document_processor.count_tokens(row['content'])
+            }
+            if row.get('start_byte') is not None:
+                chunk["start_byte"], chunk["end_byte"] = row['start_byte'], row['end_byte']
+            chunks.append(chunk)
+        
+        try:
+            self.index_store.save(doc_id, index, chunks, embeddings if is_quantized(index) else None)
+        except Exception as e:
+            print(f"Failed to persist rebuilt index for {doc_id}: {e}")
+        
+        print(f"已從 Supabase 重建索引: {doc_id} ({len(chunks)} 區塊)")
+        return index, chunks
     
     def is_document_indexed(self, doc_id: str) -> bool:
-        """檢查文件是否已索引"""
-        return doc_id in self.indices
-    
-    def remove_document(self, doc_id: str):
-        """移除文件索引"""
-        if doc_id in self.indices:
-            del self.indices[doc_id]
-        if doc_id in self.chunks_store:
-            del self.chunks_store[doc_id]
+        """檢查文件是否已索引（必要時從磁碟或 Supabase 載入）"""
+        return self._get_document(doc_id) is not None
+    
+    def remove_document(self, doc_id: str, owner: Optional[str] = None):
+        """
+        移除文件索引（仍被重複文件引用時，索引轉移給其中一個重複文件）
+        
+        Args:
+            doc_id: 文件 ID
+            owner: 文件所屬使用者（從其語料中移除）
+        """
+        new_owner = self.registry.remove(doc_id)
+        if new_owner and USE_SUPABASE:
+            # Supabase 中的嵌入與其他重複文件的參照一併轉移，與本地索引檔案保持一致
+            try:
+                from config import get_supabase
+                get_supabase().transfer_document_content(doc_id, new_owner)
+            except Exception as e:
+                print(f"Failed to transfer Supabase content from {doc_id} to {new_owner}: {e}")
+        with self._load_lock:
+            self.index_cache.pop(doc_id)
+            self.text_cache.pop(doc_id)
+            if new_owner:
+                self.index_store.rename(doc_id, new_owner)
+            else:
+                self.index_store.delete(doc_id)
+        self.corpus.remove_document(doc_id, owner)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """索引快取統計（命中、未命中、淘汰次數）"""
+        return {
+            'index_cache': self.index_cache.get_stats(),
+            'text_cache': self.text_cache.get_stats(),
+            'embedding_cache': self.embedding_cache.get_stats() if self.embedding_cache else None,
+            'query_cache': self.query_cache.get_stats(),
+            'embedding_batcher': self.batcher.get_stats() if self.batcher else None,
+            'corpus': self.corpus.get_stats()
+        }
 
 
 # 單例實例
 _rag_service: Optional[RAGService] = None
+_rag_service_lock = threading.Lock()
 
 def get_rag_service() -> RAGService:
-    """獲取 RAG 服務實例"""
+    """獲取 RAG 服務實例（背景攝取執行緒也會呼叫，需避免重複載入模型）"""
     global _rag_service
     if _rag_service is None:
-        _rag_service = RAGService()
+        with _rag_service_lock:
+            if _rag_service is None:
+                _rag_service = RAGService()
     return _rag_service
+
+
+def is_rag_service_loaded() -> bool:
+    """RAG 服務（嵌入模型）是否已載入"""
+    return _rag_service is not None
@@ -0,0 +1,335 @@
+"""
+結構感知的語義切片
+依段落、標題、句子邊界（含中文標點）與 DOCX 表格結構切分區塊，
+而不是每 1000 個 token 直接截斷；每個區塊記錄頁碼與所屬章節
+
+    CHUNKING_STRATEGY=semantic
+"""
+
+import os
+import re
+import bisect
+from typing import List, Dict, Any, Optional, Callable, Iterator
+
+# 每個區塊的 token 上限；不足下限的段落會與後續段落合併
+SEMANTIC_CHUNK_MAX_TOKENS = int(os.getenv("SEMANTIC_CHUNK_MAX_TOKENS", "512"))
+SEMANTIC_CHUNK_MIN_TOKENS = int(os.getenv("SEMANTIC_CHUNK_MIN_TOKENS", "64"))
+
+# 標題長度上限（字元）
+_HEADING_MAX_CHARS = 60
+
+_PARAGRAPH_RE = re.compile(r'\n[ \t　]*\n+')
+
+# 常見的標題格式：Markdown、第X章/節、1. / 1、 / 1) / 1.2 / (一) / 一、、Chapter/Section
+# 數字開頭必須接編號符號或多層編號，「3 apples ...」這類以數量開頭的句子不算標題
+_HEADING_RE = re.compile(
+    r'^(#{1,6}\s+\S'
+    r'|第[0-9一二三四五六七八九十百零〇]+[章節篇部單元課講]'
+    r'|[0-9]{1,3}(\.[0-9]{1,3})*[.、)](?![0-9])\s*\S'
+    r'|[0-9]{1,3}(\.[0-9]{1,3})+\s+\D'
+    r'|[（(][一二三四五六七八九十0-9]+[)）]'
+    r'|[一二三四五六七八九十]+、'
+    r'|(chapter|section|part|unit|lecture)\s+[0-9ivx]+)',
+    re.IGNORECASE
+)
+
+# 句子結尾：中文句號/問號/驚嘆號/分號（可接右引號或右括號），或英文標點後接空白
+_SENTENCE_RE = re.compile(r"[^。！？；!?;\n]*?(?:[。！？；]+[」』”’）)]*|[.!?;]+[\"')\]]*(?=\s|$)|\n|$)\s*")
+
+# 句末標點（判斷短行是否為標題）
+_TERMINAL_PUNCTUATION = '。！？；：，、.!?;:,'
+
+
+def split_sentences(text: str) -> List[str]:
+    """依中英文句末標點切分句子（保留標點與後續空白）"""
+    return [sentence for sentence in _SENTENCE_RE.findall(text) if sentence]
+
+
+def is_heading(line: str) -> bool:
+    """判斷單行文字是否為標題"""
+    line = line.strip()
+    if not line or len(line) > _HEADING_MAX_CHARS or '\n' in line:
+        return False
+    if line.startswith('#'):
+        return True
+    if line[-1] in _TERMINAL_PUNCTUATION:
+        return False
+    return bool(_HEADING_RE.match(line))
+
+
+def _heading_level(line: str) -> int:
+    """標題層級：Markdown 依 # 數量、編號依點的數量，其他視為第 1 層"""
+    line = line.strip()
+    markdown = re.match(r'^(#{1,6})\s', line)
+    if markdown:
+        return len(markdown.group(1))
+    numbered = re.match(r'^([0-9]+(?:\.[0-9]+)*)', line)
+    if numbered:
+        return numbered.group(1).count('.') + 1
+    if re.match(r'^[（(]', line):
+        return 3
+    if re.match(r'^[一二三四五六七八九十]+、', line):
+        return 2
+    return 1
+
+
+def blocks_from_text(text: str, page_offsets: Optional[List[int]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    將純文字切成結構區塊
+
+    Args:
+        text: 完整文字
+        page_offsets: join_pages 返回的每頁起始字元位置（PDF）
+
+    Yields:
+        {"type": "heading" | "paragraph", "text", "page"}
+    """
+    position = 0
+    for match in list(_PARAGRAPH_RE.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        paragraph = text[position:end]
+        page = bisect.bisect_right(page_offsets, position) if page_offsets else 1
+        position = match.end() if match else len(text)
+
+        if not paragraph.strip():
+            continue
+
+        # 段落開頭的單行標題（PDF 常將標題與內文放在同一段）
+        first_line, _, rest = paragraph.strip().partition('\n')
+        if is_heading(first_line):
+            yield {"type": "heading", "text": first_line.strip(), "page": page}
+            if rest.strip():
+                yield {"type": "paragraph", "text": rest.strip(), "page": page}
+        else:
+            yield {"type": "paragraph", "text": paragraph.strip(), "page": page}
+
+
+def blocks_from_docx(file_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    依文件順序讀取 DOCX 的段落與表格
+
+    標題使用段落樣式（Heading / Title / 標題）判斷；
+    表格以列為單位輸出，儲存格以 " | " 分隔，第一列視為表頭
+
+    Yields:
+        {"type": "heading" | "paragraph" | "table", "text" 或 "rows", "page", "level"}
+    """
+    from docx import Document
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    doc = Document(file_path)
+    for element in doc.element.body.iterchildren():
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            paragraph = Paragraph(element, doc)
+            text = paragraph.text.strip()
+            if not text:
+                continue
+            style = (paragraph.style.name if paragraph.style is not None else '') or ''
+            if style.startswith(('Heading', 'Title', '標題')):
+                level = int(style.split()[-1]) if style.split()[-1].isdigit() else 1
+                yield {"type": "heading", "text": text, "page": 1, "level": level}
+            else:
+                yield {"type": "paragraph", "text": text, "page": 1}
+        elif tag == 'tbl':
+            rows = []
+            for row in Table(element, doc).rows:
+                cells = [cell.text.strip() for cell in row.cells]
+                # 合併儲存格在 python-docx 中會重複出現，相鄰重複只保留一次
+                cells = [cell for i, cell in enumerate(cells) if i == 0 or cell != cells[i - 1]]
+                if any(cells):
+                    rows.append(" | ".join(cells))
+            if rows:
+                yield {"type": "table", "rows": rows, "page": 1}
+
+
+class SemanticChunker:
+    """
+    將結構區塊組合成區塊
+
+    - 標題開啟新的章節，並作為後續區塊的 section（例如「第二章 > 2.1 線性迴歸」）
+    - 段落完整保留；同一章節內較短的段落合併到 max_tokens 為止
+    - 不足 min_tokens 的區塊從下一段落開頭補入句子，最後再與同章節相鄰的區塊合併
+    - 超過上限的段落依句子切分，單句仍超過上限時才依 token 截斷
+    - 表格不與段落合併；超過上限時依列分組，每組重複表頭，單列過長時依 token 切分
+
+    Args:
+        count_tokens: 計算 token 數的函數
+        encode / decode: 單句過長時依 token 截斷使用
+        max_tokens: 區塊 token 上限（預設讀取 SEMANTIC_CHUNK_MAX_TOKENS）
+        min_tokens: 區塊 token 下限（預設讀取 SEMANTIC_CHUNK_MIN_TOKENS）
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], encode: Callable[[str], List[int]],
+                 decode: Callable[[List[int]], str], max_tokens: int = None, min_tokens: int = None):
+        self.count_tokens = count_tokens
+        self.encode = encode
+        self.decode = decode
+        self.max_tokens = max_tokens or SEMANTIC_CHUNK_MAX_TOKENS
+        self.min_tokens = min_tokens if min_tokens is not None else SEMANTIC_CHUNK_MIN_TOKENS
+
+    def chunk(self, blocks: Iterator[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            區塊列表：content、chunk_index、token_count、page_start、page_end、section
+        """
+        # (區塊, 可否與相鄰區塊合併)；表格區塊不合併
+        pending: List[tuple] = []
+        headings: List[tuple] = []  # (層級, 標題)
+        parts: List[str] = []
+        part_tokens = 0
+        pages: List[int] = []
+
+        def section() -> Optional[str]:
+            return " > ".join(title for _, title in headings) or None
+
+        def emit(texts: List[str], tokens: int, page_start: int, page_end: int, separator: str = "\n\n",
+                 mergeable: bool = True):
+            pending.append(({
+                "content": separator.join(texts),
+                "token_count": tokens,
+                "page_start": page_start,
+                "page_end": page_end,
+                "section": section()
+            }, mergeable))
+
+        def flush():
+            nonlocal parts, part_tokens, pages
+            if parts:
+                emit(parts, part_tokens, pages[0], pages[-1])
+            parts, part_tokens, pages = [], 0, []
+
+        for block in blocks:
+            if block["type"] == "heading":
+                flush()
+                level = block.get("level") or _heading_level(block["text"])
+                headings = [(lvl, title) for lvl, title in headings if lvl < level] + [(level, block["text"])]
+                continue
+
+            if block["type"] == "table":
+                flush()
+                for rows, tokens in self._table_groups(block["rows"]):
+                    emit(rows, tokens, block["page"], block["page"], separator="\n", mergeable=False)
+                continue
+
+            text = block["text"]
+            tokens = self.count_tokens(text)
+
+            # 加入後超過上限：目前內容不足下限時，先從段落開頭補入句子（段落剩餘部分仍保留下限），
+            # 再輸出目前的區塊
+            if parts and part_tokens + tokens > self.max_tokens:
+                if part_tokens < self.min_tokens:
+                    budget = min(self.max_tokens - part_tokens, tokens - self.min_tokens)
+                    head, head_tokens, text = self._take_sentences(text, budget)
+                    if head:
+                        parts.append(head)
+                        part_tokens += head_tokens
+                        pages.append(block["page"])
+                    tokens = self.count_tokens(text) if text else 0
+                flush()
+                if not text:
+                    continue
+
+            if tokens > self.max_tokens:
+                for piece, piece_tokens in self._split_long(text):
+                    emit([piece], piece_tokens, block["page"], block["page"], separator="")
+                continue
+
+            parts.append(text)
+            part_tokens += tokens
+            pages.append(block["page"])
+            if part_tokens >= self.max_tokens - self.min_tokens:
+                flush()
+
+        flush()
+
+        chunks = self._merge_small(pending)
+        for i, chunk in enumerate(chunks):
+            chunk["chunk_index"] = i
+        return chunks
+
+    def _merge_small(self, pending: List[tuple]) -> List[Dict[str, Any]]:
+        """不足下限的區塊併入同章節的前一個區塊（合併後不超過上限時）"""
+        merged: List[tuple] = []
+        for chunk, mergeable in pending:
+            if merged:
+                previous, previous_mergeable = merged[-1]
+                if (mergeable and previous_mergeable
+                        and previous["section"] == chunk["section"]
+                        and min(previous["token_count"], chunk["token_count"]) < self.min_tokens
+                        and previous["token_count"] + chunk["token_count"] <= self.max_tokens):
+                    previous["content"] = f"{previous['content']}\n\n{chunk['content']}"
+                    previous["token_count"] += chunk["token_count"]
+                    previous["page_end"] = chunk["page_end"]
+                    continue
+            merged.append((chunk, mergeable))
+        return [chunk for chunk, _ in merged]
+
+    def _take_sentences(self, text: str, budget: int) -> tuple:
+        """
+        從段落開頭取出不超過 budget 個 token 的完整句子
+
+        Returns:
+            (取出的文字, token 數, 剩餘文字)
+        """
+        head, head_tokens = "", 0
+        sentences = split_sentences(text)
+        for i, sentence in enumerate(sentences):
+            tokens = self.count_tokens(sentence)
+            if head_tokens + tokens > budget:
+                return head.strip(), head_tokens, "".join(sentences[i:]).strip()
+            head += sentence
+            head_tokens += tokens
+        return head.strip(), head_tokens, ""
+
+    def _split_tokens(self, text: str, limit: int) -> Iterator[tuple]:
+        """依 token 截斷成不超過 limit 的片段"""
+        ids = self.encode(text)
+        for start in range(0, len(ids), limit):
+            piece = ids[start:start + limit]
+            yield self.decode(piece), len(piece)
+
+    def _split_long(self, text: str) -> Iterator[tuple]:
+        """將過長的段落依句子組合成不超過上限的片段"""
+        current, current_tokens = "", 0
+        for sentence in split_sentences(text):
+            tokens = self.count_tokens(sentence)
+            if tokens > self.max_tokens:
+                if current:
+                    yield current.strip(), current_tokens
+                    current, current_tokens = "", 0
+                yield from self._split_tokens(sentence, self.max_tokens)
+                continue
+            if current and current_tokens + tokens > self.max_tokens:
+                yield current.strip(), current_tokens
+                current, current_tokens = "", 0
+            current += sentence
+            current_tokens += tokens
+        if current.strip():
+            yield current.strip(), current_tokens
+
+    def _table_groups(self, rows: List[str]) -> Iterator[tuple]:
+        """
+        表格依列分組，每組不超過上限，續接的組重複表頭
+
+        單列超過上限時依 token 切分成多段，每段與表頭一起仍不超過上限；
+        表頭本身超過上限的一半時不重複
+        """
+        header_tokens = self.count_tokens(rows[0])
+        repeat = [rows[0]] if header_tokens <= self.max_tokens // 2 else []
+        repeat_tokens = header_tokens if repeat else 0
+
+        group, group_tokens = [], 0
+        for row in rows:
+            tokens = self.count_tokens(row)
+            limit = self.max_tokens - repeat_tokens
+            pieces = [(row, tokens)] if tokens <= limit else self._split_tokens(row, limit)
+            for piece, piece_tokens in pieces:
+                if group and group_tokens + piece_tokens > self.max_tokens:
+                    yield group, group_tokens
+                    group, group_tokens = list(repeat), repeat_tokens
+                group.append(piece)
+                group_tokens += piece_tokens
+        if group:
+            yield group, group_tokens
@@ -0,0 +1,333 @@
+"""
+向量索引工廠
+根據區塊數量或配置選擇索引類型（Flat / HNSW / IVF-Flat / IVF-PQ 及其純量量化版本），
+並提供與精確 Flat 基準比較的召回率/延遲報告
+"""
+
+import os
+import math
+import time
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+import faiss
+
+INDEX_TYPES = ('flat', 'sq8', 'sq_fp16', 'hnsw', 'hnsw_sq8', 'hnsw_fp16', 'ivf_flat', 'ivf_pq')
+
+# 有損壓縮的索引類型：搜索後需以全精度向量重新排序
+QUANTIZED_TYPES = ('sq8', 'sq_fp16', 'hnsw_sq8', 'hnsw_fp16', 'ivf_pq')
+
+# auto 模式下 flat / hnsw 的純量量化：sq8（每維 1 byte）、fp16（2 bytes）、none（float32）
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "sq8").lower()
+
+# 重新排序的候選倍數：先取 top_k × RERANK_FACTOR 個候選，再以全精度向量排序
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+
+_QUANTIZED_VARIANTS = {
+    'sq8': {'flat': 'sq8', 'hnsw': 'hnsw_sq8'},
+    'fp16': {'flat': 'sq_fp16', 'hnsw': 'hnsw_fp16'},
+    'none': {}
+}
+
+# auto 模式下的區塊數門檻
+FLAT_MAX_VECTORS = int(os.getenv("VECTOR_INDEX_FLAT_MAX", "5000"))
+HNSW_MAX_VECTORS = int(os.getenv("VECTOR_INDEX_HNSW_MAX", "200000"))
+# 超過此區塊數才套用 VECTOR_QUANTIZATION；小文件維持精確的 Flat 索引，
+# 省下的記憶體有限，卻要付出量化誤差與重新排序的磁碟讀取
+QUANTIZE_MIN_VECTORS = int(os.getenv("VECTOR_QUANTIZE_MIN", str(FLAT_MAX_VECTORS)))
+
+# 索引建構與搜索參數
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+PQ_NBITS = 8
+
+# 每個聚類/碼本至少需要的訓練樣本數
+MIN_POINTS_PER_CENTROID = 39
+
+
+def choose_index_type(num_vectors: int, index_type: Optional[str] = None) -> str:
+    """
+    決定索引類型
+
+    Args:
+        num_vectors: 向量數量
+        index_type: 指定類型；None 時讀取 VECTOR_INDEX_TYPE（預設 auto，超過 QUANTIZE_MIN_VECTORS 時套用 VECTOR_QUANTIZATION）
+
+    Returns:
+        INDEX_TYPES 之一
+    """
+    index_type = (index_type or os.getenv("VECTOR_INDEX_TYPE", "auto")).lower()
+
+    if index_type == 'auto':
+        if num_vectors <= FLAT_MAX_VECTORS:
+            index_type = 'flat'
+        elif num_vectors <= HNSW_MAX_VECTORS:
+            index_type = 'hnsw'
+        else:
+            index_type = 'ivf_pq'
+        if num_vectors > QUANTIZE_MIN_VECTORS:
+            index_type = _QUANTIZED_VARIANTS.get(VECTOR_QUANTIZATION, {}).get(index_type, index_type)
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported vector index type: {index_type}")
+
+    # 訓練樣本不足時退回較簡單的索引
+    if index_type == 'ivf_pq' and num_vectors < (1 << PQ_NBITS) * MIN_POINTS_PER_CENTROID:
+        index_type = 'ivf_flat'
+    if index_type == 'ivf_flat' and num_vectors < MIN_POINTS_PER_CENTROID * 2:
+        index_type = 'flat'
+
+    return index_type
+
+
+def _nlist_for(num_vectors: int) -> int:
+    """IVF 聚類數：約 4·√N，並確保每個聚類有足夠訓練樣本"""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """PQ 子向量數：取能整除維度、且每段約 8 維的值"""
+    for m in (dim // 8, dim // 4, dim // 2, dim):
+        if m > 0 and dim % m == 0:
+            return m
+    return dim
+
+
+_SQ_TYPES = {
+    'sq8': faiss.ScalarQuantizer.QT_8bit,
+    'hnsw_sq8': faiss.ScalarQuantizer.QT_8bit,
+    'sq_fp16': faiss.ScalarQuantizer.QT_fp16,
+    'hnsw_fp16': faiss.ScalarQuantizer.QT_fp16
+}
+
+
+def _train_scalar_quantizer(index: faiss.Index, index_type: str, training_vectors: Optional[np.ndarray]):
+    """SQ8 需以樣本學習每維的數值範圍；fp16 不需要訓練"""
+    if index.is_trained:
+        return
+    if training_vectors is None or len(training_vectors) == 0:
+        raise ValueError(f"{index_type} index requires training vectors")
+    index.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+
+
+def create_index(index_type: str, dim: int, training_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    建立（並在需要時訓練）一個空索引，使用內積（向量已正規化，即餘弦相似度）
+
+    Args:
+        index_type: INDEX_TYPES 之一
+        dim: 向量維度
+        training_vectors: IVF 類索引的訓練樣本
+
+    Returns:
+        可直接 add 的索引
+    """
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dim)
+
+    if index_type in ('sq8', 'sq_fp16'):
+        index = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[index_type], faiss.METRIC_INNER_PRODUCT)
+        _train_scalar_quantizer(index, index_type, training_vectors)
+        return index
+
+    if index_type in ('hnsw', 'hnsw_sq8', 'hnsw_fp16'):
+        if index_type == 'hnsw':
+            index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWSQ(dim, _SQ_TYPES[index_type], HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            _train_scalar_quantizer(index, index_type, training_vectors)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        if training_vectors is None or len(training_vectors) == 0:
+            raise ValueError(f"{index_type} index requires training vectors")
+
+        nlist = _nlist_for(len(training_vectors))
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer, dim, nlist, _pq_subquantizers(dim), PQ_NBITS, faiss.METRIC_INNER_PRODUCT
+            )
+
+        # 訓練樣本上限，避免大型索引訓練過久
+        max_samples = nlist * 256
+        if len(training_vectors) > max_samples:
+            rng = np.random.default_rng(0)
+            training_vectors = training_vectors[rng.choice(len(training_vectors), max_samples, replace=False)]
+        index.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+        index.nprobe = IVF_NPROBE
+        return index
+
+    raise ValueError(f"Unsupported vector index type: {index_type}")
+
+
+def build_index(embeddings: np.ndarray, index_type: Optional[str] = None) -> faiss.Index:
+    """
+    為一組向量建立索引
+
+    Args:
+        embeddings: 已正規化的向量
+        index_type: 指定類型；None 時依配置與向量數量自動選擇
+
+    Returns:
+        已加入所有向量的索引
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index_type = choose_index_type(len(embeddings), index_type)
+    index = create_index(index_type, embeddings.shape[1], embeddings)
+    index.add(embeddings)
+    return index
+
+
+def configure_search(index: faiss.Index, ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+    """套用搜索參數（從磁碟載入後也需呼叫）"""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search or HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe or IVF_NPROBE
+
+
+def _sq_suffix(index: faiss.Index) -> str:
+    return 'fp16' if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq8'
+
+
+def get_index_type(index: faiss.Index) -> str:
+    """返回索引的類型名稱"""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        storage = faiss.downcast_index(index.storage)
+        if isinstance(storage, faiss.IndexScalarQuantizer):
+            return f"hnsw_{_sq_suffix(storage)}"
+        return 'hnsw'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return 'sq_fp16' if _sq_suffix(index) == 'fp16' else 'sq8'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf_flat'
+    return 'flat'
+
+
+def is_quantized(index: faiss.Index) -> bool:
+    """索引是否只保存有損壓縮的向量"""
+    return get_index_type(index) in QUANTIZED_TYPES
+
+
+def estimate_index_bytes(index: faiss.Index) -> int:
+    """估算索引佔用的記憶體"""
+    if isinstance(index, faiss.IndexHNSW):
+        # 儲存的向量編碼 + 第 0 層約 2·M 個鄰居（int32）
+        storage = faiss.downcast_index(index.storage)
+        try:
+            code_size = storage.sa_code_size()
+        except Exception:
+            code_size = index.d * 4
+        return index.ntotal * (code_size + index.hnsw.nb_neighbors(0) * 4)
+    try:
+        return index.ntotal * index.sa_code_size()
+    except Exception:
+        return index.ntotal * index.d * 4
+
+
+def rerank(query: np.ndarray, candidates: np.ndarray, vectors: np.ndarray, top_k: int):
+    """
+    以全精度向量重新排序近似搜索的候選
+
+    Args:
+        query: 查詢向量（一維）
+        candidates: 候選位置（可包含 -1）
+        vectors: 全精度向量（可為 np.memmap，只讀取候選的列）
+        top_k: 返回數量
+
+    Returns:
+        (位置陣列, 分數陣列)，依分數由高到低
+    """
+    candidates = candidates[(candidates >= 0) & (candidates < len(vectors))]
+    if len(candidates) == 0:
+        return candidates.astype(np.int64), np.zeros(0, dtype=np.float32)
+    # 依位置排序讀取，mmap 時為循序存取
+    candidates = np.unique(candidates)
+    scores = np.asarray(vectors[candidates], dtype=np.float32) @ np.asarray(query, dtype=np.float32).ravel()
+    order = np.argsort(-scores)[:top_k]
+    return candidates[order], scores[order]
+
+
+def evaluate_index_types(embeddings: np.ndarray, queries: np.ndarray, top_k: int = 10,
+                         configs: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    與精確 Flat 基準比較各種索引的召回率與查詢延遲
+
+    Args:
+        embeddings: 已正規化的資料向量
+        queries: 已正規化的查詢向量
+        top_k: 評估的近鄰數
+        configs: [{"type": "hnsw", "ef_search": 64}, {"type": "sq8", "rerank": True}, ...]
+
+    Returns:
+        每個配置的報告：recall@k、平均/P95 延遲、建構時間、估計記憶體
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    configs = configs or [
+        {'type': 'flat'},
+        {'type': 'sq_fp16'},
+        {'type': 'sq8'},
+        {'type': 'sq8', 'rerank': True},
+        {'type': 'hnsw', 'ef_search': 32},
+        {'type': 'hnsw', 'ef_search': 64},
+        {'type': 'hnsw', 'ef_search': 128},
+        {'type': 'hnsw_sq8', 'ef_search': 64},
+        {'type': 'hnsw_sq8', 'ef_search': 64, 'rerank': True},
+        {'type': 'ivf_flat', 'nprobe': 8},
+        {'type': 'ivf_flat', 'nprobe': 32},
+        {'type': 'ivf_pq', 'nprobe': 8},
+        {'type': 'ivf_pq', 'nprobe': 32},
+        {'type': 'ivf_pq', 'nprobe': 32, 'rerank': True},
+    ]
+
+    baseline = faiss.IndexFlatIP(embeddings.shape[1])
+    baseline.add(embeddings)
+    _, truth = baseline.search(queries, top_k)
+
+    built: Dict[str, Any] = {}
+    report = []
+    for config in configs:
+        index_type = config['type']
+        if index_type not in built:
+            started = time.perf_counter()
+            index = create_index(index_type, embeddings.shape[1], embeddings)
+            index.add(embeddings)
+            built[index_type] = (index, (time.perf_counter() - started) * 1000)
+        index, build_ms = built[index_type]
+        configure_search(index, ef_search=config.get('ef_search'), nprobe=config.get('nprobe'))
+
+        latencies = []
+        hits = 0
+        for i in range(len(queries)):
+            started = time.perf_counter()
+            if config.get('rerank'):
+                _, candidates = index.search(queries[i:i + 1], top_k * RERANK_FACTOR)
+                ids, _ = rerank(queries[i], candidates[0], embeddings, top_k)
+                ids = ids[None, :]
+            else:
+                _, ids = index.search(queries[i:i + 1], top_k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(set(ids[0].tolist()) & set(truth[i].tolist()))
+
+        report.append({
+            **config,
+            f'recall@{top_k}': round(hits / (len(queries) * top_k), 4),
+            'mean_latency_ms': round(float(np.mean(latencies)), 3),
+            'p95_latency_ms': round(float(np.percentile(latencies, 95)), 3),
+            'build_ms': round(build_ms, 1),
+            'index_bytes': estimate_index_bytes(index)
+        })
+
+    return report
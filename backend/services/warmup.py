@@ -0,0 +1,87 @@
+"""
+啟動預熱與就緒狀態
+在應用啟動時載入嵌入模型並執行一次編碼（配置記憶體、初始化推論執行路徑），
+/api/ready 僅在模型常駐後返回成功，負載平衡器不會把流量導向冷啟動的工作行程
+"""
+
+import os
+import time
+import threading
+from typing import Dict, Any
+
+WARMUP_MODES = ('background', 'sync', 'preload', 'off')
+
+# 預熱時編碼的文字：短查詢 + 接近區塊大小的長文字
+_WARMUP_TEXTS = [
+    "暖機查詢",
+    "這是一段用於預熱嵌入模型的文字。This text warms up the embedding model. " * 40
+]
+
+_state: Dict[str, Any] = {
+    'status': 'pending',  # pending → warming_up → ready / failed
+    'mode': None,
+    'error': None,
+    'duration_ms': None
+}
+_state_lock = threading.Lock()
+
+
+def _set_state(**updates):
+    with _state_lock:
+        _state.update(updates)
+
+
+def warm_up():
+    """載入嵌入模型與 tokenizer，並執行一次編碼"""
+    from .rag_service import get_rag_service
+
+    _set_state(status='warming_up', error=None)
+    started = time.perf_counter()
+    try:
+        rag_service = get_rag_service()
+        rag_service.create_embeddings(_WARMUP_TEXTS)
+        rag_service.document_processor.split_text_into_chunks(_WARMUP_TEXTS[1])  # 同時建立 token 位元組長度表
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        _set_state(status='failed', error=str(e))
+        return
+
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    print(f"模型預熱完成: {duration_ms} ms")
+    _set_state(status='ready', duration_ms=duration_ms)
+
+
+def start_warm_up(mode: str = None):
+    """
+    依模式啟動預熱
+
+    Args:
+        mode: background（背景執行緒，預設）、sync（阻塞直到完成）、
+              preload（只載入模型，供 gunicorn 主行程 fork 前使用，編碼預熱留給工作行程）、
+              off（首次使用時才載入）；None 時讀取 EMBEDDING_WARMUP
+    """
+    mode = (mode or os.getenv("EMBEDDING_WARMUP", "background")).lower()
+    if mode not in WARMUP_MODES:
+        raise ValueError(f"Unsupported warm-up mode: {mode}")
+
+    _set_state(mode=mode)
+    if mode == 'sync':
+        warm_up()
+    elif mode == 'preload':
+        from .prefork import preload
+        preload()
+    elif mode == 'background':
+        _set_state(status='warming_up')
+        threading.Thread(target=warm_up, name="embedding-warmup", daemon=True).start()
+
+
+def get_readiness() -> Dict[str, Any]:
+    """返回就緒狀態（未預熱時，以模型是否已被延遲載入判斷）"""
+    from .rag_service import is_rag_service_loaded
+
+    with _state_lock:
+        state = dict(_state)
+    if state['status'] == 'pending' and is_rag_service_loaded():
+        state['status'] = 'ready'
+    state['ready'] = state['status'] == 'ready'
+    return state
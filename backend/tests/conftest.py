@@ -0,0 +1,212 @@
+"""
+測試共用設定
+
+- 以決定性的假嵌入模型取代 SentenceTransformer（不下載模型、不需要 torch）
+- 每個測試使用獨立的索引目錄與快取檔案，並重置服務單例
+- fake_supabase 以記憶體中的資料表模擬 SupabaseClient
+"""
+
+import os
+import sys
+import types
+import random
+import hashlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.supabase_client import SupabaseClient  # noqa: E402
+
+EMBEDDING_DIM = 32
+
+
+class FakeSentenceTransformer:
+    """以文字雜湊產生固定向量的 SentenceTransformer 替身（相同文字得到相同向量）"""
+
+    instances = []
+
+    def __init__(self, model_name_or_path, **kwargs):
+        self.model_name = model_name_or_path
+        self.kwargs = kwargs
+        FakeSentenceTransformer.instances.append(self)
+
+    def get_sentence_embedding_dimension(self):
+        return EMBEDDING_DIM
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+            vectors[i] = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+        return vectors[0] if single else vectors
+
+
+def sample_text(paragraphs: int = 40, seed: int = 0) -> str:
+    """產生不重複的中英混合段落（避免週期性文字讓重疊比對失去意義）"""
+    rng = random.Random(seed)
+    words = ['機器學習', '線性代數', '梯度下降', '資料', '模型', '訓練', '驗證', '損失函數', '正規化',
+             'neural', 'network', 'vector', 'matrix', 'probability', '統計', '推論', '最佳化', '特徵']
+    parts = []
+    for i in range(paragraphs):
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            sentence = ''.join(rng.choice(words) for _ in range(rng.randint(4, 12)))
+            sentences.append(sentence + rng.choice('。！？'))
+        parts.append(f"段落{i}：" + ''.join(sentences))
+    return "\n\n".join(parts)
+
+
+@pytest.fixture(autouse=True)
+def fake_sentence_transformers(monkeypatch):
+    module = types.ModuleType('sentence_transformers')
+    module.SentenceTransformer = FakeSentenceTransformer
+    monkeypatch.setitem(sys.modules, 'sentence_transformers', module)
+    FakeSentenceTransformer.instances = []
+    return module
+
+
+@pytest.fixture(autouse=True)
+def isolated_services(tmp_path, monkeypatch):
+    """每個測試使用獨立的磁碟目錄，並在前後重置所有服務單例"""
+    monkeypatch.setenv('INDEX_STORE_DIR', str(tmp_path / 'index_store'))
+    monkeypatch.setenv('EMBEDDING_CACHE_PATH', str(tmp_path / 'cache' / 'embeddings.sqlite3'))
+    monkeypatch.setenv('CORPUS_SAVE_INTERVAL', '0')
+    monkeypatch.delenv('EMBEDDING_MODEL', raising=False)
+    monkeypatch.delenv('SUPABASE_URL', raising=False)
+    monkeypatch.delenv('SUPABASE_KEY', raising=False)
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+
+    _reset_singletons()
+    yield
+    _reset_singletons()
+
+
+def _reset_singletons():
+    from services import (rag_service, index_store, document_registry, embedding_cache,
+                          document_processor, embedding_writer, generation_cache)
+
+    rag_service._rag_service = None
+    index_store._index_store = None
+    document_registry._document_registry = None
+    embedding_cache._embedding_cache = None
+    document_processor._document_processor = None
+    embedding_writer._embedding_writer = None
+    generation_cache._generation_cache = None
+
+
+@pytest.fixture
+def rag_service():
+    from services.rag_service import get_rag_service
+    return get_rag_service()
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    """將文字寫入暫存 TXT 檔並返回路徑"""
+    def write(text: str, name: str = 'lecture.txt') -> str:
+        path = tmp_path / name
+        path.write_text(text, encoding='utf-8')
+        return str(path)
+    return write
+
+
+class FakeSupabase:
+    """
+    記憶體中的 SupabaseClient 替身
+
+    documents / document_embeddings 以 dict 保存；
+    fail 可指定方法名稱 → 例外，用於模擬 Supabase 失敗
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.embeddings = {}  # (document_id, chunk_index) -> row
+        self.fail = {}
+        self.calls = []
+
+    def _call(self, name, *args):
+        self.calls.append((name,) + args)
+        error = self.fail.get(name)
+        if error is not None:
+            raise error
+
+    def save_document(self, doc_data):
+        self._call('save_document', doc_data)
+        self.documents[doc_data['id']] = dict(doc_data)
+        return SimpleNamespace(data=[doc_data])
+
+    def update_document(self, doc_id, updates):
+        self._call('update_document', doc_id, updates)
+        if doc_id in self.documents:
+            self.documents[doc_id].update(updates)
+        return SimpleNamespace(data=[self.documents.get(doc_id)])
+
+    # 組合其他方法的輔助函式沿用正式實作
+    mark_document_failed = SupabaseClient.mark_document_failed
+
+    def get_document(self, doc_id):
+        self._call('get_document', doc_id)
+        return SimpleNamespace(data=self.documents.get(doc_id))
+
+    def delete_document(self, doc_id):
+        self._call('delete_document', doc_id)
+        self.documents.pop(doc_id, None)
+        for key in [key for key in self.embeddings if key[0] == doc_id]:
+            del self.embeddings[key]
+        return SimpleNamespace(data=[])
+
+    def find_document_by_hash(self, column, value):
+        self._call('find_document_by_hash', column, value)
+        rows = [row for row in self.documents.values() if row.get(column) == value and row.get('status') == 'ready']
+        return SimpleNamespace(data=rows[:1])
+
+    def upsert_embeddings(self, rows):
+        self._call('upsert_embeddings', rows)
+        for row in rows:
+            self.embeddings[(row['document_id'], row['chunk_index'])] = dict(row)
+        return SimpleNamespace(data=None)
+
+    def delete_document_embeddings(self, doc_id):
+        self._call('delete_document_embeddings', doc_id)
+        for key in [key for key in self.embeddings if key[0] == doc_id]:
+            del self.embeddings[key]
+        return SimpleNamespace(data=[])
+
+    def transfer_document_content(self, old_doc_id, new_doc_id):
+        self._call('transfer_document_content', old_doc_id, new_doc_id)
+        for (doc_id, chunk_index) in [key for key in self.embeddings if key[0] == old_doc_id]:
+            row = self.embeddings.pop((doc_id, chunk_index))
+            self.embeddings[(new_doc_id, chunk_index)] = {**row, 'document_id': new_doc_id}
+        if new_doc_id in self.documents:
+            self.documents[new_doc_id]['content_document_id'] = None
+        for row in self.documents.values():
+            if row.get('content_document_id') == old_doc_id:
+                row['content_document_id'] = new_doc_id
+        return SimpleNamespace(data=None)
+
+    def get_document_chunks(self, doc_id, include_embeddings=False):
+        self._call('get_document_chunks', doc_id)
+        rows = sorted((row for key, row in self.embeddings.items() if key[0] == doc_id),
+                      key=lambda row: row['chunk_index'])
+        return SimpleNamespace(data=[dict(row) for row in rows])
+
+    def rows_for(self, doc_id):
+        return [row for key, row in sorted(self.embeddings.items()) if key[0] == doc_id]
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    """以 FakeSupabase 取代 get_supabase，並讓各模組視為已設定 Supabase"""
+    import config
+    from services import rag_service
+
+    client = FakeSupabase()
+    monkeypatch.setattr(config, 'get_supabase', lambda: client)
+    monkeypatch.setattr(rag_service, 'USE_SUPABASE', True)
+    return client
@@ -0,0 +1,23 @@
+"""應用端點：統計端點不載入嵌入模型"""
+
+from app import create_app
+
+from conftest import FakeSentenceTransformer
+
+
+def test_stats_does_not_load_model(monkeypatch):
+    monkeypatch.delenv('GROQ_API_KEY', raising=False)
+    app = create_app(warm_up='off')
+
+    response = app.test_client().get('/api/stats')
+
+    assert response.status_code == 200
+    assert response.get_json()['rag_service'] == 'not loaded'
+    assert FakeSentenceTransformer.instances == []
+
+
+def test_stats_reports_loaded_service(rag_service, monkeypatch):
+    monkeypatch.delenv('GROQ_API_KEY', raising=False)
+    stats = create_app(warm_up='off').test_client().get('/api/stats').get_json()
+
+    assert 'index_cache' in stats and 'corpus' in stats
@@ -0,0 +1,164 @@
+"""跨文件語料索引：使用者隔離、只保存 ID、IVF 篩選後備、記憶體預算、多行程合併寫回與按使用者加鎖"""
+
+import json
+import threading
+
+import faiss
+import numpy as np
+import pytest
+from flask import Flask
+
+from services.corpus_index import CorpusIndex, CorpusIndexManager
+from services.ingestion_pipeline import IngestionPipeline
+
+from conftest import sample_text, EMBEDDING_DIM
+
+
+def random_vectors(count, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, EMBEDDING_DIM)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def test_search_reads_chunks_from_index_cache(rag_service, text_file, monkeypatch):
+    context = IngestionPipeline().run('doc-a', text_file(sample_text(40)), {'user_id': 'u1'})
+
+    monkeypatch.setattr(rag_service.index_store, 'load', lambda doc_id: pytest.fail('loaded index from disk'))
+    target = context.chunks[2]
+    results = rag_service.search_corpus(target['content'], top_k=2, owner='u1')
+
+    assert results[0]['document_id'] == 'doc-a'
+    assert results[0]['content'] == target['content']
+    assert results[0]['chunk_index'] == 2
+
+
+def test_documents_without_owner_stay_out_of_corpora(rag_service, text_file):
+    IngestionPipeline().run('doc-a', text_file(sample_text(20)))
+
+    assert rag_service.corpus.get_stats()['corpora'] == {}
+    with pytest.raises(ValueError):
+        rag_service.search_corpus('資料', owner=None)
+
+
+def test_corpus_routes_require_user_id(rag_service):
+    from routes.study_tools import study_tools_bp
+
+    app = Flask(__name__)
+    app.register_blueprint(study_tools_bp, url_prefix='/api/study')
+    response = app.test_client().post('/api/study/search', json={'query': '資料'})
+
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'user_id is required'
+
+
+def test_remove_only_loads_owner_corpus():
+    manager = CorpusIndexManager(EMBEDDING_DIM, save_interval=0)
+    manager.add_document('doc-a', random_vectors(3), 'u1')
+    manager.add_document('doc-b', random_vectors(3, seed=1), 'u2')
+
+    fresh = CorpusIndexManager(EMBEDDING_DIM, save_interval=0)
+    fresh.remove_document('doc-a', 'u1')
+
+    assert list(fresh.corpora) == ['u1']
+    assert fresh.get('u1').get_stats()['documents'] == 0
+    assert fresh.get('u2').get_stats()['documents'] == 1
+
+
+def test_corpora_are_evicted_over_budget():
+    manager = CorpusIndexManager(EMBEDDING_DIM, save_interval=0, max_bytes=1)
+    manager.add_document('doc-a', random_vectors(4), 'u1')
+    manager.add_document('doc-b', random_vectors(4, seed=1), 'u2')
+
+    stats = manager.get_stats()
+    assert list(stats['corpora']) == ['u2']
+    assert stats['evictions'] == 1
+    # 被淘汰的語料已寫回磁碟，再次存取時重新載入
+    hits = manager.get('u1').search(random_vectors(4)[:1], top_k=1)
+    assert (hits[0]['document_id'], hits[0]['position']) == ('doc-a', 0)
+
+
+def test_workers_merge_instead_of_overwriting():
+    # 兩個 worker 各自載入同一份語料，之後先後寫回
+    first = CorpusIndexManager(EMBEDDING_DIM, save_interval=0, version_check_interval=0)
+    second = CorpusIndexManager(EMBEDDING_DIM, save_interval=3600)
+    second.add_document('doc-b', random_vectors(2, seed=1), 'u1')
+    first.add_document('doc-a', random_vectors(2), 'u1')
+    second._save_timer.cancel()
+    second.flush()
+
+    reader = CorpusIndexManager(EMBEDDING_DIM, save_interval=0)
+    assert set(reader.get('u1').content_of) == {'doc-a', 'doc-b'}
+    # 仍持有舊版本的 worker 讀取時發現檔案已更新並重新載入
+    assert set(first.get('u1').content_of) == {'doc-a', 'doc-b'}
+
+
+def test_filtered_ivf_search_falls_back_to_all_lists():
+    corpus = CorpusIndex(EMBEDDING_DIM, ivf_threshold=2000, nprobe=1)
+    corpus.add_document('bulk', random_vectors(2000))
+    assert corpus.is_ivf
+
+    query = random_vectors(1, seed=7)
+    # 與查詢方向相反的向量落在查詢不會探查的聚類
+    target = -query + 0.05 * random_vectors(5, seed=8)
+    faiss.normalize_L2(target)
+    corpus.add_document('target', target)
+
+    selector = faiss.IDSelectorBatch(np.array(corpus.vector_ids['target'], dtype=np.int64))
+    _, ids = corpus.index.search(query, 5, params=faiss.SearchParametersIVF(sel=selector, nprobe=1))
+    assert (ids[0] < 0).all()
+
+    results = corpus.search(query, top_k=5, doc_ids=['target'])
+    assert len(results) == 5
+    assert {hit['document_id'] for hit in results} == {'target'}
+
+
+def test_corpus_file_stores_ids_only(rag_service, text_file):
+    context = IngestionPipeline().run('doc-a', text_file(sample_text(20)), {'user_id': 'u1'})
+
+    _, map_path = rag_service.index_store._corpus_paths('u1')
+    with open(map_path, encoding='utf-8') as f:
+        state = json.load(f)
+    assert 'chunks' not in state
+    assert context.chunks[0]['content'] not in json.dumps(state, ensure_ascii=False)
+
+
+def test_version_check_is_throttled(monkeypatch):
+    manager = CorpusIndexManager(EMBEDDING_DIM, save_interval=0, version_check_interval=3600)
+    manager.add_document('doc-a', random_vectors(2), 'u1')
+
+    calls = []
+    version = manager.index_store.corpus_version
+    monkeypatch.setattr(manager.index_store, 'corpus_version', lambda owner: calls.append(owner) or version(owner))
+    for _ in range(5):
+        manager.get('u1').search(random_vectors(1), top_k=1)
+    assert calls == []
+
+
+def test_save_does_not_block_searches_or_other_owners(monkeypatch):
+    manager = CorpusIndexManager(EMBEDDING_DIM, save_interval=3600)
+    manager.add_document('doc-a', random_vectors(2), 'u1')
+    manager.add_document('doc-b', random_vectors(2, seed=1), 'u2')
+    manager._save_timer.cancel()
+
+    writing, release = threading.Event(), threading.Event()
+    save_corpus = manager.index_store.save_corpus
+
+    def slow_save(owner, index, state):
+        writing.set()
+        release.wait(5)
+        save_corpus(owner, index, state)
+
+    monkeypatch.setattr(manager.index_store, 'save_corpus', slow_save)
+    saver = threading.Thread(target=manager._save, args=('u1',))
+    saver.start()
+    assert writing.wait(5)
+
+    # 寫檔期間：同一使用者仍可搜索與更新索引，其他使用者可以新增文件
+    assert manager.get('u1').search(random_vectors(1), top_k=1)
+    manager.add_document('doc-c', random_vectors(2, seed=2), 'u2')
+    assert manager.get('u2').get_stats()['documents'] == 2
+
+    release.set()
+    saver.join(5)
+    manager._save_timer.cancel()
+    assert manager.index_store.corpus_version('u1') == manager.versions['u1']
@@ -0,0 +1,76 @@
+"""去重登記表：重複文件共用語料向量、刪除來源時轉移內容、建立重複文件失敗時的清理"""
+
+import pytest
+from flask import Flask
+
+from services.ingestion_pipeline import IngestionPipeline
+
+from conftest import sample_text
+
+
+def upload(doc_id, path, user_id='u1'):
+    return IngestionPipeline(use_supabase=True).run(
+        doc_id, path, {'user_id': user_id, 'file_hash': doc_id, 'original_filename': f'{doc_id}.txt'}
+    )
+
+
+@pytest.fixture
+def duplicates(rag_service, fake_supabase, text_file):
+    text = sample_text(30)
+    first = upload('doc-a', text_file(text, 'a.txt'))
+    upload('doc-b', text_file(text + "\n", 'b.txt'))
+    upload('doc-c', text_file(text + "\n\n", 'c.txt'))
+    return first
+
+
+def test_linked_duplicates_share_corpus_vectors(rag_service, duplicates):
+    stats = rag_service.corpus.get('u1').get_stats()
+    assert stats['vectors'] == len(duplicates.chunks)
+    assert stats['documents'] == 3
+
+    target = duplicates.chunks[1]
+    results = rag_service.search_corpus(target['content'], top_k=3, owner='u1')
+    assert [hit['chunk_index'] for hit in results].count(1) == 1
+    assert results[0]['document_ids'] == ['doc-a', 'doc-b', 'doc-c']
+
+    filtered = rag_service.search_corpus(target['content'], top_k=1, owner='u1', doc_ids=['doc-c'])
+    assert filtered[0]['document_id'] == 'doc-c'
+
+
+def test_removing_source_transfers_content(rag_service, fake_supabase, duplicates):
+    rag_service.remove_document('doc-a', 'u1')
+
+    assert rag_service.registry.resolve('doc-c') == 'doc-b'
+    assert fake_supabase.rows_for('doc-a') == []
+    assert len(fake_supabase.rows_for('doc-b')) == len(duplicates.chunks)
+    assert fake_supabase.documents['doc-b']['content_document_id'] is None
+    assert fake_supabase.documents['doc-c']['content_document_id'] == 'doc-b'
+
+    # 語料中的向量保留給其餘的重複文件，新的重複文件仍共用同一份向量
+    corpus = rag_service.corpus.get('u1')
+    assert corpus.get_stats()['vectors'] == len(duplicates.chunks)
+    results = rag_service.search_corpus(duplicates.chunks[0]['content'], top_k=1, owner='u1')
+    assert results[0]['document_ids'] == ['doc-b', 'doc-c']
+
+    rag_service.remove_document('doc-b', 'u1')
+    rag_service.remove_document('doc-c', 'u1')
+    assert corpus.get_stats()['vectors'] == 0
+
+
+def test_failed_duplicate_leaves_no_processing_entry(rag_service, tmp_path, monkeypatch):
+    from routes import documents
+
+    def broken_link(*args, **kwargs):
+        raise ValueError('Document doc-a not indexed')
+
+    monkeypatch.setattr(rag_service, 'link_duplicate', broken_link)
+    path = tmp_path / 'b.txt'
+    path.write_text('內容', encoding='utf-8')
+
+    with Flask(__name__).app_context():
+        with pytest.raises(ValueError):
+            documents._create_duplicate_document('doc-b', str(path), 'b.txt', 'b.txt', 'u1', 'hash',
+                                                 {'content_document_id': 'doc-a', 'total_characters': 2,
+                                                  'total_tokens': 2, 'total_chunks': 1})
+
+    assert 'doc-b' not in documents.documents_store
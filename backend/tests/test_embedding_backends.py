@@ -0,0 +1,59 @@
+"""嵌入推論後端：EMBEDDING_MODEL 前綴解析，以及 RAGService 經後端載入與編碼"""
+
+import os
+
+import numpy as np
+
+from services import embedding_backends
+from services.embedding_backends import parse_model_spec, create_embedding_backend
+from services.rag_service import RAGService
+
+from conftest import FakeSentenceTransformer, EMBEDDING_DIM
+
+
+def test_parse_model_spec():
+    assert parse_model_spec('shibing624/text2vec-base-chinese') == ('torch', 'shibing624/text2vec-base-chinese')
+    assert parse_model_spec('onnx:org/model') == ('onnx', 'org/model')
+    assert parse_model_spec('onnx-int8:org/model') == ('onnx-int8', 'org/model')
+    # 未知前綴視為模型名稱的一部分
+    assert parse_model_spec('hf:org/model') == ('torch', 'hf:org/model')
+
+
+def test_rag_service_loads_onnx_backend(monkeypatch):
+    monkeypatch.setenv('EMBEDDING_MODEL', 'onnx:org/model')
+    service = RAGService()
+
+    model = FakeSentenceTransformer.instances[-1]
+    assert model.model_name == 'org/model'
+    assert model.kwargs == {'backend': 'onnx'}
+    assert service.embedding_backend.backend == 'onnx'
+    assert service.model_name == 'onnx:org/model'
+    assert service.embedding_dim == EMBEDDING_DIM
+
+    embeddings = service.create_embeddings(['第一段', '第二段'])
+    assert embeddings.shape == (2, EMBEDDING_DIM)
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-5)
+
+
+def test_int8_backend_exports_once(monkeypatch, tmp_path, fake_sentence_transformers):
+    exports = []
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+
+    def export_dynamic_quantized_onnx_model(model, config, path):
+        exports.append(config)
+        os.makedirs(os.path.join(path, 'onnx'), exist_ok=True)
+        open(os.path.join(path, 'onnx', f'model_qint8_{config}.onnx'), 'wb').close()
+
+    monkeypatch.setattr(FakeSentenceTransformer, 'save', save, raising=False)
+    fake_sentence_transformers.export_dynamic_quantized_onnx_model = export_dynamic_quantized_onnx_model
+    monkeypatch.setattr(embedding_backends, 'ONNX_EXPORT_DIR', str(tmp_path / 'onnx'))
+
+    backend = create_embedding_backend('onnx-int8:org/model')
+    assert backend.backend == 'onnx-int8'
+    assert backend.model.kwargs == {'backend': 'onnx', 'model_kwargs': {'file_name': 'onnx/model_qint8_avx2.onnx'}}
+
+    # 已匯出的量化模型直接載入
+    create_embedding_backend('onnx-int8:org/model')
+    assert exports == ['avx2']
@@ -0,0 +1,60 @@
+"""嵌入微批次：批次不超過上限、結果依請求分發，只有查詢經過批次處理"""
+
+import time
+import threading
+
+import numpy as np
+
+from services.embedding_batcher import EmbeddingBatcher
+
+from conftest import EMBEDDING_DIM
+
+
+def test_batches_never_exceed_max_size():
+    started, release = threading.Event(), threading.Event()
+    batches = []
+
+    def encode(texts):
+        batches.append(list(texts))
+        if len(batches) == 1:
+            # 第一批編碼期間，其他請求在佇列中累積
+            started.set()
+            release.wait(5)
+        return np.array([[float(text)] for text in texts], dtype=np.float32)
+
+    batcher = EmbeddingBatcher(encode, max_batch_size=4, max_wait_ms=50)
+    requests = [[str(i * 10 + j) for j in range(3)] for i in range(4)]
+    results = {}
+
+    def run(texts):
+        results[texts[0]] = batcher.encode(texts)
+
+    first = threading.Thread(target=run, args=(requests[0],))
+    first.start()
+    assert started.wait(5)
+    others = [threading.Thread(target=run, args=(texts,)) for texts in requests[1:]]
+    for thread in others:
+        thread.start()
+    while batcher.queue.qsize() < len(others):
+        time.sleep(0.01)
+    release.set()
+    for thread in [first, *others]:
+        thread.join(5)
+
+    # 每個請求 3 段文字、上限 4：加入下一個請求會超過上限，因此各自成批
+    assert [len(batch) for batch in batches] == [3, 3, 3, 3]
+    for texts in requests:
+        np.testing.assert_array_equal(results[texts[0]][:, 0], [float(text) for text in texts])
+
+
+def test_only_queries_use_batcher(rag_service, monkeypatch):
+    batched = []
+    encode = rag_service.batcher.encode
+    monkeypatch.setattr(rag_service.batcher, 'encode', lambda texts: batched.append(list(texts)) or encode(texts))
+
+    embeddings, stats = rag_service.create_document_embeddings(['第一段', '第二段'])
+    assert embeddings.shape == (2, EMBEDDING_DIM) and stats['misses'] == 2
+    assert batched == []
+
+    assert rag_service.embed_query('什麼是梯度下降？').shape == (1, EMBEDDING_DIM)
+    assert batched == [['什麼是梯度下降？']]
@@ -0,0 +1,112 @@
+"""嵌入快取：超出筆數或容量上限時淘汰最久未使用的向量，舊版資料表自動升級"""
+
+import sqlite3
+
+import numpy as np
+
+from services import embedding_cache as cache_module
+from services.embedding_cache import EmbeddingCache, text_hash
+
+
+def vectors(count, dim=8):
+    return np.arange(count * dim, dtype=np.float32).reshape(count, dim)
+
+
+def put(cache, texts):
+    cache.put_many('model', [text_hash(text) for text in texts], vectors(len(texts)))
+
+
+def cached_texts(cache, texts):
+    found, _ = cache.get_many('model', texts)
+    return sorted(texts[i] for i in found)
+
+
+def statements(cache):
+    """記錄快取連線執行的 SQL"""
+    executed = []
+    cache.conn.set_trace_callback(executed.append)
+    return executed
+
+
+def test_prunes_least_recently_used_over_max_entries(tmp_path, monkeypatch):
+    clock = {'now': 1000}
+    monkeypatch.setattr(cache_module.time, 'time', lambda: clock['now'])
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=10, max_bytes=0)
+
+    put(cache, [f'舊 {i}' for i in range(5)])
+    clock['now'] += 10
+    put(cache, [f'新 {i}' for i in range(5)])
+    # 超過更新間隔後讀取，使前兩筆舊向量成為最近使用
+    clock['now'] += 100
+    assert cached_texts(cache, ['舊 0', '舊 1']) == ['舊 0', '舊 1']
+
+    clock['now'] += 10
+    put(cache, ['最新'])
+
+    # 超出 10 筆時淘汰到 9 筆：從未再讀取的三筆舊向量中刪除兩筆
+    assert cache.get_stats()['evictions'] == 2
+    remaining = cached_texts(cache, [f'舊 {i}' for i in range(5)])
+    assert remaining[:2] == ['舊 0', '舊 1'] and len(remaining) == 3
+    assert len(cached_texts(cache, [f'新 {i}' for i in range(5)] + ['最新'])) == 6
+
+
+def test_prunes_over_max_bytes(tmp_path):
+    # 每筆向量 8 維 float32 = 32 bytes
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=0, max_bytes=32 * 10)
+    put(cache, [f'區塊 {i}' for i in range(20)])
+
+    remaining = cached_texts(cache, [f'區塊 {i}' for i in range(20)])
+    assert len(remaining) == 9
+
+
+def test_upgrades_table_without_last_used(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE embeddings (
+            model TEXT NOT NULL, text_hash BLOB NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("INSERT INTO embeddings VALUES (?, ?, ?, ?)",
+                 ('model', text_hash('舊資料'), 8, vectors(1)[0].tobytes()))
+    conn.commit()
+    conn.close()
+
+    cache = EmbeddingCache(path, max_entries=2, max_bytes=0)
+    assert cached_texts(cache, ['舊資料']) == ['舊資料']
+    put(cache, ['a', 'b'])
+    assert len(cached_texts(cache, ['舊資料', 'a', 'b'])) == 1
+
+
+def test_counters_avoid_full_scans_until_limit(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=10, max_bytes=0)
+    executed = statements(cache)
+
+    put(cache, [f'區塊 {i}' for i in range(6)])
+    put(cache, [f'區塊 {i}' for i in range(4, 10)])  # 兩筆已存在，不重複計算
+    assert not any('COUNT' in sql for sql in executed)
+    assert (cache.get_stats()['entries'], cache.get_stats()['bytes']) == (10, 10 * 32)
+
+    put(cache, ['區塊 10'])
+    assert sum('COUNT' in sql for sql in executed) == 1
+    assert cache.get_stats()['entries'] == 9
+    assert cache.get_stats()['bytes'] == 9 * 32
+
+
+def test_hits_touch_last_used_at_most_once_per_interval(tmp_path, monkeypatch):
+    clock = {'now': 1000}
+    monkeypatch.setattr(cache_module.time, 'time', lambda: clock['now'])
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), max_entries=0, max_bytes=0)
+    put(cache, ['a', 'b'])
+    executed = statements(cache)
+
+    for _ in range(5):
+        clock['now'] += 5
+        assert cached_texts(cache, ['a', 'b']) == ['a', 'b']
+    assert not any(sql.startswith('UPDATE') for sql in executed)
+
+    clock['now'] += cache_module._TOUCH_INTERVAL
+    cached_texts(cache, ['a'])
+    cached_texts(cache, ['a'])
+    assert sum(sql.startswith('UPDATE') for sql in executed) == 1
@@ -0,0 +1,82 @@
+"""嵌入批次寫入：批次切分、依 SQLSTATE 與 HTTP 狀態判斷重試"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from services.embedding_writer import EmbeddingWriter, split_batches, _is_retryable
+
+
+class APIError(Exception):
+    """與 postgrest.APIError 相同的屬性"""
+
+    def __init__(self, code):
+        super().__init__(f'error {code}')
+        self.code = code
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+class PsycopgError(Exception):
+    def __init__(self, sqlstate):
+        super().__init__(sqlstate)
+        self.sqlstate = sqlstate
+
+
+@pytest.mark.parametrize('error', [
+    APIError('40001'), APIError('57014'), APIError('08006'), PsycopgError('40P01'), PsycopgError('08001'),
+    HTTPStatusError(429), HTTPStatusError(503), APIError('502'), ConnectionResetError('reset'),
+])
+def test_retryable_errors(error):
+    assert _is_retryable(error)
+
+
+@pytest.mark.parametrize('error', [
+    APIError('23505'), APIError('22P02'), APIError('42501'), APIError('42P01'), APIError('PGRST204'),
+    PsycopgError('23503'), HTTPStatusError(400), HTTPStatusError(401), APIError('413'),
+])
+def test_non_retryable_errors(error):
+    assert not _is_retryable(error)
+
+
+def rows(count, doc_id='doc-a'):
+    return [{'document_id': doc_id, 'content': f'區塊 {i}', 'chunk_index': i, 'embedding': '[0.1,0.2]'}
+            for i in range(count)]
+
+
+def test_split_batches_respects_rows_and_bytes():
+    assert [len(batch) for batch in split_batches(rows(5), max_rows=2, max_bytes=10 ** 6)] == [2, 2, 1]
+    # 單列超過位元組上限時自成一批
+    assert [len(batch) for batch in split_batches(rows(3), max_rows=100, max_bytes=1)] == [1, 1, 1]
+
+
+def test_writer_retries_serialization_failure(fake_supabase, monkeypatch):
+    monkeypatch.setenv('EMBEDDING_WRITE_BACKOFF_BASE', '0')
+    upsert_embeddings = fake_supabase.upsert_embeddings
+    failures = [APIError('40001')]
+
+    def flaky(batch):
+        if failures:
+            raise failures.pop()
+        return upsert_embeddings(batch)
+
+    fake_supabase.upsert_embeddings = flaky
+    stats = EmbeddingWriter(max_workers=1).write(rows(3))
+
+    assert stats['retries'] == 1
+    assert len(fake_supabase.rows_for('doc-a')) == 3
+
+
+def test_writer_does_not_retry_constraint_violation(fake_supabase, monkeypatch):
+    monkeypatch.setenv('EMBEDDING_WRITE_BACKOFF_BASE', '0')
+    fake_supabase.fail['upsert_embeddings'] = APIError('23503')
+    writer = EmbeddingWriter(max_workers=1)
+
+    with pytest.raises(APIError):
+        writer.write(rows(3))
+    assert len([call for call in fake_supabase.calls if call[0] == 'upsert_embeddings']) == 1
+    assert writer.get_stats()['failed_batches'] == 1
@@ -0,0 +1,64 @@
+"""長文件 map-reduce：各層的 map 請求並行送入執行器，同時進行的請求不超過上限"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services import groq_service as groq_module
+
+
+@pytest.fixture
+def groq_service(monkeypatch):
+    monkeypatch.setenv('GROQ_API_KEY', 'test-key')
+    monkeypatch.setattr(groq_module, '_groq_service', None)
+    monkeypatch.setitem(groq_module.PROMPT_CONTENT_CHARS, 'quiz', 100)
+    monkeypatch.setattr(groq_module, 'MAP_REDUCE_FANOUT', 3)
+    return groq_module.get_groq_service()
+
+
+def test_map_requests_run_concurrently_up_to_fanout(groq_service, monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=16)
+    lock = threading.Lock()
+    state = {'active': 0, 'peak': 0, 'calls': 0}
+
+    def fake_notes(content, max_chars):
+        def run():
+            with lock:
+                state['active'] += 1
+                state['calls'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.02)
+            with lock:
+                state['active'] -= 1
+            return content.split(':')[0]
+        return pool.submit(run)
+
+    monkeypatch.setattr(groq_service, '_submit_notes', fake_notes)
+    paragraphs = [f"p{i}:" + "x" * 80 for i in range(6)]
+    prepared = groq_service._prepare_content('quiz', "\n".join(paragraphs))
+    pool.shutdown()
+
+    assert state['calls'] == 6
+    assert state['peak'] == 3
+    # 筆記依原段落順序合併
+    assert [line for line in prepared.splitlines() if line.startswith('p')] == [f"p{i}" for i in range(6)]
+
+
+def test_identical_groups_share_one_request(groq_service, monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=4)
+    futures = {}
+
+    def coalescing_notes(content, max_chars):
+        # 與執行器相同：相同的進行中請求返回同一個 Future
+        if content not in futures:
+            futures[content] = pool.submit(lambda: 'note')
+        return futures[content]
+
+    monkeypatch.setattr(groq_service, '_submit_notes', coalescing_notes)
+    notes = groq_service._map_notes(['same', 'same', 'other'], 500)
+    pool.shutdown()
+
+    assert notes == ['note', 'note', 'note']
+    assert len(futures) == 2
@@ -0,0 +1,48 @@
+"""索引存儲與全文：依位元組範圍讀取、從 Supabase 區塊精確還原全文"""
+
+from services.index_store import IndexStore
+from services.ingestion_pipeline import IngestionPipeline
+
+from conftest import sample_text
+
+
+def test_read_text_range_aligns_to_characters(tmp_path):
+    store = IndexStore(str(tmp_path / 'store'))
+    store.save_text('doc-a', '機器學習 model')
+
+    # 從「器」的第 2 個位元組開始、在「學」中間結束：兩端對齊到字元邊界
+    text, start, end = store.read_text_range('doc-a', 4, 4)
+    assert (text, start, end) == ('學', 6, 9)
+    assert store.read_text_range('doc-a', 12, 100) == (' model', 12, 18)
+    assert store.read_text_range('missing') is None
+
+
+def forget_local_copy(rag_service, doc_id):
+    rag_service.index_store.delete(doc_id)
+    rag_service.index_cache.pop(doc_id)
+    rag_service.text_cache.pop(doc_id)
+
+
+def test_full_text_rebuilt_exactly_from_supabase(rag_service, fake_supabase, text_file):
+    text = sample_text(40)
+    IngestionPipeline(use_supabase=True).run('doc-a', text_file(text))
+    assert all(row['start_byte'] is not None for row in fake_supabase.rows_for('doc-a'))
+
+    forget_local_copy(rag_service, 'doc-a')
+    assert rag_service.get_full_text('doc-a') == text
+    assert rag_service.index_store.load_text('doc-a') == text
+
+
+def test_approximate_text_is_not_persisted(rag_service, fake_supabase, text_file):
+    IngestionPipeline(use_supabase=True).run('doc-a', text_file(sample_text(40)))
+    # 沒有位元組位置的舊資料列
+    for row in fake_supabase.rows_for('doc-a'):
+        row['start_byte'] = row['end_byte'] = None
+
+    forget_local_copy(rag_service, 'doc-a')
+    assert rag_service.get_full_text('doc-a')
+    assert not rag_service.index_store.has_text('doc-a')
+    assert rag_service.text_cache.get('doc-a') is None
+
+    ranged = rag_service.get_text_range('doc-a', 0, 64)
+    assert ranged['start'] == 0 and ranged['text']
@@ -0,0 +1,106 @@
+"""持久化階段與狀態查詢：Supabase 記錄最後一定是 ready、degraded 或 failed，任務狀態與記錄一致"""
+
+import pytest
+from flask import Flask
+
+from services.ingestion_jobs import IngestionJobQueue
+from services.ingestion_pipeline import IngestionPipeline
+
+from conftest import sample_text
+
+
+@pytest.fixture(autouse=True)
+def no_write_retries(monkeypatch):
+    monkeypatch.setenv('EMBEDDING_WRITE_RETRIES', '0')
+
+
+def upload_metadata(doc_id):
+    return {'original_filename': f'{doc_id}.txt', 'stored_filename': f'{doc_id}.txt', 'file_hash': doc_id}
+
+
+def test_persist_marks_ready(rag_service, fake_supabase, text_file):
+    context = IngestionPipeline(use_supabase=True).run('doc-a', text_file(sample_text(30)), upload_metadata('doc-a'))
+
+    assert context.saved_to_supabase
+    assert fake_supabase.documents['doc-a']['status'] == 'ready'
+    assert len(fake_supabase.rows_for('doc-a')) == len(context.chunks)
+
+
+def test_persist_failure_marks_degraded(rag_service, fake_supabase, text_file):
+    fake_supabase.fail['upsert_embeddings'] = RuntimeError('connection reset')
+    context = IngestionPipeline(use_supabase=True).run('doc-a', text_file(sample_text(30)), upload_metadata('doc-a'))
+
+    assert not context.saved_to_supabase
+    assert context.persist_error == 'connection reset'
+    assert context.status == 'degraded'
+    assert fake_supabase.documents['doc-a']['status'] == 'degraded'
+    assert fake_supabase.documents['doc-a']['error'] == 'connection reset'
+    # 本地索引仍可使用
+    assert rag_service.is_document_indexed('doc-a')
+
+
+def test_degraded_status_without_error_column(rag_service, fake_supabase, text_file):
+    calls = {'count': 0}
+    update_document = fake_supabase.update_document
+
+    def reject_error_column(doc_id, updates):
+        calls['count'] += 1
+        if 'error' in updates:
+            raise RuntimeError("Could not find the 'error' column")
+        return update_document(doc_id, updates)
+
+    fake_supabase.update_document = reject_error_column
+    fake_supabase.fail['upsert_embeddings'] = RuntimeError('timeout')
+    IngestionPipeline(use_supabase=True).run('doc-a', text_file(sample_text(30)), upload_metadata('doc-a'))
+
+    assert fake_supabase.documents['doc-a']['status'] == 'degraded'
+
+
+@pytest.fixture
+def documents_client(fake_supabase, monkeypatch):
+    from routes import documents
+
+    monkeypatch.setattr(documents, 'USE_SUPABASE', True)
+    monkeypatch.setattr(documents, 'get_supabase', lambda: fake_supabase)
+    queue = IngestionJobQueue(max_workers=1)
+    monkeypatch.setattr(documents, 'get_ingestion_queue', lambda: queue)
+    monkeypatch.setattr(documents, 'documents_store', {})
+
+    app = Flask(__name__)
+    app.register_blueprint(documents.documents_bp, url_prefix='/api/documents')
+    yield app.test_client(), queue
+    queue.executor.shutdown()
+
+
+def test_status_falls_back_to_supabase_row(documents_client, fake_supabase):
+    client, _ = documents_client
+    fake_supabase.documents['doc-x'] = {'id': 'doc-x', 'status': 'failed', 'error': 'timeout'}
+
+    response = client.get('/api/documents/doc-x/status').get_json()
+
+    assert response['status'] == 'failed'
+    assert response['error'] == 'timeout'
+
+
+def test_status_after_persist_failure_matches_supabase_row(rag_service, fake_supabase, text_file,
+                                                           documents_client, monkeypatch):
+    from routes import documents
+
+    client, queue = documents_client
+    fake_supabase.fail['upsert_embeddings'] = RuntimeError('connection reset')
+    fake_supabase.save_document({'id': 'doc-a', 'status': 'processing'})
+    documents.documents_store['doc-a'] = {'id': 'doc-a', 'status': 'processing'}
+    queue.submit('doc-a', text_file(sample_text(30)), {**upload_metadata('doc-a'), 'document_saved': True},
+                 use_supabase=True, on_success=lambda context: documents._on_ingestion_success('doc-a', context))
+    queue.executor.shutdown(wait=True)
+
+    response = client.get('/api/documents/doc-a/status').get_json()
+    assert response['status'] == 'degraded'
+    assert response['error'] == 'connection reset'
+    assert response['document']['status'] == 'degraded'
+    assert response['document']['saved_to_supabase'] is False
+
+    # 其他 worker（沒有這個任務）回退到 documents 表，得到相同的狀態
+    monkeypatch.setattr(documents, 'get_ingestion_queue', lambda: IngestionJobQueue(max_workers=1))
+    fallback = client.get('/api/documents/doc-a/status').get_json()
+    assert (fallback['status'], fallback['error']) == ('degraded', 'connection reset')
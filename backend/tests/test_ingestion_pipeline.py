@@ -0,0 +1,67 @@
+"""攝取管線：單次解析、區塊與索引、文字雜湊去重"""
+
+from collections import Counter
+
+from services.ingestion_pipeline import IngestionPipeline
+
+from conftest import sample_text
+
+
+def count_calls(monkeypatch, target, name, counts, size=None):
+    """以包裝函式記錄 target.name 的呼叫次數（size 用於累計參數數量，例如編碼的文字數）"""
+    original = getattr(target, name)
+
+    def wrapper(*args, **kwargs):
+        counts[name] += 1
+        if size is not None:
+            counts[f'{name}_items'] += size(*args, **kwargs)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(target, name, wrapper)
+
+
+def test_pipeline_runs_every_stage_once(rag_service, text_file, monkeypatch):
+    path = text_file(sample_text(60))
+    pipeline = IngestionPipeline()
+    counts = Counter()
+    processor = pipeline.document_processor
+    for name in ('extract_pages', '_extract_from_txt', 'encode_array', 'tokenize', 'split_text_into_chunks'):
+        count_calls(monkeypatch, processor, name, counts)
+    count_calls(monkeypatch, rag_service.embedding_backend, 'encode', counts, size=lambda texts, **kwargs: len(texts))
+    for name in ('index_chunks', 'index_document'):
+        count_calls(monkeypatch, rag_service, name, counts)
+
+    context = pipeline.run('doc-a', path)
+
+    # 每份上傳只提取、編碼 token、切片、嵌入與建立索引各一次
+    assert counts['extract_pages'] == 1 and counts['_extract_from_txt'] == 1
+    assert counts['encode_array'] == 1 and counts['tokenize'] == 0
+    assert counts['split_text_into_chunks'] == 1
+    assert counts['encode_items'] == len(context.chunks)
+    assert counts['index_chunks'] == 1 and counts['index_document'] == 0
+    assert list(context.timings) == IngestionPipeline.STAGES
+    assert context.chunks and context.index_result['chunks_indexed'] == len(context.chunks)
+    assert context.stats['total_tokens'] == len(context.tokens)
+    assert context.stats['total_chunks'] == len(context.chunks)
+    assert rag_service.is_document_indexed('doc-a')
+
+
+def test_search_finds_indexed_chunk(rag_service, text_file):
+    context = IngestionPipeline().run('doc-a', text_file(sample_text(60)))
+
+    # 假模型對相同文字產生相同向量，以區塊內容查詢應取回該區塊
+    target = context.chunks[3]
+    results = rag_service.search('doc-a', target['content'], top_k=3)
+    assert results[0]['chunk_index'] == target['chunk_index']
+
+
+def test_text_identical_upload_reuses_index(rag_service, text_file):
+    text = sample_text(30)
+    first = IngestionPipeline().run('doc-a', text_file(text, 'a.txt'))
+    # 檔案位元組不同（結尾空白），正規化後的文字相同
+    second = IngestionPipeline().run('doc-b', text_file(text + "\n\n", 'b.txt'))
+
+    assert first.duplicate is None
+    assert second.duplicate['content_document_id'] == 'doc-a'
+    assert second.index_result['embeddings_for_db'] == []
+    assert rag_service.search('doc-b', first.chunks[0]['content'], top_k=1)[0]['chunk_index'] == 0
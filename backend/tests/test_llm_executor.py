@@ -0,0 +1,151 @@
+"""LLM 執行器：令牌桶補充與退讓、429 重試而 400 不重試、進行中請求合併、串流共用並行名額"""
+
+import threading
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from groq import BadRequestError, RateLimitError
+
+from services import llm_executor as llm_module
+from services.llm_executor import LLMExecutor, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """以手動推進的時鐘取代 time.monotonic / time.sleep（sleep 直接推進時鐘並記錄）"""
+    state = {'now': 1000.0, 'sleeps': []}
+
+    def sleep(seconds):
+        state['sleeps'].append(seconds)
+        state['now'] += seconds
+
+    monkeypatch.setattr(llm_module.time, 'monotonic', lambda: state['now'])
+    monkeypatch.setattr(llm_module.time, 'sleep', sleep)
+    return state
+
+
+def reply(content='ok'):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def status_error(error_class, status_code, headers=None):
+    response = httpx.Response(status_code, headers=headers or {}, request=httpx.Request('POST', 'https://api.groq.com'))
+    return error_class(f'status {status_code}', response=response, body=None)
+
+
+class FakeClient:
+    """chat.completions.create 依序返回 outcomes 中的結果（例外則拋出）"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if callable(outcome):
+            outcome = outcome()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_executor(client, max_workers=2):
+    return LLMExecutor(client, max_workers=max_workers, requests_per_minute=0, tokens_per_minute=0, max_retries=3)
+
+
+MESSAGES = [{'role': 'user', 'content': '什麼是梯度下降？'}]
+
+
+def test_bucket_refills_continuously_up_to_capacity(clock):
+    bucket = TokenBucket(60)  # 每秒補充 1 個
+    assert bucket.acquire(60) == 0.0
+
+    clock['now'] += 30
+    assert bucket.acquire(10) == 0.0
+    assert bucket.tokens == pytest.approx(20)
+
+    clock['now'] += 1000
+    bucket.adjust(0)
+    assert bucket.tokens == pytest.approx(60)
+
+
+def test_bucket_waits_for_missing_tokens(clock):
+    bucket = TokenBucket(120)  # 每秒補充 2 個
+    bucket.acquire(120)
+
+    assert bucket.acquire(10) == pytest.approx(5)
+    assert clock['sleeps'] == [pytest.approx(5)]
+
+
+def test_penalize_drains_bucket_for_retry_after(clock):
+    bucket = TokenBucket(60)
+    bucket.penalize(5)
+    assert bucket.tokens == pytest.approx(-5)
+
+    # 先補回被預扣的 5 秒，再等 1 秒取得令牌
+    assert bucket.acquire(1) == pytest.approx(6)
+
+
+def test_retries_rate_limit_with_retry_after(clock):
+    client = FakeClient(status_error(RateLimitError, 429, {'retry-after': '2'}), reply('答案'))
+    executor = make_executor(client)
+
+    assert executor.complete('model', MESSAGES) == '答案'
+    assert len(client.requests) == 2
+    assert clock['sleeps'] == [2.0]
+    assert executor.get_stats()['retries'] == 1
+
+
+def test_does_not_retry_bad_request(clock):
+    client = FakeClient(status_error(BadRequestError, 400), reply())
+    executor = make_executor(client)
+
+    with pytest.raises(BadRequestError):
+        executor.complete('model', MESSAGES)
+    assert len(client.requests) == 1
+    assert clock['sleeps'] == []
+    assert executor.get_stats()['failed'] == 1
+
+
+def test_identical_in_flight_requests_are_coalesced():
+    release = threading.Event()
+    client = FakeClient(lambda: release.wait(5) and reply('共用'))
+    executor = make_executor(client)
+
+    first = executor.submit('model', MESSAGES)
+    second = executor.submit('model', MESSAGES)
+    other = executor.submit('model', MESSAGES, temperature=0.1)
+    release.set()
+
+    assert second is first
+    assert first.result(5) == second.result(5) == '共用'
+    other.result(5)
+    assert len(client.requests) == 2
+    assert executor.get_stats()['coalesced'] == 1
+    # 完成後相同的請求重新呼叫
+    executor.complete('model', MESSAGES)
+    assert len(client.requests) == 3
+
+
+def test_stream_shares_concurrency_limit_with_pool():
+    release = threading.Event()
+    chunk = SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='片段'))])
+    client = FakeClient(lambda: release.wait(5) and reply(), [chunk])
+    executor = make_executor(client, max_workers=1)
+
+    pending = executor.submit('model', MESSAGES)
+    streamed = []
+    streamer = threading.Thread(target=lambda: streamed.extend(executor.stream('model', MESSAGES)))
+    streamer.start()
+    streamer.join(0.2)
+
+    # 唯一的名額被執行緒池的請求佔用，串流尚未送出
+    assert streamer.is_alive() and len(client.requests) == 1
+    release.set()
+    pending.result(5)
+    streamer.join(5)
+    assert streamed == ['片段']
+    assert executor.get_stats()['running'] == 0
@@ -0,0 +1,33 @@
+"""PDF 提取行程池：預設以 spawn 啟動，結果與逐頁提取相同"""
+
+import pytest
+from PyPDF2 import PdfWriter
+
+from services import document_processor as processor_module
+from services.document_processor import DocumentProcessor
+
+
+@pytest.fixture
+def pdf_pool(monkeypatch):
+    monkeypatch.setattr(processor_module, 'PDF_EXTRACT_WORKERS', 2)
+    monkeypatch.setattr(processor_module, 'PDF_PARALLEL_MIN_PAGES', 4)
+    yield
+    if processor_module._pdf_pool is not None:
+        processor_module._pdf_pool.shutdown()
+        processor_module._pdf_pool = None
+
+
+def blank_pdf(path, pages):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return str(path)
+
+
+def test_pdf_pool_uses_spawn(pdf_pool, tmp_path):
+    path = blank_pdf(tmp_path / 'slides.pdf', 6)
+
+    assert DocumentProcessor().extract_pages(path) == [''] * 6
+    assert processor_module._pdf_pool._mp_context.get_start_method() == 'spawn'
@@ -0,0 +1,68 @@
+"""語義切片：標題判斷、不足下限的區塊合併、過長表格列依 token 切分"""
+
+import pytest
+
+from services.semantic_chunker import SemanticChunker, is_heading
+
+
+def make_chunker(max_tokens=20, min_tokens=8):
+    # 以空白分隔的單字作為 token，方便計算預期結果
+    return SemanticChunker(lambda text: len(text.split()), str.split, " ".join,
+                           max_tokens=max_tokens, min_tokens=min_tokens)
+
+
+def words(count, start=0):
+    return " ".join(f"w{i}" for i in range(start, start + count))
+
+
+def paragraph(text, page=1):
+    return {"type": "paragraph", "text": text, "page": page}
+
+
+@pytest.mark.parametrize('line', ['1. 引言', '1、研究方法', '2) Results', '2.1 線性迴歸', '1.2. 方法',
+                                  '第二章 線性代數', '# Overview', '(一) 背景', 'Chapter 3 Vectors'])
+def test_headings(line):
+    assert is_heading(line)
+
+
+@pytest.mark.parametrize('line', ['3 apples on the table', '1.5倍的成長', '2024 年度報告摘要',
+                                  '1. 這是一個完整的句子。'])
+def test_not_headings(line):
+    assert not is_heading(line)
+
+
+def test_short_chunk_is_topped_up_from_next_paragraph():
+    first = words(4) + "."
+    second = ". ".join(words(5, start=10 + 5 * i) for i in range(4)) + "."
+    chunks = make_chunker().chunk([paragraph(first), paragraph(second)])
+
+    assert all(chunk['token_count'] >= 8 for chunk in chunks)
+    assert all(chunk['token_count'] <= 20 for chunk in chunks)
+    assert " ".join(chunk['content'] for chunk in chunks).split() == (first + " " + second).split()
+
+
+def test_short_tail_merges_within_section():
+    blocks = [
+        {"type": "heading", "text": "1. 引言", "page": 1},
+        paragraph(words(14)), paragraph(words(14, start=20)), paragraph(words(3, start=40), page=2),
+        {"type": "heading", "text": "2. 方法", "page": 2},
+        paragraph(words(3, start=50), page=2),
+    ]
+    chunks = make_chunker().chunk(blocks)
+
+    assert [chunk['token_count'] for chunk in chunks] == [14, 17, 3]
+    assert chunks[1]['page_end'] == 2
+    # 不跨章節合併
+    assert chunks[2]['section'] == '2. 方法'
+    assert [chunk['chunk_index'] for chunk in chunks] == [0, 1, 2]
+
+
+def test_oversized_table_row_is_split():
+    header = "name | value"
+    rows = [header, "a | 1", words(50), "b | 2"]
+    chunks = make_chunker().chunk([{"type": "table", "rows": rows, "page": 3}])
+
+    assert all(chunk['token_count'] <= 20 for chunk in chunks)
+    assert all(chunk['content'].startswith(header) for chunk in chunks)
+    body = " ".join(chunk['content'].replace(header, '') for chunk in chunks)
+    assert words(50) in " ".join(body.split())
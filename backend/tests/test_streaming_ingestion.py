@@ -0,0 +1,117 @@
+"""串流攝取：全文與區塊和批次模式相同、串流結束後去重、失敗時清除部分嵌入"""
+
+import pytest
+
+from services import document_processor as processor_module
+from services.document_processor import DocumentProcessor, join_pages, strip_pieces
+from services.ingestion_pipeline import IngestionPipeline
+
+from conftest import sample_text
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    from services import ingestion_pipeline
+    monkeypatch.setattr(ingestion_pipeline, 'STREAM_BATCH_SIZE', 2)
+    monkeypatch.setenv('EMBEDDING_WRITE_RETRIES', '0')
+
+
+def batch_chunks(processor, pages):
+    text, offsets = join_pages(pages)
+    chunks = processor.split_text_into_chunks(text)
+    processor.assign_pages(chunks, text, offsets)
+    return text, chunks
+
+
+def stream_chunks(processor, pieces):
+    texts = []
+
+    def tee():
+        for page_number, text in strip_pieces(pieces):
+            texts.append(text)
+            yield page_number, text
+
+    chunks = list(processor.iter_chunks(tee()))
+    return "".join(texts), chunks
+
+
+def test_txt_stream_matches_batch(text_file, monkeypatch):
+    monkeypatch.setattr(processor_module, 'TXT_STREAM_BLOCK_CHARS', 500)
+    path = text_file("\n  " + sample_text(60) + "\n\n \n")
+    processor = DocumentProcessor()
+
+    text, expected = batch_chunks(processor, processor.extract_pages(path))
+    streamed_text, chunks = stream_chunks(processor, processor.iter_pages(path))
+
+    assert streamed_text == text
+    assert chunks == expected
+    # 最後一個起點落在前一區塊的重疊內，兩種模式都保留
+    assert chunks[-1]['end_token'] == chunks[-2]['end_token']
+
+
+def test_pdf_pages_match_batch():
+    processor = DocumentProcessor()
+    processor.chunk_size, processor.chunk_overlap = 40, 10
+    pages = ["  \n", sample_text(3, seed=1), "", sample_text(2, seed=2) + "\n ", sample_text(4, seed=3)]
+    # iter_pages 對 PDF 只產生有文字的頁面，每頁附加分頁空行
+    pieces = [(number, page + "\n\n") for number, page in enumerate(pages, start=1) if page]
+
+    text, expected = batch_chunks(processor, pages)
+    streamed_text, chunks = stream_chunks(processor, pieces)
+
+    assert streamed_text == text
+    assert chunks == expected
+    assert {chunk['page_start'] for chunk in chunks} >= {2, 4, 5}
+
+
+def test_streaming_full_text_matches_batch(rag_service, text_file):
+    text = sample_text(40) + "\n"
+    IngestionPipeline(streaming=True).run('doc-a', text_file(text))
+
+    assert rag_service.get_full_text('doc-a') == text.strip()
+
+
+def test_streaming_dedups_after_stream(rag_service, fake_supabase, text_file):
+    text = sample_text(30)
+    IngestionPipeline(use_supabase=True).run('doc-a', text_file(text, 'a.txt'), {'file_hash': 'a'})
+    context = IngestionPipeline(use_supabase=True, streaming=True).run(
+        'doc-b', text_file(text + "\n", 'b.txt'), {'file_hash': 'b'}
+    )
+
+    assert context.duplicate['content_document_id'] == 'doc-a'
+    assert fake_supabase.rows_for('doc-b') == []
+    assert fake_supabase.documents['doc-b']['status'] == 'ready'
+    assert fake_supabase.documents['doc-b']['content_document_id'] == 'doc-a'
+    assert rag_service.get_full_text('doc-b') == text
+    assert not rag_service.index_store.has_text('doc-b')
+
+
+def test_streaming_write_error_marks_degraded_and_deletes_rows(rag_service, fake_supabase, text_file):
+    upsert_embeddings = fake_supabase.upsert_embeddings
+
+    def fail_after_first_batch(rows):
+        if fake_supabase.embeddings:
+            raise RuntimeError('connection reset')
+        return upsert_embeddings(rows)
+
+    fake_supabase.upsert_embeddings = fail_after_first_batch
+    context = IngestionPipeline(use_supabase=True, streaming=True).run('doc-a', text_file(sample_text(60)))
+
+    assert context.write_error == 'connection reset'
+    assert fake_supabase.documents['doc-a']['status'] == 'degraded'
+    assert fake_supabase.rows_for('doc-a') == []
+
+
+def test_streaming_extract_error_cleans_up(rag_service, fake_supabase, text_file, monkeypatch):
+    def broken_pages(self, file_path):
+        yield 1, sample_text(60)
+        raise RuntimeError('corrupt page')
+
+    monkeypatch.setattr(DocumentProcessor, 'iter_pages', broken_pages)
+    with pytest.raises(RuntimeError):
+        IngestionPipeline(use_supabase=True, streaming=True).run('doc-a', text_file('unused'))
+
+    assert fake_supabase.documents['doc-a']['status'] == 'failed'
+    assert fake_supabase.documents['doc-a']['error'] == 'corrupt page'
+    assert fake_supabase.rows_for('doc-a') == []
+    assert not rag_service.is_document_indexed('doc-a')
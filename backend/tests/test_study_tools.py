@@ -0,0 +1,137 @@
+"""學習工具生成快取：快取來源與記錄 ID 一併返回，記憶體命中沿用已保存的記錄 ID"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+from routes import study_tools
+from services import groq_service as groq_module
+
+
+QUIZ = {'quiz_title': '測驗', 'questions': [{'id': 1, 'question': '什麼是梯度下降？'}]}
+
+
+@pytest.fixture
+def groq_service(monkeypatch):
+    monkeypatch.setenv('GROQ_API_KEY', 'test-key')
+    monkeypatch.setattr(groq_module, '_groq_service', None)
+    service = groq_module.get_groq_service()
+    calls = []
+
+    def fake_llm(system_prompt, user_prompt, temperature=0.7):
+        calls.append(user_prompt)
+        return json.dumps(QUIZ, ensure_ascii=False)
+
+    monkeypatch.setattr(service, '_call_llm', fake_llm)
+    service.llm_calls = calls
+    return service
+
+
+@pytest.fixture
+def client(groq_service, monkeypatch):
+    class Documents:
+        def is_document_indexed(self, doc_id):
+            return True
+
+        def get_full_text(self, doc_id):
+            return '梯度下降是一種最佳化方法。'
+
+    monkeypatch.setattr(study_tools, 'get_rag_service', Documents)
+    app = Flask(__name__)
+    app.register_blueprint(study_tools.study_tools_bp, url_prefix='/api/study')
+    return app.test_client()
+
+
+def test_memory_hit_keeps_record_id(client, groq_service):
+    first = client.post('/api/study/quiz/doc-a', json={}).get_json()
+    second = client.post('/api/study/quiz/doc-a', json={}).get_json()
+
+    assert first['cache_source'] is None and first['quiz_id']
+    assert second['cache_source'] == 'memory'
+    assert second['quiz_id'] == first['quiz_id']
+    assert second['quiz'] == QUIZ
+    assert len(groq_service.llm_calls) == 1
+
+
+def test_database_hit_is_cached_with_its_id(client, groq_service, monkeypatch):
+    lookups = []
+
+    def find_record(table, doc_id, cache_key):
+        lookups.append(table)
+        return {'id': 'quiz-1', 'title': QUIZ['quiz_title'], 'questions': QUIZ['questions']}
+
+    monkeypatch.setattr(study_tools, '_find_cached_record', find_record)
+    first = client.post('/api/study/quiz/doc-a', json={}).get_json()
+    second = client.post('/api/study/quiz/doc-a', json={}).get_json()
+
+    assert (first['cache_source'], first['quiz_id']) == ('database', 'quiz-1')
+    assert (second['cache_source'], second['quiz_id']) == ('memory', 'quiz-1')
+    assert lookups == ['quizzes']
+    assert groq_service.llm_calls == []
+
+
+def test_force_regenerate_skips_cache(client, groq_service):
+    first = client.post('/api/study/quiz/doc-a', json={}).get_json()
+    forced = client.post('/api/study/quiz/doc-a', json={'force_regenerate': True}).get_json()
+
+    assert forced['cache_source'] is None
+    assert forced['quiz_id'] != first['quiz_id']
+    assert len(groq_service.llm_calls) == 2
+    # 重新生成的結果取代快取，之後的命中返回新記錄 ID
+    assert client.post('/api/study/quiz/doc-a', json={}).get_json()['quiz_id'] == forced['quiz_id']
+
+
+@pytest.fixture
+def saved_quizzes(monkeypatch):
+    """以記憶體列表模擬 quizzes 表（save_quiz / find_generation）"""
+    rows = []
+
+    class Supabase:
+        def save_quiz(self, row):
+            rows.append(row)
+
+        def find_generation(self, table, doc_id, cache_key):
+            matches = [row for row in rows
+                       if row['document_id'] == doc_id and row['settings']['cache_key'] == cache_key]
+            return SimpleNamespace(data=matches[-1:])
+
+    monkeypatch.setattr(study_tools, 'USE_SUPABASE', True)
+    monkeypatch.setattr(study_tools, 'get_supabase', Supabase)
+    return rows
+
+
+def test_unparsable_reply_is_not_saved_or_cached(client, groq_service, saved_quizzes, monkeypatch):
+    replies = ['這不是 JSON', json.dumps(QUIZ, ensure_ascii=False)]
+    monkeypatch.setattr(groq_service, '_call_llm', lambda *args, **kwargs: replies.pop(0))
+
+    failed = client.post('/api/study/quiz/doc-a', json={}).get_json()
+    assert failed['quiz']['error'] and failed['quiz_id'] is None
+    assert saved_quizzes == []
+
+    retried = client.post('/api/study/quiz/doc-a', json={}).get_json()
+    assert retried['cache_source'] is None
+    assert retried['quiz'] == QUIZ
+    assert [row['id'] for row in saved_quizzes] == [retried['quiz_id']]
+
+
+def test_empty_saved_record_is_not_a_cache_hit(client, groq_service, monkeypatch):
+    monkeypatch.setattr(study_tools, '_find_cached_record', lambda table, doc_id, cache_key: {
+        'id': 'quiz-bad', 'title': '自動生成測驗', 'questions': []
+    })
+    response = client.post('/api/study/quiz/doc-a', json={}).get_json()
+
+    assert response['cache_source'] is None
+    assert response['quiz_id'] != 'quiz-bad'
+    assert len(groq_service.llm_calls) == 1
+
+
+def test_same_content_documents_keep_their_own_records(client, groq_service, saved_quizzes):
+    first = client.post('/api/study/quiz/doc-a', json={}).get_json()
+    second = client.post('/api/study/quiz/doc-b', json={}).get_json()
+
+    assert second['cache_source'] is None
+    assert second['quiz_id'] != first['quiz_id']
+    assert [row['document_id'] for row in saved_quizzes] == ['doc-a', 'doc-b']
+    assert client.post('/api/study/quiz/doc-b', json={}).get_json()['quiz_id'] == second['quiz_id']
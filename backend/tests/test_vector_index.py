@@ -0,0 +1,52 @@
+"""單文件索引：小文件維持 Flat、量化索引的全精度向量 mmap 隨索引快取"""
+
+import pytest
+
+from services import vector_index
+from services.ingestion_pipeline import IngestionPipeline
+from services.vector_index import choose_index_type
+
+from conftest import sample_text
+
+
+def test_quantization_only_above_threshold(monkeypatch):
+    monkeypatch.setattr(vector_index, 'VECTOR_QUANTIZATION', 'sq8')
+
+    assert choose_index_type(100, 'auto') == 'flat'
+    assert choose_index_type(vector_index.FLAT_MAX_VECTORS, 'auto') == 'flat'
+    assert choose_index_type(vector_index.FLAT_MAX_VECTORS + 1, 'auto') == 'hnsw_sq8'
+    # 明確指定的類型不受門檻影響
+    assert choose_index_type(100, 'sq8') == 'sq8'
+
+
+@pytest.fixture
+def quantized_document(rag_service, text_file, monkeypatch):
+    monkeypatch.setattr(vector_index, 'QUANTIZE_MIN_VECTORS', 0)
+    context = IngestionPipeline().run('doc-a', text_file(sample_text(40)))
+    assert context.index_result['index_type'] == 'sq8'
+
+    loads = []
+    load_vectors = rag_service.index_store.load_vectors
+
+    def counting_load(doc_id):
+        loads.append(doc_id)
+        return load_vectors(doc_id)
+
+    monkeypatch.setattr(rag_service.index_store, 'load_vectors', counting_load)
+    return context, loads
+
+
+def test_vectors_memmap_is_cached(rag_service, quantized_document):
+    context, loads = quantized_document
+    target = context.chunks[3]
+
+    for _ in range(3):
+        results = rag_service.search('doc-a', target['content'], top_k=2)
+        assert results[0]['chunk_index'] == 3
+    assert loads == []
+
+    # 索引被淘汰後重新載入時才再開啟一次
+    rag_service.index_cache.pop('doc-a')
+    for _ in range(3):
+        rag_service.search('doc-a', target['content'], top_k=2)
+    assert loads == ['doc-a']
@@ -55,11 +55,11 @@ function DocumentCard({ document, onDelete }) {
       <div className="mt-6 flex items-center justify-between relative z-10">
         <div className="flex items-center gap-2">
           <span className={`px-2.5 py-1 rounded-lg text-xs font-medium border ${
-            document.status === 'ready'
+            document.status === 'ready' || document.status === 'degraded'
               ? 'bg-emerald-100 dark:bg-emerald-500/10 text-emerald-700 dark:text-emerald-400 border-emerald-200 dark:border-emerald-500/20'
               : 'bg-yellow-100 dark:bg-yellow-500/10 text-yellow-700 dark:text-yellow-400 border-yellow-200 dark:border-yellow-500/20'
           }`}>
-            {document.status === 'ready' ? '就緒' : '處理中'}
+            {document.status === 'ready' ? '就緒' : document.status === 'degraded' ? '就緒（未同步）' : '處理中'}
           </span>
           <span className="text-xs text-slate-500">
             {document.total_chunks} 塊區段
@@ -52,8 +52,11 @@ function DocumentPage() {
     setAsking(true);
     setAnswer(null);
     try {
-      const result = await studyApi.askQuestion(docId, question);
-      setAnswer(result);
+      // 來源先到，回答隨 token 逐步顯示
+      await studyApi.askQuestionStream(docId, question, {
+        onSources: (result) => setAnswer({ ...result, answer: '' }),
+        onToken: (_, text) => setAnswer((prev) => ({ ...prev, answer: text })),
+      });
     } catch (error) {
       console.error('Failed to get answer:', error);
       toast.error('Neural uplink failed');
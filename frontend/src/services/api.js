@@ -2,6 +2,12 @@ import axios from 'axios';
 
 const API_BASE_URL = '/api';
 
+// 上傳後輪詢處理狀態的間隔（毫秒）與最長等待時間（超過後放棄輪詢）
+const STATUS_POLL_INTERVAL = 1000;
+const STATUS_POLL_TIMEOUT = 10 * 60 * 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 const api = axios.create({
   baseURL: API_BASE_URL,
   headers: {
@@ -11,7 +17,7 @@ const api = axios.create({
 
 // Document APIs
 export const documentApi = {
-  // 上傳文件
+  // 上傳文件（後端返回 202 後輪詢狀態直到處理完成）
   upload: async (file) => {
     const formData = new FormData();
     formData.append('file', file);
@@ -20,6 +26,35 @@ export const documentApi = {
         'Content-Type': 'multipart/form-data',
       },
     });
+
+    const docId = response.data.document?.id;
+    if (response.status !== 202 || !docId) {
+      return response.data;
+    }
+
+    const maxAttempts = Math.ceil(STATUS_POLL_TIMEOUT / STATUS_POLL_INTERVAL);
+    for (let attempt = 0; attempt < maxAttempts; attempt++) {
+      await sleep(STATUS_POLL_INTERVAL);
+      const status = await documentApi.status(docId);
+      // degraded：已建立索引可使用，只是未能保存到 Supabase
+      if (status.status === 'ready' || status.status === 'degraded') {
+        return { ...response.data, document: status.document || response.data.document };
+      }
+      if (status.status === 'failed') {
+        const error = new Error(status.error || 'Document processing failed');
+        error.response = { data: { error: error.message } };
+        throw error;
+      }
+    }
+
+    const error = new Error('Document processing timed out');
+    error.response = { data: { error: error.message } };
+    throw error;
+  },
+
+  // 查詢處理狀態
+  status: async (docId) => {
+    const response = await api.get(`/documents/${docId}/status`);
     return response.data;
   },
 
@@ -92,6 +127,60 @@ export const studyApi = {
     return response.data;
   },
 
+  // 串流問答（SSE）：先回呼 onSources，再逐段回呼 onToken，返回完整回答
+  askQuestionStream: async (docId, question, { onSources, onToken } = {}) => {
+    const response = await fetch(`${API_BASE_URL}/study/ask/${docId}`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Accept: 'text/event-stream',
+      },
+      body: JSON.stringify({ question, stream: true }),
+    });
+
+    if (!response.ok || !response.body) {
+      const data = await response.json().catch(() => ({}));
+      const error = new Error(data.error || 'Failed to get answer');
+      error.response = { data };
+      throw error;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // 事件以空行分隔
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = 'message';
+        let data = '';
+        for (const line of raw.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) data += line.slice(5).trim();
+        }
+        const payload = data ? JSON.parse(data) : {};
+
+        if (event === 'sources') onSources?.(payload);
+        else if (event === 'token') {
+          answer += payload.content;
+          onToken?.(payload.content, answer);
+        } else if (event === 'done') answer = payload.answer;
+        else if (event === 'error') throw new Error(payload.error);
+      }
+    }
+
+    return answer;
+  },
+
   // 搜索
   search: async (docId, query, topK = 5) => {
     const response = await api.post(`/study/search/${docId}`, { query, top_k: topK });
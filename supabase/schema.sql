@@ -15,6 +15,10 @@ CREATE TABLE IF NOT EXISTS documents (
     total_tokens INTEGER,
     total_chunks INTEGER,
     status TEXT DEFAULT 'processing',
+    file_hash TEXT,            -- SHA-256 of the uploaded bytes (dedup)
+    text_hash TEXT,            -- SHA-256 of the normalized extracted text (dedup)
+    content_document_id UUID,  -- Duplicate uploads point at the document that owns the chunks/embeddings
+    error TEXT,                -- Failure reason when status = 'failed' or 'degraded' (indexed locally, not saved)
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -25,7 +29,9 @@ CREATE TABLE IF NOT EXISTS document_embeddings (
     document_id UUID REFERENCES documents(id) ON DELETE CASCADE,
     content TEXT NOT NULL,
     chunk_index INTEGER NOT NULL,
-    embedding vector(768), -- Dimension for text2vec-base-chinese (768維中文嵌入模型)
+    start_byte INTEGER, -- Byte range of the chunk in the extracted text, used to rebuild the text exactly
+    end_byte INTEGER,
+    embedding halfvec(768), -- Dimension for text2vec-base-chinese (768維中文嵌入模型，float16 儲存)
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
@@ -45,6 +51,7 @@ CREATE TABLE IF NOT EXISTS flashcards (
     document_id UUID REFERENCES documents(id) ON DELETE CASCADE,
     deck_title TEXT NOT NULL,
     cards JSONB NOT NULL,
+    settings JSONB,
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
@@ -56,23 +63,66 @@ CREATE TABLE IF NOT EXISTS summaries (
     tldr TEXT NOT NULL,
     key_points JSONB NOT NULL,
     keywords JSONB,
+    settings JSONB,
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
--- Create index for vector similarity search
-CREATE INDEX IF NOT EXISTS document_embeddings_embedding_idx 
-ON document_embeddings 
-USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+-- Upgrade existing databases: store embeddings as halfvec (requires pgvector >= 0.7)
+-- 舊的 ivfflat 索引建立在 vector 欄位上，需先移除
+DROP INDEX IF EXISTS document_embeddings_embedding_idx;
+DO $$
+BEGIN
+    IF (SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = 'document_embeddings'::regclass AND attname = 'embedding') = 'vector(768)' THEN
+        ALTER TABLE document_embeddings ALTER COLUMN embedding TYPE halfvec(768) USING embedding::halfvec(768);
+    END IF;
+END;
+$$;
+
+-- match_documents 在單一文件內精確排序，不使用全表的近似索引；
+-- 舊版建立的二值量化 HNSW 索引只會拖慢寫入
+DROP INDEX IF EXISTS document_embeddings_embedding_bq_idx;
+
+-- Upgrade existing databases: deduplication columns
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS file_hash TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS text_hash TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_document_id UUID;
+
+-- Upgrade existing databases: chunk byte offsets for exact full-text reconstruction
+ALTER TABLE document_embeddings ADD COLUMN IF NOT EXISTS start_byte INTEGER;
+ALTER TABLE document_embeddings ADD COLUMN IF NOT EXISTS end_byte INTEGER;
+
+-- Upgrade existing databases: failure reason for status = 'failed'
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS error TEXT;
+
+-- Upgrade existing databases: generation settings (includes the cache_key used for result caching)
+ALTER TABLE flashcards ADD COLUMN IF NOT EXISTS settings JSONB;
+ALTER TABLE summaries ADD COLUMN IF NOT EXISTS settings JSONB;
+
+-- Create indexes for duplicate lookups
+CREATE INDEX IF NOT EXISTS documents_file_hash_idx ON documents(file_hash);
+CREATE INDEX IF NOT EXISTS documents_text_hash_idx ON documents(text_hash);
+
+-- Create indexes for cached generation lookups
+CREATE INDEX IF NOT EXISTS quizzes_cache_key_idx ON quizzes(document_id, (settings->>'cache_key'));
+CREATE INDEX IF NOT EXISTS flashcards_cache_key_idx ON flashcards(document_id, (settings->>'cache_key'));
+CREATE INDEX IF NOT EXISTS summaries_cache_key_idx ON summaries(document_id, (settings->>'cache_key'));
 
 -- Create index for document lookups
 CREATE INDEX IF NOT EXISTS document_embeddings_document_id_idx 
 ON document_embeddings(document_id);
 
+-- One row per chunk: batched embedding writes upsert on (document_id, chunk_index) so retries are idempotent
+CREATE UNIQUE INDEX IF NOT EXISTS document_embeddings_document_chunk_idx
+ON document_embeddings(document_id, chunk_index);
+
 -- Function to match documents using vector similarity
--- 使用餘弦距離 (<=> operator) 進行向量相似度搜索
+-- 查詢限定單一文件：經 document_id 索引取出該文件的區塊，以 halfvec 餘弦距離 (<=> operator) 精確排序。
+-- 全表的近似索引（HNSW）會在套用 document_id 篩選前就截斷候選，小文件可能只剩少數甚至沒有結果；
+-- 單一文件的區塊數有限，逐列計算距離即可得到完整的召回
+DROP FUNCTION IF EXISTS match_documents(vector, INT, UUID);
 CREATE OR REPLACE FUNCTION match_documents(
-    query_embedding vector(768),
+    query_embedding halfvec(768),
     match_count INT,
     filter_doc_id UUID
 )
@@ -98,6 +148,22 @@ BEGIN
 END;
 $$;
 
+-- Function to hand the chunks/embeddings of a deleted document to one of its duplicates
+-- 擁有內容的文件被刪除時，在同一交易中將嵌入與其他重複文件的參照轉移給新的內容來源
+CREATE OR REPLACE FUNCTION transfer_document_content(
+    old_document_id UUID,
+    new_document_id UUID
+)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE document_embeddings SET document_id = new_document_id WHERE document_id = old_document_id;
+    UPDATE documents SET content_document_id = NULL WHERE id = new_document_id;
+    UPDATE documents SET content_document_id = new_document_id WHERE content_document_id = old_document_id;
+END;
+$$;
+
 -- Row Level Security (RLS) Policies
 ALTER TABLE documents ENABLE ROW LEVEL SECURITY;
 ALTER TABLE document_embeddings ENABLE ROW LEVEL SECURITY;